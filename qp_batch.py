@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+"""Headless batch runner for QP Checker.
+
+Walks a directory tree and runs the QPChecker stages (rename, value
+relation rename, styles, base layer order and value relation sources) on
+every QGS/QGZ project found, without a GUI or iface.
+
+From the QGIS plugins folder, with the QGIS Python environment active::
+
+    python -m qp_checker.qp_batch ROOT --qml QML_FOLDER
+
+or from Python::
+
+    from qp_checker.qp_batch import check_directory
+    report = check_directory(root, qml_folder)
+    print(report.summary())
+
+Pass --workers N (or workers=N) to spread the projects over N processes.
+Each worker starts its own QgsApplication once and then checks a stream
+of project paths, sending the results back to the parent over a queue.
+
+--fast-load reads the projects without opening their layer data; only
+the layers that are styled or repointed get a data provider.
+
+--engine xml applies the same rules to the project XML directly (see
+qp_xml.py). It does not start QGIS, so it also runs on machines without a
+QGIS install.
+
+--progress shows the progress of the project being checked on stderr;
+it is meant for runs with a single worker. When stderr is not a terminal
+the progress is logged at INFO instead (see --log-json).
+
+--dry-run REPORT.csv only plans the layer renames and writes them to a
+CSV report; no project or CSV is touched.
+
+--log-json EVENTS.jsonl writes the log records of every project, stamped
+with the project path, as JSON lines; --log-level sets the threshold
+(WARNING by default, DEBUG logs every rename and source change).
+
+--metrics DIR writes the stage timings and operation counts of every
+project (see qp_metrics.py) as a JSON file in DIR, at the path of the
+project relative to ROOT with .json appended.
+
+--incremental keeps a manifest in the root folder (see qp_manifest.py) and
+skips the projects that have not changed since they were last checked
+with the same QML folder and plugin version. Editing a data file of a
+project's layers, such as its SF shapefile, makes it due again. Only
+projects that checked clean are recorded, so a project with warnings is
+checked, and its warnings shown, on every run until they are fixed.
+"""
+
+import argparse
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from collections import namedtuple
+
+from .qp_log import LOGGER, PROJECT_FILTER, JsonLinesHandler, set_level
+from .qp_manifest import Manifest, inputs_fingerprint
+from .qp_metrics import METRICS, write_metrics
+from .qp_progress import log_progress, print_progress
+from .qp_rules import write_rename_report
+
+PROJECT_EXTENSIONS = ('.qgs', '.qgz')
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+ENGINES = ('qgis', 'xml')
+
+# Outcome of checking a single project. messages holds the
+# (level, title, text) tuples the checker reported along the way; saved
+# tells whether the project file was rewritten and renames holds the
+# RenameStep tuples of its rename plan. metrics holds the stage timings
+# and operation counts, see Metrics.as_dict().
+ProjectResult = namedtuple('ProjectResult', 'path ok seconds messages saved renames metrics')
+
+
+class BatchReport:
+    """Results of a batch run together with its throughput."""
+
+    def __init__(self):
+        self.results = []
+        self.skipped = 0  # projects left alone by an incremental run
+        self.elapsed = 0.0
+        self._started = time.perf_counter()
+
+    def add(self, result):
+        """Record the result of one project."""
+        self.results.append(result)
+        self.elapsed = time.perf_counter() - self._started
+
+    @property
+    def failed(self):
+        """Results of the projects that could not be checked."""
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def saved(self):
+        """Results of the projects whose file was rewritten."""
+        return [result for result in self.results if result.saved]
+
+    @property
+    def projects_per_minute(self):
+        """Throughput of the run so far."""
+        if not self.elapsed:
+            return 0.0
+        return len(self.results) * 60.0 / self.elapsed
+
+    def summary(self):
+        """One line summary suitable for the console or a log."""
+        return (f"{len(self.results)} projects checked, {len(self.failed)} failed, "
+                f"{len(self.saved)} saved, {self.skipped} unchanged in {self.elapsed:.1f}s "
+                f"({self.projects_per_minute:.1f} projects/min)")
+
+
+def find_projects(root):
+    """Yield every QGS/QGZ project below root in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(PROJECT_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+
+def configure_logging(level='WARNING', json_path=None):
+    """Log at level and above, as JSON lines to json_path if given, else nowhere.
+
+    The results printed by the command line already show the problems of
+    every project, so without json_path the records are dropped.
+    """
+    set_level(level)
+    for handler in list(LOGGER.handlers):
+        LOGGER.removeHandler(handler)
+        handler.close()
+    LOGGER.addHandler(JsonLinesHandler(json_path) if json_path else logging.NullHandler())
+    LOGGER.propagate = False
+
+
+def configure_worker_logging(level, log_queue):
+    """Log at level and above by sending the records to the parent process through log_queue.
+
+    Only the parent writes the log file, so the records of several workers
+    never interleave in it.
+    """
+    set_level(level)
+    for handler in list(LOGGER.handlers):
+        LOGGER.removeHandler(handler)
+        handler.close()
+    LOGGER.addHandler(logging.handlers.QueueHandler(log_queue))
+    LOGGER.propagate = False
+
+
+def start_qgis():
+    """Start a headless QgsApplication, or return the one already running."""
+    from qgis.core import QgsApplication
+
+    app = QgsApplication.instance()
+    if app is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        app = QgsApplication([], False)
+        app.initQgis()
+    return app
+
+
+def create_checker(qml_folder, fast_load=False, engine='qgis', dry_run=False, progress=False,
+                   value_relation_store=None, value_relation_gpkg=False):
+    """Create a checker that runs without iface against qml_folder.
+
+    The 'qgis' engine is a QPChecker and needs a running QgsApplication;
+    the 'xml' engine is an XmlProjectChecker and does not use QGIS at all.
+    A dry_run checker only plans the layer renames. With progress the
+    stage progress is printed to stderr, or logged when stderr is not a
+    terminal. With a value_relation_store the
+    Value Relation CSVs are deployed to that shared folder instead of
+    into every project folder. With value_relation_gpkg the Value Relation
+    layers use indexed GeoPackage tables made from the CSVs.
+    """
+    if engine == 'xml':
+        from .qp_xml import XmlProjectChecker
+
+        checker = XmlProjectChecker()
+    else:
+        from .qp_checker import QPChecker
+
+        start_qgis()
+        checker = QPChecker(None)
+        checker.fast_load = fast_load
+    checker.dry_run = dry_run
+    checker.value_relation_store = value_relation_store
+    checker.value_relation_gpkg = value_relation_gpkg
+    if progress:
+        checker.progress.sinks.append(print_progress if sys.stderr.isatty() else log_progress(LOGGER))
+    checker.set_qml_folder(qml_folder)
+    return checker
+
+
+def check_one(checker, qgs_file, save=True):
+    """Run checker on qgs_file and return a ProjectResult.
+
+    Exceptions raised by a stage are reported as a failed result so that
+    one broken project does not stop the whole batch.
+    """
+    started = time.perf_counter()
+    PROJECT_FILTER.project = qgs_file
+    checker.messages = []
+    try:
+        ok = checker.check_project(qgs_file, save=save)
+    except Exception as e:
+        checker.messages.append(('critical', "Error", f"{type(e).__name__}: {e}"))
+        ok = False
+    finally:
+        checker.close_project()
+        PROJECT_FILTER.project = None
+    saved = bool(ok and checker.project_changed)
+    renames = list(checker.rename_plan or [])
+    return ProjectResult(qgs_file, ok, time.perf_counter() - started, list(checker.messages), saved, renames,
+                         METRICS.as_dict())
+
+
+def check_projects(paths, qml_folder, save=True, callback=None, fast_load=False, engine='qgis',
+                   dry_run=False, progress=False, value_relation_store=None, value_relation_gpkg=False):
+    """Check every project in paths and return a BatchReport.
+
+    callback, if given, is called with each ProjectResult as soon as the
+    project has been processed.
+    """
+    checker = create_checker(qml_folder, fast_load, engine, dry_run, progress, value_relation_store,
+                             value_relation_gpkg)
+    report = BatchReport()
+    for qgs_file in paths:
+        result = check_one(checker, qgs_file, save=save)
+        report.add(result)
+        if callback is not None:
+            callback(result)
+    return report
+
+
+def _worker(qml_folder, save, fast_load, engine, dry_run, progress, value_relation_store,
+            value_relation_gpkg, log_config, tasks, results):
+    """Worker process: start QGIS once, then check paths until told to stop.
+
+    Messages sent to results are (pid, (kind, payload)) tuples. The worker
+    sends 'ready' once its checker is set up. Every path taken from tasks
+    is announced with 'started' before it is checked and answered with
+    'done' and its ProjectResult. A None task ends the worker, which then
+    sends 'exit'. log_config holds the arguments of
+    configure_worker_logging(), if any.
+    """
+    pid = os.getpid()
+    if log_config is not None:
+        configure_worker_logging(*log_config)
+    checker = create_checker(qml_folder, fast_load, engine, dry_run, progress, value_relation_store,
+                             value_relation_gpkg)
+    results.put((pid, ('ready', None)))
+    for qgs_file in iter(tasks.get, None):
+        results.put((pid, ('started', qgs_file)))
+        results.put((pid, ('done', check_one(checker, qgs_file, save=save))))
+    results.put((pid, ('exit', None)))
+
+
+def check_projects_parallel(paths, qml_folder, workers, save=True, callback=None, fast_load=False,
+                            engine='qgis', dry_run=False, progress=False, log_config=None,
+                            value_relation_store=None, value_relation_gpkg=False):
+    """Check every project in paths using a pool of worker processes.
+
+    QgsProject.instance() is a per-process singleton, so the projects are
+    spread over workers processes that each run their own QgsApplication.
+    Results are collected in the parent in completion order. A worker that
+    dies (QGIS crashes are not unheard of) has the project it was working on
+    reported as failed; the remaining workers carry on. Projects still
+    queued when every worker is gone are reported as failed too, and if no
+    worker could even start a RuntimeError is raised after reporting them.
+    Workers do not inherit the logging setup. With log_config, the
+    arguments of configure_logging() the parent was set up with, they log
+    at the same level and send their records to the parent, whose handlers
+    write them out.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    tasks = ctx.Queue()
+    results = ctx.Queue()
+    worker_log_config = None
+    listener = None
+    if log_config is not None:
+        log_queue = ctx.Queue()
+        worker_log_config = (log_config[0], log_queue)
+        listener = logging.handlers.QueueListener(log_queue, *LOGGER.handlers, respect_handler_level=True)
+        listener.start()
+    args = (qml_folder, save, fast_load, engine, dry_run, progress, value_relation_store,
+            value_relation_gpkg, worker_log_config, tasks, results)
+    processes = [ctx.Process(target=_worker, args=args, daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    for qgs_file in paths:
+        tasks.put(qgs_file)
+    for _ in processes:
+        tasks.put(None)
+
+    def failed(qgs_file, error):
+        result = ProjectResult(qgs_file, False, 0.0, [('critical', "Error", error)], False, [], {})
+        report.add(result)
+        if callback is not None:
+            callback(result)
+
+    report = BatchReport()
+    started = 0  # workers that reported ready
+    exit_codes = []  # of the workers that died
+    in_flight = {}  # pid -> path of the project the worker is checking
+    running = {process.pid: process for process in processes}
+    while running:
+        try:
+            pid, (kind, payload) = results.get(timeout=1.0)
+        except queue.Empty:
+            for pid, process in list(running.items()):
+                if process.exitcode is not None:
+                    # Died without saying goodbye
+                    del running[pid]
+                    exit_codes.append(process.exitcode)
+                    if pid in in_flight:
+                        failed(in_flight.pop(pid), f"worker exited with code {process.exitcode}")
+            continue
+
+        if kind == 'ready':
+            started += 1
+        elif kind == 'started':
+            in_flight[pid] = payload
+        elif kind == 'done':
+            in_flight.pop(pid, None)
+            report.add(payload)
+            if callback is not None:
+                callback(payload)
+        else:
+            running.pop(pid, None)
+
+    # Projects no worker was left to take
+    while True:
+        try:
+            qgs_file = tasks.get(timeout=0.1)
+        except queue.Empty:
+            break
+        if qgs_file is not None:
+            failed(qgs_file, "not checked, every worker had exited")
+
+    for process in processes:
+        process.join()
+    if listener is not None:
+        listener.stop()  # after writing what the workers sent
+    if not started:
+        raise RuntimeError(f"No worker process could start (exit codes {exit_codes})")
+    return report
+
+
+def check_directory(root, qml_folder, save=True, callback=None, workers=1, fast_load=False,
+                    engine='qgis', incremental=False, dry_run=False, progress=False, log_config=None,
+                    value_relation_store=None, value_relation_gpkg=False):
+    """Check every QGS/QGZ project below root and return a BatchReport.
+
+    With workers > 1 the projects are checked in that many processes.
+    With incremental the projects recorded in the manifest of root as
+    checked with the current inputs are skipped, and every project that is
+    checked and saved successfully without problems is recorded.
+    Incremental runs need save.
+    A dry_run only plans the renames of every project, see ProjectResult.renames.
+    log_config is passed on to the worker processes, see check_projects_parallel().
+    value_relation_store and value_relation_gpkg choose how the Value Relation
+    CSVs are deployed, see create_checker().
+    """
+    if incremental and (dry_run or not save):
+        raise ValueError("An incremental run has to save the checked projects")
+
+    paths = find_projects(root)
+    manifest = None
+    skipped = []
+    if incremental:
+        manifest = Manifest.for_root(root)
+        options = [f"store={os.path.abspath(value_relation_store)}"] if value_relation_store else []
+        if value_relation_gpkg:
+            options.append("gpkg")
+        inputs = inputs_fingerprint(qml_folder, options=options)
+
+        def changed(paths):
+            for qgs_file in paths:
+                if manifest.is_current(qgs_file, inputs):
+                    skipped.append(qgs_file)
+                else:
+                    yield qgs_file
+
+        def record(result, report_result=callback):
+            if result.ok and not result_problems(result):
+                manifest.record(result.path, inputs)
+            if report_result is not None:
+                report_result(result)
+
+        paths = changed(paths)
+        callback = record
+
+    try:
+        if workers > 1:
+            report = check_projects_parallel(paths, qml_folder, workers, save=save, callback=callback,
+                                             fast_load=fast_load, engine=engine, dry_run=dry_run,
+                                             progress=progress, log_config=log_config,
+                                             value_relation_store=value_relation_store,
+                                             value_relation_gpkg=value_relation_gpkg)
+        else:
+            report = check_projects(paths, qml_folder, save=save, callback=callback,
+                                    fast_load=fast_load, engine=engine, dry_run=dry_run,
+                                    progress=progress, value_relation_store=value_relation_store,
+                                    value_relation_gpkg=value_relation_gpkg)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    report.skipped = len(skipped)
+    return report
+
+
+def result_problems(result):
+    """Return the warnings and errors among the messages of result."""
+    return [(level, title, text) for level, title, text in result.messages if level != 'info']
+
+
+def print_result(result):
+    """Print a one line status for result followed by its problems."""
+    status = "OK  " if result.ok else "FAIL"
+    saved = " (saved)" if result.saved else ""
+    print(f"{status} {result.seconds * 1000:8.0f} ms  {result.path}{saved}")
+    for level, title, text in result_problems(result):
+        print(f"     {title}: {text}")
+
+
+def write_project_metrics(result, root, folder):
+    """Write the metrics of result to folder, at the path of its project relative to root plus .json."""
+    path = os.path.join(folder, os.path.relpath(result.path, root) + '.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_metrics(path, dict(result.metrics, path=result.path, ok=result.ok, saved=result.saved,
+                             seconds=result.seconds))
+
+
+def main(argv=None):
+    """Command line entry point. Returns the process exit code."""
+    parser = argparse.ArgumentParser(
+        prog="qp_batch",
+        description="Run QP Checker on every QGS/QGZ project below a folder.")
+    parser.add_argument("root", help="folder that is searched for projects")
+    parser.add_argument("--qml", required=True, dest="qml_folder",
+                        help="folder with the Form 8A/8B QML files and value relation CSVs")
+    parser.add_argument("--no-save", action="store_true",
+                        help="check the projects without writing them back "
+                             "(by default only projects the check changed are rewritten)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help=f"number of worker processes (this machine has {os.cpu_count()} cores)")
+    parser.add_argument("--fast-load", action="store_true",
+                        help="read projects without opening the data of every layer")
+    parser.add_argument("--engine", choices=ENGINES, default='qgis',
+                        help="'xml' edits the project files directly without starting QGIS")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip projects unchanged since they were last checked with the same inputs")
+    parser.add_argument("--progress", action="store_true",
+                        help="show the progress of the project being checked on stderr "
+                             "(logged at INFO when stderr is not a terminal)")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default='WARNING',
+                        help="threshold of the log records written by --log-json")
+    parser.add_argument("--log-json", metavar="PATH",
+                        help="append the log records of every project to PATH as JSON lines")
+    parser.add_argument("--dry-run", metavar="REPORT", dest="dry_run_report",
+                        help="only plan the layer renames and write them to the CSV file REPORT")
+    parser.add_argument("--value-relation-store", metavar="DIR",
+                        help="deploy the Value Relation CSVs once to the shared folder DIR, in a "
+                             "folder per version, instead of copying them into every project folder")
+    parser.add_argument("--gpkg-lookups", action="store_true",
+                        help="point the Value Relation layers at indexed GeoPackage tables made from the CSVs")
+    parser.add_argument("--metrics", metavar="DIR",
+                        help="write the stage timings and operation counts of every project as JSON to DIR")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.qml_folder):
+        parser.error(f"QML folder not found: {args.qml_folder}")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.incremental and (args.no_save or args.dry_run_report):
+        parser.error("--incremental cannot be combined with --no-save or --dry-run")
+
+    dry_run = args.dry_run_report is not None
+    log_config = (args.log_level, args.log_json)
+    configure_logging(*log_config)
+
+    def callback(result):
+        print_result(result)
+        if args.metrics:
+            write_project_metrics(result, args.root, args.metrics)
+
+    try:
+        report = check_directory(args.root, args.qml_folder, save=not args.no_save and not dry_run,
+                                 callback=callback, workers=args.workers,
+                                 fast_load=args.fast_load, engine=args.engine,
+                                 incremental=args.incremental, dry_run=dry_run,
+                                 progress=args.progress, log_config=log_config,
+                                 value_relation_store=args.value_relation_store,
+                                 value_relation_gpkg=args.gpkg_lookups)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(report.summary())
+    if dry_run:
+        write_rename_report(args.dry_run_report, ((result.path, step)
+                                                  for result in report.results for step in result.renames))
+        print(f"{sum(len(result.renames) for result in report.results)} renames planned, "
+              f"see {args.dry_run_report}")
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Cache of parsed files, shared by every project checked in a process.
+
+The QML styles are large documents and the same for every project, so
+they are parsed once and reused. An entry is keyed by the path and the
+modification time and size of the file, so an edited file is parsed again
+on the next lookup.
+"""
+
+import os
+import threading
+
+
+class FileCache:
+    """Parsed files by path, reparsed when the file changes.
+
+    loader is called with the path of a file and returns its parsed form.
+    Values are shared between callers and must not be modified.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._entries = {}  # path -> ((mtime_ns, size), value)
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Return the parsed form of path, parsing it only if it changed.
+
+        Errors of os.stat() and of the loader are passed on; failed loads
+        are not cached.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        value = self.loader(path)
+        with self._lock:
+            self._entries[path] = (version, value)
+        return value
+
+    def clear(self):
+        """Forget every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,8 +1,61 @@
+import logging
 import os
-import shutil  # Make sure to import shutil at the top of your file
-from qgis.core import QgsProject, QgsSettings, QgsLayerTreeLayer, QgsVectorDataProvider,QgsVectorLayer,QgsLayerTreeGroup
-from qgis.PyQt.QtWidgets import QAction, QFileDialog, QDialog, QVBoxLayout, QPushButton, QLabel, QProgressBar, QMessageBox
+import xml.etree.ElementTree as ET
+from qgis.core import QgsApplication, QgsMessageLog, Qgis, QgsProject, QgsSettings, QgsLayerTreeLayer, QgsVectorDataProvider,QgsVectorLayer,QgsLayerTreeGroup
+from qgis.PyQt.QtWidgets import QAction, QCheckBox, QFileDialog, QDialog, QVBoxLayout, QPushButton, QLabel, QProgressBar, QMessageBox
 from qgis.PyQt.QtGui import QIcon
+from qgis.PyQt.QtXml import QDomDocument
+
+from .qp_cache import FileCache
+from .qp_deploy import deploy_value_relation_csv, same_source, source_path
+from .qp_domains import domain_rules
+from .qp_gpkg import LOOKUP_ERRORS, lookup_gpkg_source
+from .qp_log import LOGGER, NOTIFY_LEVELS, RingBufferHandler, set_level
+from .qp_metrics import (
+    COUNT_RENAMES, COUNT_SOURCE_CHANGES, COUNT_STYLES, COUNT_TREE_INSERTS, COUNT_TREE_REMOVES, METRICS)
+from .qp_progress import ProgressReporter
+from .qp_qa import (
+    PolygonLocator, attribute_violations, canceled, duplicate_points, join_points, layer_source, polygon_parents)
+from .qp_project_io import project_xml_equal, read_project_xml, replace_file, temporary_sibling
+from .qp_rules import (
+    BASE_LAYER_GROUP_NAMES, CONTAINMENT_LEVELS, CONTAINMENT_POINTS, DUPLICATE_TOLERANCE, FORM_GROUP_MARKER,
+    GP_CSV_DEST_NAME, GP_CSV_SOURCE_NAME, GP_QML_NAME, SF_CSV_DEST_NAME, SF_CSV_SOURCE_NAME, SF_QML_NAME,
+    RULES_FILE_NAME, VALUE_RELATION_GP, VALUE_RELATION_GROUP_NAMES, VALUE_RELATION_SF, RenamePlan,
+    RenameRules, arranged_base_layers, find_base_layer_match, is_gp_layer, is_sf_layer, plan_layer_renames,
+    plan_value_relation_renames, reorder_moves)
+from .qp_style import QML_STYLES, QML_VALUE_RELATIONS, STYLE_PROPERTY
+from .qp_task import QPCheckTask
+from .qp_tree_index import LayerTreeIndex
+
+LOG_TAG = "QP Checker"  # Tab of the log messages panel
+
+
+def parse_qml_document(qml_file):
+    """Parse a QML file into a QDomDocument. Raises ValueError if it is not valid XML."""
+    with open(qml_file, 'rb') as f:
+        document = QDomDocument()
+        parsed, error, line, column = document.setContent(f.read())
+    if not parsed:
+        raise ValueError(f"line {line}: {error}")
+    return document
+
+
+# Parsed QML styles, shared by every project checked in this QGIS session
+QML_DOCUMENTS = FileCache(parse_qml_document)
+
+
+class QgsMessageLogHandler(logging.Handler):
+    """Send log records to the QP Checker tab of the QGIS log messages panel."""
+
+    LEVELS = ((logging.ERROR, Qgis.Critical), (logging.WARNING, Qgis.Warning), (logging.NOTSET, Qgis.Info))
+
+    def emit(self, record):
+        try:
+            level = next(qgis_level for threshold, qgis_level in self.LEVELS if record.levelno >= threshold)
+            QgsMessageLog.logMessage(self.format(record), LOG_TAG, level)
+        except Exception:
+            self.handleError(record)
+
 
 class QPChecker:
     def __init__(self, iface):
@@ -15,13 +68,71 @@ class QPChecker:
         self.gp_layer = None
         self.plugin_dir = os.path.dirname(__file__)
         self.qgs_file = None  # Store the selected QGS file here
+        self.progress_bar = None  # Only exists while the dialog is shown
+        self.progress = ProgressReporter()  # Stage progress, passed on to its sinks
+        self.messages = []  # Messages collected when running without iface
+        self.fast_load = False  # Read projects without opening layer data providers
+        self.collect_messages = False  # Record messages instead of showing them (background task)
+        self.value_relation_sources = None  # Value Relation role -> deployed CSV
+        self.value_relation_store = None  # Shared folder for the Value Relation CSVs, None for per-project copies
+        self.value_relation_gpkg = False  # Point the Value Relation layers at indexed GeoPackage tables
+        self.show_metrics = False  # Show the stage timings and counters (see qp_metrics) when a check is done
+        self.qml_styles = {}  # QML path -> parsed QDomDocument
+        self.rename_rules = RenameRules()  # Suffix rules, replaced by the QML folder's rules file
+        self.rename_plan = None  # RenamePlan of the loaded project
+        self.tree_index = None  # LayerTreeIndex of the loaded project
+        self.polygon_sources = []  # (level, LayerSource) of the containment polygons, see prepare_checks()
+        self.point_sources = []  # LayerSources of the points checked for containment
+        self.form_sources = {}  # "SF"/"GP" -> LayerSource of the form layer
+        self.transform_context = None  # of the project, for the checks off the main thread
+        self.feedback = None  # QgsFeedback of the running QPCheckTask, cancels the checks
+        self.dry_run = False  # Only plan the renames, change nothing
+        self.task = None  # Running QPCheckTask, if any
+        self.log_handlers = []  # Handlers added to LOGGER by initGui()
+        self.log_buffer = None  # RingBufferHandler with the latest records, shown with the problems of a check
+        self.restyled_layers = []  # Layers whose style changed, repainted by refresh_canvas()
+        self.save_after_check = False  # Write the project back when the check succeeds
+        self.project_changed = None  # Whether the last save rewrote the project file
         self.settings = QgsSettings()  # Initialize settings to store paths
 
         # Load previously saved QML folder path if it exists
-        self.qml_folder = self.settings.value("last_qml_folder", "")
-        if self.qml_folder:
-            self.sf_qml_file = os.path.join(self.qml_folder, "2. 2024 POPCEN-CBMS Form 8A.qml")
-            self.gp_qml_file = os.path.join(self.qml_folder, "3. 2024 POPCEN-CBMS Form 8B.qml")
+        saved_qml_folder = self.settings.value("last_qml_folder", "")
+        if saved_qml_folder:
+            self.set_qml_folder(saved_qml_folder)
+        self.value_relation_store = self.settings.value("value_relation_store", "") or None
+        self.value_relation_gpkg = self.settings.value("value_relation_gpkg", False, type=bool)
+        self.show_metrics = self.settings.value("show_metrics", False, type=bool)
+
+    def set_qml_folder(self, qml_folder):
+        """Use qml_folder as the source of the Form 8A/8B QML files and CSVs."""
+        self.qml_folder = qml_folder
+        self.sf_qml_file = os.path.join(self.qml_folder, SF_QML_NAME)
+        self.gp_qml_file = os.path.join(self.qml_folder, GP_QML_NAME)
+
+    def notify(self, level, title, text, bar=False):
+        """Show a message to the user, or record it when running headless.
+
+        level is one of 'info', 'warning' or 'critical'. Messages go to a
+        QMessageBox, or to the message bar when bar is True. Without an
+        iface (batch mode), or while a background task collects them, they
+        are appended to self.messages instead. Every message is also logged.
+        """
+        LOGGER.log(NOTIFY_LEVELS[level], "%s: %s", title, text, extra={'event': 'message'})
+        if self.iface is None or self.collect_messages:
+            self.messages.append((level, title, text))
+            return
+
+        if bar:
+            if level == 'critical':
+                self.iface.messageBar().pushCritical(title, text)
+            else:
+                self.iface.messageBar().pushWarning(title, text)
+        elif level == 'critical':
+            QMessageBox.critical(self.iface.mainWindow(), title, text)
+        elif level == 'warning':
+            QMessageBox.warning(self.iface.mainWindow(), title, text)
+        else:
+            QMessageBox.information(self.iface.mainWindow(), title, text)
 
     def initGui(self):
         """Create the plugin menu item and toolbar icon."""
@@ -32,10 +143,23 @@ class QPChecker:
         self.iface.addToolBarIcon(self.action)
         self.iface.addPluginToMenu("&QP Checker", self.action)
 
+        # Log to the log messages panel, and keep the latest records in memory
+        set_level(self.settings.value("log_level", "INFO"))
+        self.log_buffer = RingBufferHandler()
+        self.log_handlers = [QgsMessageLogHandler(), self.log_buffer]
+        for handler in self.log_handlers:
+            LOGGER.addHandler(handler)
+
     def unload(self):
         """Remove the plugin menu item and icon."""
+        if self.task is not None:
+            self.task.cancel()
+            self.refresh_canvas()
         self.iface.removeToolBarIcon(self.action)
         self.iface.removePluginMenu("&QP Checker", self.action)
+        for handler in self.log_handlers:
+            LOGGER.removeHandler(handler)
+        self.log_handlers = []
 
     def show_ui(self):
         """Show the plugin UI for selecting QML and QGS files."""        
@@ -56,8 +180,26 @@ class QPChecker:
         qgs_button.clicked.connect(self.load_qgs_project)  # Connect to load QGS project
 
         # Run button
-        run_button = QPushButton("Run")
-        run_button.clicked.connect(self.run)
+        self.run_button = QPushButton("Run")
+        self.run_button.clicked.connect(self.run)
+
+        # Save option, remembered between sessions
+        self.save_checkbox = QCheckBox("Save project when done")
+        self.save_checkbox.setChecked(self.settings.value("save_after_check", False, type=bool))
+
+        # Shared Value Relation store, remembered between sessions
+        self.store_checkbox = QCheckBox(self.value_relation_store_text())
+        self.store_checkbox.setChecked(bool(self.value_relation_store))
+        self.store_checkbox.toggled.connect(self.toggle_value_relation_store)
+        self.gpkg_checkbox = QCheckBox("Convert Value Relation CSVs to GeoPackage")
+        self.gpkg_checkbox.setChecked(self.value_relation_gpkg)
+        self.metrics_checkbox = QCheckBox("Show timings when done")
+        self.metrics_checkbox.setChecked(self.show_metrics)
+
+        # Cancel button, enabled while a check is running
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel)
 
         # Progress Bar
         self.progress_bar = QProgressBar()
@@ -70,22 +212,45 @@ class QPChecker:
         layout.addWidget(qml_button)
         layout.addWidget(self.qgs_label)
         layout.addWidget(qgs_button)
-        layout.addWidget(run_button)
+        layout.addWidget(self.save_checkbox)
+        layout.addWidget(self.store_checkbox)
+        layout.addWidget(self.gpkg_checkbox)
+        layout.addWidget(self.metrics_checkbox)
+        layout.addWidget(self.run_button)
+        layout.addWidget(self.cancel_button)
         layout.addWidget(self.progress_bar)  # Add progress bar to layout
 
         self.dialog.setLayout(layout)
-        self.dialog.exec_()  # Show the dialog as modal
+        self.dialog.show()  # Not modal: QGIS stays usable while the check runs in the background
 
     def select_qml_folder(self):
         """Open a dialog to select a folder containing QML files."""
         folder_dialog = QFileDialog()
-        self.qml_folder = folder_dialog.getExistingDirectory(None, "Select QML Folder")
-        if self.qml_folder:
-            self.sf_qml_file = os.path.join(self.qml_folder, "2. 2024 POPCEN-CBMS Form 8A.qml")
-            self.gp_qml_file = os.path.join(self.qml_folder, "3. 2024 POPCEN-CBMS Form 8B.qml")
+        qml_folder = folder_dialog.getExistingDirectory(None, "Select QML Folder")
+        if qml_folder:
+            self.set_qml_folder(qml_folder)
             self.qml_label.setText(f"Select QML Folder: {self.qml_folder}")  # Update label
             self.settings.setValue("last_qml_folder", self.qml_folder)  # Save the selected QML folder
 
+    def value_relation_store_text(self):
+        """Return the text of the shared Value Relation store checkbox."""
+        if self.value_relation_store:
+            return f"Share Value Relation CSVs: {self.value_relation_store}"
+        return "Share Value Relation CSVs in one folder"
+
+    def toggle_value_relation_store(self, checked):
+        """Ask for the shared Value Relation store when it is switched on, forget it when off."""
+        store = None
+        if checked:
+            store = QFileDialog.getExistingDirectory(None, "Select Value Relation Store") or None
+            if store is None:
+                self.store_checkbox.blockSignals(True)
+                self.store_checkbox.setChecked(False)  # Cancelled
+                self.store_checkbox.blockSignals(False)
+        self.value_relation_store = store
+        self.settings.setValue("value_relation_store", store or "")
+        self.store_checkbox.setText(self.value_relation_store_text())
+
     def load_qgs_project(self):
         """Open a dialog to select a QGS project file and store it."""        
         self.qgs_file = QFileDialog.getOpenFileName(None, "Select QGS Project", "", "QGS files (*.qgs *.qgz)")[0]
@@ -97,159 +262,419 @@ class QPChecker:
         """Run the main logic when the RUN button is clicked."""
         # Check if the QML folder has been selected
         if not self.qml_folder:
-            QMessageBox.warning(self.iface.mainWindow(), "Error", "Please select a valid QML folder.")
+            self.notify('warning', "Error", "Please select a valid QML folder.")
             return
 
         # Check if the QGS file has been selected
         if not self.qgs_file:
-            QMessageBox.warning(self.iface.mainWindow(), "Error", "Please select a QGS project file.")
+            self.notify('warning', "Error", "Please select a QGS project file.")
             return
-        
-        # Load the QGIS project
+
+        if self.task is not None:
+            return  # Already running
+
+        self.save_after_check = self.save_checkbox.isChecked()
+        self.project_changed = None
+        self.settings.setValue("save_after_check", self.save_after_check)
+        self.value_relation_gpkg = self.gpkg_checkbox.isChecked()
+        self.settings.setValue("value_relation_gpkg", self.value_relation_gpkg)
+        self.show_metrics = self.metrics_checkbox.isChecked()
+        self.settings.setValue("show_metrics", self.show_metrics)
+
+        # Run the pipeline as a background task; messages are shown when it is done
+        self.messages = []
+        self.collect_messages = True
+        if self.log_buffer is not None:
+            self.log_buffer.clear()  # Keep the records of this check only
+        self.task = QPCheckTask(self, self.qgs_file)
+        self.task.progressChanged.connect(lambda progress: self.progress_bar.setValue(int(progress)))
+        self.task.taskCompleted.connect(self.task_finished)
+        self.task.taskTerminated.connect(self.task_finished)
+        self.run_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.freeze_canvas()
+        QgsApplication.taskManager().addTask(self.task)
+
+    def cancel(self):
+        """Cancel the running check."""
+        if self.task is not None:
+            self.task.cancel()
+
+    def task_finished(self):
+        """Report the outcome of the background check and reset the dialog."""
+        task, self.task = self.task, None
+        self.collect_messages = False
+        self.clear_checks()
+        self.refresh_canvas()
+        self.run_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+
+        if task.exception is not None:
+            self.messages.append(('critical', "Error", f"QP Check failed: {task.exception}"))
+        LOGGER.info("Timings:\n%s", METRICS.summary(), extra={'event': 'metrics'})
+        problems = [f"{title}: {text}" for level, title, text in self.messages if level != 'info']
+        if problems:
+            self.show_problems("\n".join(problems))
+
+        if task.isCanceled():
+            self.notify('warning', "QP Check", "QP Check was cancelled.")
+        elif task.succeeded:
+            if self.project_changed is False:
+                text = "QP Check completed successfully! Nothing changed, the project file was left untouched."
+            else:
+                text = "QP Check completed successfully!"
+            if self.show_metrics:
+                text += f"\n\n{METRICS.summary()}"
+            self.notify('info', "Success", text)
+            self.dialog.accept()  # Close the dialog
+
+    def show_problems(self, text):
+        """Show the problems of a check, with the log records of the check as details."""
+        LOGGER.warning("QP Check: %s", text, extra={'event': 'message'})
+        box = QMessageBox(QMessageBox.Warning, "QP Check", text, QMessageBox.Ok, self.iface.mainWindow())
+        if self.log_buffer is not None:
+            box.setDetailedText("\n".join(self.log_buffer.lines()))
+        box.exec_()
+
+    def pipeline(self):
+        """Return the check stages in order as (label, weight, needs_main_thread, method).
+
+        weight is the rough share of the run time of the stage, used for the
+        progress. Stages that only read files, copy them or read features
+        through the sources taken by prepare_checks() can run on a worker
+        thread; the ones that mutate the project have to run on the
+        main thread. A stage that returns False stops the pipeline. A dry
+        run stops after planning the renames. Nothing is written next to
+        the project before it has loaded.
+        """
+        if self.dry_run:
+            return [
+                ("Reading rename rules", 1, False, self.read_rename_rules),
+                ("Loading project", 30, True, self.load_project),
+                ("Renaming layers", 10, True, self.rename_layers),
+                ("Renaming Value Relation layers", 2, True, self.rename_value_relation_layers),
+            ]
+        stages = [
+            ("Reading rename rules", 1, False, self.read_rename_rules),
+            ("Reading QML styles", 2, False, self.read_qml_styles),
+            ("Loading project", 30, True, self.load_project),
+            ("Copying Value Relation CSVs", 2, False, self.deploy_value_relation_csvs),
+            ("Renaming layers", 10, True, self.rename_layers),
+            ("Renaming Value Relation layers", 2, True, self.rename_value_relation_layers),
+            ("Applying styles", 15, True, self.apply_styles_to_layers),
+            ("Arranging base layers", 3, True, self.arrange_base_layers),
+            ("Updating Value Relation sources", 10, True, self.update_layer_sources),
+            ("Preparing checks", 1, True, self.prepare_checks),
+            ("Checking containment", 20, False, self.check_containment),
+            ("Checking duplicates", 5, False, self.check_duplicates),
+            ("Checking attribute codes", 10, False, self.check_domains),
+        ]
+        if self.save_after_check:
+            stages.append(("Saving project", 20, True, self.save_project))
+        return stages
+
+    def check_project(self, qgs_file, save=False):
+        """Load qgs_file and run every check stage on it.
+
+        This is the synchronous form of QPCheckTask, used by the headless
+        batch runner. When save is True the project is written back to
+        qgs_file afterwards if the check changed it (see save_project()).
+        Returns False if the project could not be loaded or saved.
+        """
+        self.qgs_file = qgs_file
+        self.project_changed = None
+        self.save_after_check = save and not self.dry_run
+        self.freeze_canvas()
         try:
-            QgsProject.instance().read(self.qgs_file)  # Load the QGIS project
-        except Exception as e:
-            QMessageBox.critical(self.iface.mainWindow(), "Error", f"Failed to load QGS project: {e}")
+            return self.run_pipeline()
+        finally:
+            self.refresh_canvas()
+
+    def run_pipeline(self):
+        """Run the stages of pipeline() one after the other, on this thread."""
+        stages = self.pipeline()
+        METRICS.reset()
+        self.progress.start([(label, weight) for label, weight, needs_main_thread, stage in stages])
+        for index, (label, weight, needs_main_thread, stage) in enumerate(stages):
+            self.progress.begin_stage(index)
+            with METRICS.stage(label):
+                result = stage()
+            if result is False:
+                return False
+        self.progress.finish()
+        return True
+
+    def freeze_canvas(self):
+        """Stop the map canvas from rendering while the project is half processed."""
+        self.restyled_layers = []
+        if self.iface is not None:
+            self.iface.mapCanvas().freeze(True)
+
+    def refresh_canvas(self):
+        """Unfreeze the map canvas and render it once, with the new styles.
+
+        Headless there is no canvas and nothing is rendered.
+        """
+        if self.iface is None:
             return
-
-        # Collapse base layer groups after loading the project
-        
-
-        # Proceed to rename layers, apply styles, and arrange layers
-        self.rename_layers()
-        self.rename_value_relation_layers()
-        self.apply_styles_to_layers()
-        self.arrange_base_layers()  # Call the function to arrange base layers
-        self.update_layer_sources()
-        QMessageBox.information(self.iface.mainWindow(), "Success", "QP Check completed successfully!")
-        self.dialog.accept()  # Close the dialog
+        canvas = self.iface.mapCanvas()
+        for layer in self.restyled_layers:
+            layer.triggerRepaint()  # drops its cached image; the frozen canvas does not render
+        self.restyled_layers = []
+        canvas.freeze(False)
+        canvas.refresh()
+
+    def save_project(self):
+        """Write the checked project back to self.qgs_file, if it changed.
+
+        The project is written to a temporary file next to the original, in
+        the same format, and its XML compared with the original's. When only
+        the save stamp differs the temporary file is deleted and the
+        original left untouched; otherwise it is moved over the original in
+        one step. Returns False if the project could not be written.
+        """
+        self.project_changed = None
+        project = QgsProject.instance()
+        temp_file = temporary_sibling(self.qgs_file)
+        try:
+            written = project.write(temp_file)
+        finally:
+            project.setFileName(self.qgs_file)  # write() adopts the name it was given
+        try:
+            if not written:
+                self.notify('critical', "Error", f"Failed to save QGS project: {project.error()}")
+                return False
+            self.project_changed = not project_xml_equal(read_project_xml(self.qgs_file),
+                                                         read_project_xml(temp_file))
+            if self.project_changed:
+                replace_file(temp_file, self.qgs_file)
+                LOGGER.info("Saved %s", self.qgs_file, extra={'event': 'save'})
+            else:
+                LOGGER.info("No changes, %s left untouched", self.qgs_file, extra={'event': 'unchanged'})
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        project.setDirty(False)
+        return True
+
+    def load_project(self):
+        """Read self.qgs_file into the current project. Returns False on failure."""
+        self.sf_layer = None
+        self.gp_layer = None
+        self.rename_plan = None
+        self.close_tree_index()
+        try:
+            loaded = self.read_project()  # Load the QGIS project
+        except Exception as e:
+            self.notify('critical', "Error", f"Failed to load QGS project: {e}")
+            return False
+        if not loaded:
+            self.notify('critical', "Error", f"Failed to load QGS project: {QgsProject.instance().error()}")
+            return False
+        self.rename_plan = RenamePlan({layer_id: layer.name()
+                                       for layer_id, layer in QgsProject.instance().mapLayers().items()})
+        self.tree_index = LayerTreeIndex(QgsProject.instance().layerTreeRoot())
+        return True
+
+    def close_tree_index(self):
+        """Stop maintaining the layer tree index of the previous project."""
+        if self.tree_index is not None:
+            self.tree_index.close()
+            self.tree_index = None
+
+    def close_project(self):
+        """Clear the current project once a headless check is done with it."""
+        self.close_tree_index()
+        self.clear_checks()
+        QgsProject.instance().clear()
+
+    def read_project(self):
+        """Read self.qgs_file into the current project.
+
+        With fast_load the layers are not resolved: no shapefile, CSV or
+        raster is opened while reading. Most stages only touch names, the
+        layer tree and source strings; the few layers that need a provider
+        are opened on demand with ensure_layer_loaded().
+        """
+        if not self.fast_load:
+            return QgsProject.instance().read(self.qgs_file)
+
+        flags = QgsProject.ReadFlags()
+        flags |= QgsProject.FlagDontResolveLayers
+        flags |= QgsProject.FlagTrustLayerMetadata
+        return QgsProject.instance().read(self.qgs_file, flags)
+
+    def ensure_layer_loaded(self, layer):
+        """Open the data provider of a layer left unresolved by a fast load.
+
+        Returns whether the layer is valid afterwards. QGIS restores the style
+        stored in the project once the layer becomes valid.
+        """
+        if layer.isValid():
+            return True
+        layer.setDataSource(layer.source(), layer.name(), layer.providerType())  # opens the provider, same source
+        return layer.isValid()
+
+    def read_rename_rules(self):
+        """Load the rename rules file of the QML folder, if it has one.
+
+        Returns False if the file is invalid, rather than renaming layers
+        with the wrong rules.
+        """
+        try:
+            self.rename_rules = RenameRules.for_folder(self.qml_folder)
+        except (OSError, ValueError) as e:
+            self.notify('critical', "Error", f"Failed to read {RULES_FILE_NAME}: {e}")
+            return False
+        return True
 
     def rename_layers(self):
-        """Rename layers based on defined suffixes and check names in 'Base Layer' group."""
-        suffixes_to_rename = {
-            'bgy': 'bgy',
-            'ea2024': 'ea',
-            'ea': 'ea',
-            'bldg': 'bldgpts',
-            'bldg_points' : 'bldgpts',
-            'landmark': 'landmark',
-            'road': 'road',
-            'road_updated': 'road',
-            'updated_road' : 'road',
-            'updated_river' : 'river',
-            'river': 'river',
-            'river_updated' : 'river',
-            'block': 'block',
-            'Block': 'block',
-            'block2024': 'block',
-        }
-
-        # Get all layers in the project and convert to a list
-        layers = list(QgsProject.instance().mapLayers().values())
-        
-        # Extract the 8-digit identifier from layers ending with '_SF' or '_SF.shp'
-        eight_digit_id = None
-        for layer in layers:
-            if layer.name().endswith(('_SF', '_SF.shp')):  # Check for both endings
-                eight_digit_id = layer.name()[:8]  # Extract the first 8 characters
-                break  # Stop after finding the first matching layer
+        """Rename layers based on defined suffixes and check names in 'Base Layer' group.
 
+        The renames are planned first (see plan_layer_renames()) and then
+        applied in one batch, unless this is a dry run.
+        """
         # Check layers in the "Base Layer" group
-        base_layer_group = None
-        for variation in ['Base Layers', 'Base layers', 'Base Layer', 'Base layer', 'base layers']:
-            base_layer_group = QgsProject.instance().layerTreeRoot().findGroup(variation)
-            if base_layer_group is not None:
-                break  # Stop searching after finding the first matching group
-
+        base_layer_group = self.tree_index.group(BASE_LAYER_GROUP_NAMES)
+        base_layer_ids = []
         if base_layer_group is not None:
-            print("Checking layers in 'Base Layer' group:")
-            for layer_tree_layer in base_layer_group.findLayers():
-                layer_name = layer_tree_layer.name()
-                print(f"Layer in 'Base Layer': {layer_name}")
-
-                # Replace the 5-digit identifier with the 8-digit identifier only if it doesn't already have one
-                if len(layer_name) >= 8 and not layer_name[:8].isdigit():  # Ensure the layer name is long enough and doesn't already start with 8 digits
-                    new_name = eight_digit_id + layer_name[5:]  # Replace the first 5 digits
-                    layer_tree_layer.layer().setName(new_name)
-                    print(f"Renamed layer to: {new_name}")
-
-        for idx, layer in enumerate(layers):
-            layer_name = layer.name()
-            renamed = False  # Flag to track if a renaming has occurred
-
-             # Rename layers ending with '_SF.shp' to '_SF' if not already named '_SF'
-            if layer_name.endswith('_SF.shp'):
-                new_name = eight_digit_id + '_SF'  # Replace '_SF.shp' with '_SF'
-                if not new_name in [layer.name() for layer in layers]:  # Check if the new name already exists
-                    layer.setName(new_name)
-                    output = f"Layer renamed to: {new_name}"
-                    renamed = True
-            
-            # Rename layers ending with '_GP.shp' to '_GP' if not already named '_GP'
-            elif layer_name.endswith('_GP.shp'):
-                new_name = eight_digit_id + '_GP'  # Replace '_GP.shp' with '_GP'
-                if not new_name in [layer.name() for layer in layers]:  # Check if the new name already exists
-                    layer.setName(new_name)
-                    output = f"Layer renamed to: {new_name}"
-                    renamed = True
-            
-            for suffix, new_suffix in suffixes_to_rename.items():
-                if suffix in layer_name and not layer_name.endswith(new_suffix):
-                    # Rename the layer to the new suffix
-                    new_name = layer_name.split(suffix)[0] + new_suffix
-                    layer.setName(new_name)
-                    output = f"Layer renamed to: {new_name}"
-                    renamed = True
-                    break  # Break after renaming for this layer
-            
-            if not renamed:
-                output = f"No renaming needed for layer: {layer_name}"
-            
-            print(output)
-
-            # Update progress bar
-            self.progress_bar.setValue((idx + 1) * 100 // len(layers))
+            base_layer_ids = [node.layerId() for node in self.tree_index.layers(base_layer_group)
+                              if node.layerId() in self.rename_plan.names]
+
+        first_step = len(self.rename_plan)
+        plan_layer_renames(self.rename_plan, base_layer_ids, self.rename_rules)
+        self.apply_rename_steps(self.rename_plan.steps[first_step:])
+
+    def apply_rename_steps(self, steps):
+        """Rename the layers of the rename plan steps in one batch.
+
+        The layer tree root does not pass the name changes on while the
+        layers are renamed, so the layer tree view is not updated once per
+        layer. Afterwards only the rows of the renamed layers are repainted;
+        the rest of the model, with the expanded groups and the selection,
+        is left alone. Nothing is renamed in a dry run.
+        """
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            for step in steps:
+                LOGGER.debug("Layer %r renamed to %r (%s)", step.old_name, step.new_name, step.reason,
+                             extra={'event': 'rename', 'layer': step.layer_id, 'reason': step.reason})
+        if self.dry_run:
+            return
 
-    
+        new_names = self.rename_plan.final_names(steps)
+        if not new_names:
+            return
+        project = QgsProject.instance()
+        root = project.layerTreeRoot()
+        was_blocked = root.blockSignals(True)
+        try:
+            for idx, (layer_id, new_name) in enumerate(new_names.items()):
+                project.mapLayer(layer_id).setName(new_name)
+                METRICS.count(COUNT_RENAMES)
+                self.progress.update(idx + 1, len(new_names))
+        finally:
+            root.blockSignals(was_blocked)
+
+        self.tree_index.invalidate()  # The root did not tell it about the new names
+        project.setDirty(True)
+        if self.iface is not None:
+            model = self.iface.layerTreeView().layerTreeModel()
+            for node in root.findLayers():
+                if node.layerId() in new_names:
+                    index = model.node2index(node)
+                    model.dataChanged.emit(index, index)
 
     def apply_styles_to_layers(self):
         """Find specific layers inside the group containing 'Form 8' and apply QML styles to them."""
-        group = None
-        
-        # Iterate through all layer groups to find one containing 'Form 8' in its name
-        for layer_group in QgsProject.instance().layerTreeRoot().children():
-            if 'Form 8' in layer_group.name():
-                group = layer_group
-                break  # Stop searching after finding the first matching group
-
+        # The first top level group containing 'Form 8' in its name
+        group = self.tree_index.top_group_containing(FORM_GROUP_MARKER)
         if not group:
-            QMessageBox.critical(self.iface.mainWindow(), "Error", "Group containing 'Form 8' not found.")
+            self.notify('critical', "Error", "Group containing 'Form 8' not found.")
             return
 
         sf_layer_found = False
         gp_layer_found = False
 
-        for layer_tree_layer in group.findLayers():
+        for layer_tree_layer in self.tree_index.layers(group):
             layer_name = layer_tree_layer.name()
-            if layer_name.endswith(('_SF', '_SF.shp')):
+            if is_sf_layer(layer_name):
                 self.sf_layer = layer_tree_layer.layer()
                 sf_layer_found = True
-            elif layer_name.endswith(('_GP', '_GP.shp')):
+            elif is_gp_layer(layer_name):
                 self.gp_layer = layer_tree_layer.layer()
                 gp_layer_found = True
 
         # Apply QML styles to the found layers
-        if sf_layer_found and self.sf_layer.isValid() and os.path.exists(self.sf_qml_file):
-            self.sf_layer.loadNamedStyle(self.sf_qml_file)
-            self.sf_layer.triggerRepaint()
+        if sf_layer_found and self.ensure_layer_loaded(self.sf_layer) and os.path.exists(self.sf_qml_file):
+            if self.apply_qml_style(self.sf_layer, self.sf_qml_file):
+                self.restyled_layers.append(self.sf_layer)
         else:
-            QMessageBox.critical(self.iface.mainWindow(), "Error", "SF layer not found or invalid.")
+            self.notify('critical', "Error", "SF layer not found or invalid.")
+        self.progress.update(1, 2)
 
-        if gp_layer_found and self.gp_layer.isValid() and os.path.exists(self.gp_qml_file):
-            self.gp_layer.loadNamedStyle(self.gp_qml_file)
-            self.gp_layer.triggerRepaint()
+        if gp_layer_found and self.ensure_layer_loaded(self.gp_layer) and os.path.exists(self.gp_qml_file):
+            if self.apply_qml_style(self.gp_layer, self.gp_qml_file):
+                self.restyled_layers.append(self.gp_layer)
         else:
-            QMessageBox.critical(self.iface.mainWindow(), "Error", "GP layer not found or invalid.")
+            self.notify('critical', "Error", "GP layer not found or invalid.")
+
+    def read_qml_styles(self):
+        """Parse the Form 8A/8B QML files ahead of apply_styles_to_layers().
+
+        The documents come from QML_DOCUMENTS, so a QML file is only read
+        again when it changed since an earlier project. Only files are read
+        here, so this can run on a worker thread.
+        """
+        self.qml_styles = {}
+        for qml_file in (self.sf_qml_file, self.gp_qml_file):
+            if not qml_file or not os.path.exists(qml_file):
+                continue
+            try:
+                self.qml_styles[qml_file] = QML_DOCUMENTS.get(qml_file)
+                QML_STYLES.get(qml_file)  # fingerprint it while off the main thread
+            except (OSError, ValueError, ET.ParseError) as e:
+                LOGGER.warning("Could not parse %s at %s", qml_file, e)
+
+    def apply_qml_style(self, layer, qml_file):
+        """Apply qml_file to layer, from the parsed document when there is one.
+
+        The cached document is shared by every project, and importing may
+        upgrade the document it gets in place, so a deep copy is imported.
+        The fingerprint of the QML is recorded in the STYLE_PROPERTY custom
+        property of the layer, which is saved with the project. Returns
+        False, leaving the layer alone, if it already carries the style, and
+        after reporting it if the style could not be applied.
+        """
+        fingerprint = self.qml_fingerprint(qml_file)
+        if fingerprint is not None and layer.customProperty(STYLE_PROPERTY) == fingerprint:
+            LOGGER.debug("Layer %s already has the style of %s", layer.name(), qml_file,
+                         extra={'event': 'style', 'layer': layer.id()})
+            return False
+        document = self.qml_styles.get(qml_file)
+        if document is None:
+            error, ok = layer.loadNamedStyle(qml_file)
+        else:
+            ok, error = layer.importNamedStyle(document.cloneNode(True).toDocument())
+        if not ok:
+            self.notify('critical', "Error", f"Failed to apply {qml_file} to {layer.name()}: {error}")
+            return False
+        if fingerprint is not None:
+            layer.setCustomProperty(STYLE_PROPERTY, fingerprint)
+        METRICS.count(COUNT_STYLES)
+        return True
+
+    def qml_fingerprint(self, qml_file):
+        """Return the fingerprint of qml_file (see qp_style.py), or None if it cannot be read.
+
+        The style QGIS exports for a layer carries versions, defaults and
+        field settings a QML leaves out, so it never matches the QML's
+        fingerprint; the fingerprint recorded by apply_qml_style() is
+        compared instead.
+        """
+        try:
+            return QML_STYLES.get(qml_file).fingerprint
+        except (OSError, ET.ParseError):
+            return None
 
     # def arrange_base_layers(self):
     #     """Rearrange base layers in a specific order."""
@@ -306,191 +731,306 @@ class QPChecker:
     #     self.remove_duplicates(group)
 
     def arrange_base_layers(self):
-        """Rearrange base layers in a specific order."""
-        # Adjust 'bldg_points' to match various names like 'bldg_point', 'bldgps', 'bldgp', etc.
-        layer_order = ['river', 'road', 'block', 'ea', 'bgy', 'landmark', 'bldg_point_variants']
-
-        base_layer_group = None
-        for variation in ['Base Layers', 'Base layers', 'Base Layer', 'Base layer', 'base layers']:
-            base_layer_group = QgsProject.instance().layerTreeRoot().findGroup(variation)
-            if base_layer_group is not None:
-                break  #
+        """Rearrange base layers in a specific order (see arranged_base_layers())."""
+        base_layer_group = self.tree_index.group(BASE_LAYER_GROUP_NAMES)
 
         # Check if the group is valid
         if not base_layer_group:
-            self.iface.messageBar().pushCritical("Error", "Base Layers group not found.")
+            self.notify('critical', "Error", "Base Layers group not found.", bar=True)
             return
 
-        # Get all layers in the group
-        layers = [node.layer() for node in base_layer_group.children() if isinstance(node, QgsLayerTreeLayer)]
-        
-        # Log current layers in the group before rearrangement
-        print("Current layers in the group before rearrangement:")
-        for layer in layers:
-            print(f"- {layer.name()}")
-
-        self.rearrange_layers(base_layer_group, layers, layer_order)
-
-    def rearrange_layers(self, group, layers, layer_order):
-        """Rearrange layers within the selected group according to the specified order."""
-        # Create a mapping of layer names to their QgsLayerTreeLayer objects
-        layer_dict = {layer.name(): layer for layer in layers}
-
-        # Iterate over the desired layer order
-        for layer_name in layer_order:
-            if layer_name == 'bldg_point_variants':
-                # Handle bldg_point variations
-                matching_layer = next((layer for layer in layer_dict if any(variant in layer for variant in ['bldg_point','bldg_points', 'bldgps', 'bldgp', 'bldgpts', 'bldgpt'])), None)
-            else:
-                matching_layer = next((layer for layer in layer_dict if layer_name in layer), None)
-
-            if matching_layer:
-                layer_to_duplicate = layer_dict[matching_layer]
-                layer_tree_layer = QgsLayerTreeLayer(layer_to_duplicate)  # Duplicate the layer
-                group.insertChildNode(0, layer_tree_layer)  # Insert it at the top
-                print(f"Inserted duplicated layer '{layer_name}' into the group.")
-            else:
-                print(f"Layer '{layer_name}' not found in the layer dictionary.")
-
-        # Call the method to remove duplicates after rearranging
-        self.remove_duplicates(group)
-
-
-    def remove_duplicates(self, group):
-        """Remove duplicate layers from the given group."""
-        layer_names = set()
-        nodes_to_remove = []
-        
-        for node in group.children():
-            if isinstance(node, QgsLayerTreeLayer):
-                layer = node.layer()
-                layer_name = layer.name()
-                if layer_name in layer_names:
-                    nodes_to_remove.append(node)
-                    print(f"Removed duplicate layer: {layer.name()}")
-                else:
-                    layer_names.add(layer_name)
-        
-        for node in nodes_to_remove:
-            group.removeChildNode(node)
-
+        # Layer names of the children, None for sub-groups
+        nodes = base_layer_group.children()
+        names = [node.name() if isinstance(node, QgsLayerTreeLayer) else None for node in nodes]
 
+        # Log current layers in the group before rearrangement
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("Base layers before rearrangement: %s", ", ".join(name for name in names if name))
+
+        self.rearrange_layers(base_layer_group, nodes, arranged_base_layers(names))
+
+    def rearrange_layers(self, group, nodes, order):
+        """Move nodes, the children of group, into order with the fewest moves.
+
+        order is a permutation of the indices into nodes (see reorder_moves()).
+        The layer tree has no move operation: a node is cloned into its new
+        place, which keeps its visibility, expansion and custom properties,
+        and the original removed.
+        """
+        moves = reorder_moves(order)
+        current = dict(enumerate(nodes))  # index -> node now in the tree
+        debug = LOGGER.isEnabledFor(logging.DEBUG)
+        for idx, (index, anchor) in enumerate(moves):
+            self.progress.update(idx, len(moves))
+            position = 0 if anchor is None else group.children().index(current[anchor]) + 1
+            clone = current[index].clone()
+            group.insertChildNode(position, clone)
+            group.removeChildNode(current[index])
+            METRICS.count(COUNT_TREE_INSERTS)
+            METRICS.count(COUNT_TREE_REMOVES)
+            current[index] = clone
+            if debug:
+                LOGGER.debug("Moved %r into place", clone.name())
+
+    def deploy_value_relation_csvs(self):
+        """Copy the Value Relation CSVs from the QML folder to the project directory.
+
+        With a value_relation_store they go to that shared store instead,
+        and every project points at the same files. A CSV already there
+        with the same content is left alone (see deploy_file()). With
+        value_relation_gpkg each CSV is also turned into an indexed
+        GeoPackage table (see lookup_gpkg_source()) that the layers use.
+
+        Only files are touched here, so this can run on a worker thread. On
+        success self.value_relation_sources maps the Value Relation roles
+        (VALUE_RELATION_SF/GP) to the OGR data sources to use, otherwise
+        it is None.
+        """
+        self.value_relation_sources = None
 
-    def update_layer_sources(self):
-        """Update the data source for specific layers in the 'Value Relation' group in the QGIS project using the QML path and overwrite with new CSV files."""
         # Ensure the QML folder is set
         if not self.qml_folder:
-            self.iface.messageBar().pushWarning("Error", "QML folder not selected.")
+            self.notify('warning', "Error", "QML folder not selected.", bar=True)
             return
 
         # Define the source paths for the CSV files using the QML folder
-        source_sf_data_source = os.path.join(self.qml_folder, "2024_POPCEN-CBMS_SF_Specific_Types.csv")  # Use QML folder path
-        source_gp_data_source = os.path.join(self.qml_folder, "2024_POPCEN-CBMS_GP_Fund.csv")  # Use QML folder path
+        source_sf_data_source = os.path.join(self.qml_folder, SF_CSV_SOURCE_NAME)  # Use QML folder path
+        source_gp_data_source = os.path.join(self.qml_folder, GP_CSV_SOURCE_NAME)  # Use QML folder path
 
-        # Define the destination paths for the copied CSV files in the QGIS project directory
+        # Copy the CSV files to the QGIS project directory or the shared store, unless they are there already
         project_dir = os.path.dirname(self.qgs_file)  # Get the directory of the QGS file
-        dest_sf_data_source = os.path.join(project_dir, "2024 POPCEN-CBMS SF Specific Types.csv")
-        dest_gp_data_source = os.path.join(project_dir, "2024 POPCEN-CBMS GP Fund.csv")
-
-        # Copy the CSV files to the QGIS project directory
         try:
-            shutil.copy(source_sf_data_source, dest_sf_data_source)  # Copy SF CSV
-            print(f"Copied {source_sf_data_source} to {dest_sf_data_source}")
+            dest_sf_data_source = deploy_value_relation_csv(  # Copy SF CSV
+                source_sf_data_source, project_dir, SF_CSV_DEST_NAME, self.value_relation_store)
         except Exception as e:
-            QMessageBox.warning(self.iface.mainWindow(), "Error", f"Failed to copy SF CSV: {e}")
+            self.notify('warning', "Error", f"Failed to copy SF CSV: {e}")
             return
 
         try:
-            shutil.copy(source_gp_data_source, dest_gp_data_source)  # Copy GP CSV
-            print(f"Copied {source_gp_data_source} to {dest_gp_data_source}")
+            dest_gp_data_source = deploy_value_relation_csv(  # Copy GP CSV
+                source_gp_data_source, project_dir, GP_CSV_DEST_NAME, self.value_relation_store)
         except Exception as e:
-            QMessageBox.warning(self.iface.mainWindow(), "Error", f"Failed to copy GP CSV: {e}")
+            self.notify('warning', "Error", f"Failed to copy GP CSV: {e}")
             return
 
+        if self.value_relation_gpkg:
+            qml_files = (self.sf_qml_file, self.gp_qml_file)
+            try:
+                dest_sf_data_source = lookup_gpkg_source(
+                    dest_sf_data_source, qml_files, self.rename_rules, VALUE_RELATION_SF, self.value_relation_store)
+                dest_gp_data_source = lookup_gpkg_source(
+                    dest_gp_data_source, qml_files, self.rename_rules, VALUE_RELATION_GP, self.value_relation_store)
+            except LOOKUP_ERRORS as e:
+                self.notify('warning', "Error", f"Failed to convert the Value Relation CSVs to GeoPackage: {e}")
+                return
+
+        self.value_relation_sources = {VALUE_RELATION_SF: dest_sf_data_source,
+                                       VALUE_RELATION_GP: dest_gp_data_source}
+
+    def prepare_checks(self):
+        """Take the feature sources the QA stages read, on the main thread.
+
+        Unresolved layers are loaded here and every checked layer wrapped in
+        a LayerSource (see qp_qa), so check_containment(), check_duplicates()
+        and check_domains() can read the data on the task thread.
+        """
+        self.polygon_sources = []
+        self.point_sources = []
+        self.form_sources = {}
+        self.transform_context = QgsProject.instance().transformContext()
+        for layer, label in ((self.sf_layer, "SF"), (self.gp_layer, "GP")):
+            if layer is not None and self.ensure_layer_loaded(layer):  # Problems reported by apply_styles_to_layers()
+                self.form_sources[label] = layer_source(layer)
+
+        base_layer_group = self.tree_index.group(BASE_LAYER_GROUP_NAMES)
+        if base_layer_group is None:
+            return  # Reported by arrange_base_layers()
+        layers = {node.name(): node.layer() for node in self.tree_index.layers(base_layer_group)}
+        for level in CONTAINMENT_LEVELS:
+            layer = layers.get(find_base_layer_match(level, layers))
+            if layer is not None and self.ensure_layer_loaded(layer):
+                self.polygon_sources.append((level, layer_source(layer)))
+            else:
+                LOGGER.info("No valid %s layer, points are not checked against it", level)
+        layer = layers.get(find_base_layer_match(CONTAINMENT_POINTS, layers))
+        if layer is not None and self.ensure_layer_loaded(layer):
+            self.point_sources.append(layer_source(layer))
+        self.point_sources += self.form_sources.values()
+
+    def clear_checks(self):
+        """Drop the feature sources taken by prepare_checks()."""
+        self.polygon_sources = []
+        self.point_sources = []
+        self.form_sources = {}
+
+    def canceled(self):
+        """Return True if the running check has been cancelled."""
+        return canceled(self.feedback)
+
+    def check_containment(self):
+        """Check that building, SF and GP points lie in nested block, EA and barangay polygons.
+
+        The polygon layers are indexed once and the points located with
+        prepared geometries (see qp_qa). A point outside every polygon of a
+        level, or in a block outside its EA (an EA outside its barangay),
+        is reported; the feature ids are logged at DEBUG. Returns False if
+        the check was cancelled.
+        """
+        if not self.polygon_sources:
+            return
+        locators = [(level, PolygonLocator(source, self.transform_context, self.feedback))
+                    for level, source in self.polygon_sources]
+        parents = polygon_parents(locators, self.feedback)
+
+        # Every point layer moves the progress over its share of all the points
+        total = sum(max(layer.count, 0) for layer in self.point_sources)
+        first = 0
+        for layer in self.point_sources:
+            def progress(done, count, first=first):
+                self.progress.update(first + done, total)
+            join = join_points(layer, locators, parents, progress, self.feedback)
+            if self.canceled():
+                return False
+            first += max(layer.count, 0)
+            problems = [(join.outside(level), f"outside every {level} polygon") for level in join.levels]
+            problems += [(join.mismatches(level), f"in a {level} that is not inside their {parent_level}")
+                         for level, parent_level in zip(join.levels, join.levels[1:])]
+            for point_ids, text in problems:
+                if point_ids:
+                    self.notify('warning', "Containment",
+                                f"{len(point_ids)} of {len(join)} points of {layer.name} are {text}.")
+                    if LOGGER.isEnabledFor(logging.DEBUG):
+                        LOGGER.debug("Points of %s %s: %s", layer.name, text, ", ".join(map(str, point_ids)),
+                                     extra={'event': 'containment', 'layer': layer.id})
+
+    def check_duplicates(self):
+        """Report SF and GP points entered twice: points within DUPLICATE_TOLERANCE metres of each other.
+
+        See qp_grid; each cluster of close points is logged with its
+        feature ids at DEBUG. Returns False if the check was cancelled.
+        """
+        for label, layer in self.form_sources.items():
+            clusters = duplicate_points(layer, DUPLICATE_TOLERANCE, self.feedback)
+            if self.canceled():
+                return False
+            if clusters:
+                self.notify('warning', "Duplicates",
+                            f"{sum(map(len, clusters))} {label} points of {layer.name} are within "
+                            f"{DUPLICATE_TOLERANCE:g} m of another point, in {len(clusters)} groups.")
+            if LOGGER.isEnabledFor(logging.DEBUG):
+                for cluster in clusters:
+                    LOGGER.debug("Duplicate %s points of %s: %s", label, layer.name, ", ".join(map(str, cluster)),
+                                 extra={'event': 'duplicates', 'layer': layer.id})
+
+    def check_domains(self):
+        """Report SF and GP attribute values that are not codes of their Value Relation lookup table.
+
+        The fields to check, and the key column of the lookup CSV each one
+        takes its codes from, come from the ValueRelation widgets of the
+        Form 8A/8B QMLs. The lookup CSVs of the QML folder, the masters of
+        the deployed copies, are read once into sets of codes; the features
+        are streamed without geometry (see qp_domains). The offending
+        feature ids are logged at DEBUG. Returns False if the check was
+        cancelled.
+        """
+        lookups = {VALUE_RELATION_SF: os.path.join(self.qml_folder, SF_CSV_SOURCE_NAME),
+                   VALUE_RELATION_GP: os.path.join(self.qml_folder, GP_CSV_SOURCE_NAME)}
+        lookups = {role: path for role, path in lookups.items() if os.path.exists(path)}
+        qml_files = {"SF": self.sf_qml_file, "GP": self.gp_qml_file}
+        for label, layer in self.form_sources.items():
+            qml_file = qml_files[label]
+            if not os.path.exists(qml_file):
+                continue
+            try:
+                rules = domain_rules(QML_VALUE_RELATIONS.get(qml_file), lookups,
+                                     self.rename_rules.value_relation_role)
+            except LOOKUP_ERRORS as e:
+                LOGGER.warning("Could not read the lookup codes of %s: %s", qml_file, e)
+                continue
+            lookup_of = {rule.field: rule.lookup for rule in rules}
+            counts = {}  # field -> number of bad values
+            debug = LOGGER.isEnabledFor(logging.DEBUG)
+            for violation in attribute_violations(layer, rules, self.feedback):
+                counts[violation.field] = counts.get(violation.field, 0) + 1
+                if debug:
+                    LOGGER.debug("%s feature %s of %s: %s %r is not in %s", label, violation.feature_id,
+                                 layer.name, violation.field, violation.value, lookup_of[violation.field],
+                                 extra={'event': 'domain', 'layer': layer.id})
+            if self.canceled():
+                return False
+            for field, count in counts.items():
+                self.notify('warning', "Attribute codes",
+                            f"{count} {field} values of {layer.count} {label} features of {layer.name} "
+                            f"are not codes of {lookup_of[field]}.")
+
+    def update_layer_sources(self):
+        """Update the data source for specific layers in the 'Value Relation' group to the CSVs or tables deployed by deploy_value_relation_csvs()."""
+        if self.value_relation_sources is None:
+            return  # Copying failed and has been reported already
+        dest_sf_data_source = self.value_relation_sources[VALUE_RELATION_SF]
+        dest_gp_data_source = self.value_relation_sources[VALUE_RELATION_GP]
+
         # Find the "Value Relation" group
-        value_relation_group = None
-        for variation in ["Value Relation", "Value Relations", "Value Relations "]:  # Check for trailing space
-            value_relation_group = QgsProject.instance().layerTreeRoot().findGroup(variation)
-            if value_relation_group is not None:
-                break  # Stop searching after finding the first matching group
+        value_relation_group = self.tree_index.group(VALUE_RELATION_GROUP_NAMES)
 
         if value_relation_group is None:
-            QMessageBox.warning(self.iface.mainWindow(), "Warning", "Value Relations group not found or has a trailing space.")
+            self.notify('warning', "Warning", "Value Relations group not found or has a trailing space.")
             return  # Exit if the group is not found
 
-        # Update existing layers instead of removing them
-        sf_layer_names = ["2024 POPCEN-CBMS SF Specific Types", "2024 POPCEN-CBMS_SF_Specific_Types","2024 POPCEN-CBMS SF Specific Types ","2024-POPCEN-CBMS-SF-Specific-Types","2024_POPCEN_CBMS_SF_Specific_Types","2024 POPCEN_CBMS_SF_Specific_Types", "2024_POPCEN-CBMS_SF_Specific_Types"]
-        gp_layer_names = ["2024 POPCEN-CBMS GP Fund ", "2024 POPCEN-CBMS_GP_Fund", "2024 POPCEN-CBMS GP Fund", "2024-POPCEN-CBMS-GP-Fund", "2024_POPCEN_CBMS_GP_Fund", "2024 POPCEN_CBMS_GP_Fund", "2024_POPCEN-CBMS_GP_Fund"]
-
-        for layer_tree_layer in value_relation_group.findLayers():
+        # Update existing layers instead of removing them. After a fast load
+        # the old source has not been opened; setDataSource() opens the new one.
+        layer_tree_layers = self.tree_index.layers(value_relation_group)
+        for idx, layer_tree_layer in enumerate(layer_tree_layers):
+            self.progress.update(idx, len(layer_tree_layers))
             layer = layer_tree_layer.layer()
-            if layer.name() in sf_layer_names:
+            role = self.rename_rules.value_relation_role(layer.name())
+            if role == VALUE_RELATION_SF:
                 # Validate if the layer exists before updating
-                if layer.isValid() and os.path.exists(dest_sf_data_source):
+                if self.has_source(layer, dest_sf_data_source):
+                    LOGGER.debug("SF layer %s already uses %s", layer.name(), dest_sf_data_source)
+                elif (self.fast_load or layer.isValid()) and os.path.exists(source_path(dest_sf_data_source)):
                     # Update the data source for the SF layer
                     layer.setDataSource(dest_sf_data_source, layer.name(), "ogr")  # Update the data source
-                    print(f"Updated SF data source for layer: {layer.name()} with {dest_sf_data_source}")
+                    METRICS.count(COUNT_SOURCE_CHANGES)
+                    LOGGER.debug("Updated SF data source for layer: %s with %s", layer.name(), dest_sf_data_source,
+                                 extra={'event': 'source', 'layer': layer.id()})
                 else:
-                    print(f"SF layer '{layer.name()}' is invalid or data source does not exist.")
+                    LOGGER.warning("SF layer %r is invalid or data source does not exist", layer.name())
 
-            elif layer.name() in gp_layer_names:
+            elif role == VALUE_RELATION_GP:
                 # Validate if the layer exists before updating
-                if layer.isValid() and os.path.exists(dest_gp_data_source):
+                if self.has_source(layer, dest_gp_data_source):
+                    LOGGER.debug("GP layer %s already uses %s", layer.name(), dest_gp_data_source)
+                elif (self.fast_load or layer.isValid()) and os.path.exists(source_path(dest_gp_data_source)):
                     # Update the data source for the GP layer
                     layer.setDataSource(dest_gp_data_source, layer.name(), "ogr")  # Update the data source
-                    print(f"Updated GP data source for layer: {layer.name()} with {dest_gp_data_source}")
+                    METRICS.count(COUNT_SOURCE_CHANGES)
+                    LOGGER.debug("Updated GP data source for layer: %s with %s", layer.name(), dest_gp_data_source,
+                                 extra={'event': 'source', 'layer': layer.id()})
                 else:
-                    print(f"GP layer '{layer.name()}' is invalid or data source does not exist.")
+                    LOGGER.warning("GP layer %r is invalid or data source does not exist", layer.name())
+
 
+    def has_source(self, layer, source):
+        """Return True if layer already reads the OGR data source source."""
+        return layer.providerType() == "ogr" and same_source(layer.source(), source)
 
     def rename_value_relation_layers(self):
         """Rename layers in the 'Value Relation' group to standard names."""
 
-        # Define the standard names and the list of alternative names to be checked
-        standard_sf_name = "2024 POPCEN-CBMS SF Specific Types"
-        standard_gp_name = "2024 POPCEN-CBMS GP Fund"
-        
-        sf_layer_names = [
-            "2024 POPCEN-CBMS SF Specific Types", "2024 POPCEN-CBMS_SF_Specific_Types",
-            "2024 POPCEN-CBMS SF Specific Types ", "2024-POPCEN-CBMS-SF-Specific-Types",
-            "2024_POPCEN_CBMS_SF_Specific_Types", "2024 POPCEN_CBMS_SF_Specific_Types",
-            "2024_POPCEN-CBMS_SF_Specific_Types"
-        ]
-        
-        gp_layer_names = [
-            "2024 POPCEN-CBMS GP Fund ", "2024 POPCEN-CBMS_GP_Fund",
-            "2024 POPCEN-CBMS GP Fund", "2024-POPCEN-CBMS-GP-Fund",
-            "2024_POPCEN_CBMS_GP_Fund", "2024 POPCEN_CBMS_GP_Fund",
-            "2024_POPCEN-CBMS_GP_Fund"
-        ]
-
         # Find the "Value Relation" group
-        value_relation_group = None
-        for variation in ["Value Relation", "Value Relations", "Value Relations "]:  # Check for trailing space
-            value_relation_group = QgsProject.instance().layerTreeRoot().findGroup(variation)
-            if value_relation_group is not None:
-                break  # Stop searching after finding the first matching group
+        value_relation_group = self.tree_index.group(VALUE_RELATION_GROUP_NAMES)
 
         if value_relation_group is None:
-            QMessageBox.warning(self.iface.mainWindow(), "Warning", "Value Relations group not found or has a trailing space.")
+            self.notify('warning', "Warning", "Value Relations group not found or has a trailing space.")
             return  # Exit if the group is not found
 
         # Rename layers in the "Value Relation" group if they match any of the alternative names
-        for layer_tree_layer in value_relation_group.findLayers():
-            layer_name = layer_tree_layer.name()
-            
-            # Check if the layer name matches any alternative SF name and rename it to the standard SF name
-            if layer_name in sf_layer_names:
-                layer_tree_layer.layer().setName(standard_sf_name)
-                print(f"Renamed layer '{layer_name}' to '{standard_sf_name}'")
-
-            # Check if the layer name matches any alternative GP name and rename it to the standard GP name
-            elif layer_name in gp_layer_names:
-                layer_tree_layer.layer().setName(standard_gp_name)
-                print(f"Renamed layer '{layer_name}' to '{standard_gp_name}'")
-
-            else:
-                print(f"No renaming needed for layer: {layer_name}")
+        layer_ids = [node.layerId() for node in self.tree_index.layers(value_relation_group)
+                     if node.layerId() in self.rename_plan.names]
+        first_step = len(self.rename_plan)
+        plan_value_relation_renames(self.rename_plan, layer_ids, self.rename_rules)
+        self.apply_rename_steps(self.rename_plan.steps[first_step:])
 
 
 
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Deploying the Value Relation CSVs into project folders without redundant copies.
+
+A file is only copied when the destination does not hold the same bytes
+already. The check reads as little as it can: a destination with the size
+and modification time of the source (copies keep the source's time) is
+taken as equal after two os.stat() calls, and only files of the same size
+but another time are hashed. The hash of a source is cached, as every
+project of a batch gets the same sources.
+
+Where the filesystem can clone files (reflinks on Btrfs or XFS), the copy
+shares the source's blocks instead of writing them again. Hardlinks are not
+used: a project's copy must stay independent of the master CSV.
+
+Instead of a copy per project, the CSVs can be deployed once to a shared
+store, a folder with one version folder per content: <store>/<hash>/<name>.
+A version is never modified once written, so projects pointing at it keep
+the lookup tables they were checked with when the master CSVs change.
+"""
+
+import hashlib
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .qp_cache import FileCache
+from .qp_log import LOGGER
+from .qp_metrics import COUNT_BYTES_CLONED, COUNT_BYTES_COPIED, METRICS
+from .qp_project_io import replace_file, temporary_sibling
+
+# Linux ioctl making a file share the extents of another (a reflink)
+FICLONE = 0x40049409
+HASH_CHUNK_SIZE = 1024 * 1024
+# Length of the content hash naming a version folder of a store
+STORE_VERSION_LENGTH = 16
+
+# What deploy_file() did
+DEPLOY_UNCHANGED = 'unchanged'
+DEPLOY_COPIED = 'copied'
+DEPLOY_CLONED = 'cloned'
+
+
+def file_digest(path):
+    """Return the SHA-256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Digests of the source files, shared by every project checked in this process
+FILE_DIGESTS = FileCache(file_digest)
+
+
+def same_content(source, dest):
+    """Return True if dest exists and holds the same bytes as source."""
+    try:
+        dest_stat = os.stat(dest)
+    except FileNotFoundError:
+        return False
+    source_stat = os.stat(source)
+    if os.path.samestat(source_stat, dest_stat):
+        return True
+    if source_stat.st_size != dest_stat.st_size:
+        return False
+    if source_stat.st_mtime_ns == dest_stat.st_mtime_ns:
+        return True
+    if FILE_DIGESTS.get(source) != file_digest(dest):
+        return False
+    # Same bytes: give dest the source's time so the next check only stats
+    os.utime(dest, ns=(dest_stat.st_atime_ns, source_stat.st_mtime_ns))
+    return True
+
+
+def clone_file(source, dest):
+    """Create dest as a copy-on-write clone of source.
+
+    Returns False, leaving no dest behind, where the platform or the
+    filesystem cannot clone files.
+    """
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(dest):
+            os.remove(dest)
+        return False
+    shutil.copystat(source, dest)
+    return True
+
+
+def deploy_file(source, dest):
+    """Make dest a copy of source unless it is one already.
+
+    The copy is written next to dest and moved into place, so a project
+    never sees a half written CSV. Returns DEPLOY_UNCHANGED, DEPLOY_CLONED
+    or DEPLOY_COPIED.
+    """
+    if same_content(source, dest):
+        LOGGER.debug("%s is up to date", dest, extra={'event': 'copy', 'outcome': DEPLOY_UNCHANGED})
+        return DEPLOY_UNCHANGED
+    temp_path = temporary_sibling(dest)
+    try:
+        cloned = clone_file(source, temp_path)
+        if not cloned:
+            shutil.copy2(source, temp_path)
+        replace_file(temp_path, dest)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    outcome = DEPLOY_CLONED if cloned else DEPLOY_COPIED
+    METRICS.count(COUNT_BYTES_CLONED if cloned else COUNT_BYTES_COPIED, os.path.getsize(dest))
+    LOGGER.info("Copied %s to %s", source, dest, extra={'event': 'copy', 'outcome': outcome})
+    return outcome
+
+
+def same_path(first, second):
+    """Return True if two paths name the same file, without touching the disk."""
+    return os.path.normcase(os.path.abspath(first)) == os.path.normcase(os.path.abspath(second))
+
+
+def ogr_source(path, layer_name=None):
+    """Return the OGR data source of a file, or of the layer layer_name of a file."""
+    return path if layer_name is None else f"{path}|layername={layer_name}"
+
+
+def source_path(source):
+    """Return the file of an OGR data source."""
+    return source.split('|', 1)[0]
+
+
+def same_source(first, second):
+    """Return True if two OGR data sources name the same file and options."""
+    first_path, _, first_options = first.partition('|')
+    second_path, _, second_options = second.partition('|')
+    return first_options == second_options and same_path(first_path, second_path)
+
+
+def store_file(source, store, name):
+    """Deploy source as name in the version folder of its content in store; return its path."""
+    folder = os.path.join(store, FILE_DIGESTS.get(source)[:STORE_VERSION_LENGTH])
+    os.makedirs(folder, exist_ok=True)
+    dest = os.path.join(folder, name)
+    deploy_file(source, dest)
+    return dest
+
+
+def deploy_value_relation_csv(source, project_dir, name, store=None):
+    """Deploy the Value Relation CSV source for a project and return where it is.
+
+    Without a store it is copied into project_dir as name, with one it is
+    put in the store (see store_file()).
+    """
+    if store:
+        return store_file(source, store, name)
+    dest = os.path.join(project_dir, name)
+    deploy_file(source, dest)
+    return dest
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Checking coded attributes against the Value Relation lookup tables.
+
+Each lookup CSV is read once per version (see FileCache) into a set of
+values per column. The ValueRelation widgets of a form QML say which field
+takes its codes from which lookup table and key column; those become
+DomainRules. Rows are then checked one at a time, so validating a layer
+needs memory for the domains only, not for its features.
+
+Filter expressions of the widgets are not evaluated: a code is accepted if
+the lookup table has it at all.
+"""
+
+import csv
+from collections import namedtuple
+
+from .qp_cache import FileCache
+
+# A field whose values must be keys of a lookup table. domain is the set of
+# keys; with allow_multi a value is a list of keys, like "{1,3}".
+DomainRule = namedtuple('DomainRule', 'field domain allow_multi lookup')
+# A value of a field that is not in the domain of its DomainRule
+Violation = namedtuple('Violation', 'feature_id field value')
+
+
+def read_csv_columns(csv_path):
+    """Return the values of every column of a CSV file as {column: frozenset of values}."""
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = [set() for _ in header]
+        for row in reader:
+            for values, value in zip(columns, row):
+                values.add(value.strip())
+    return {name: frozenset(values) for name, values in zip(header, columns)}
+
+
+# Column values of the lookup CSVs, shared by every project checked in this process
+CSV_COLUMNS = FileCache(read_csv_columns)
+
+
+def domain_rules(configs, lookups, role_of):
+    """Return the DomainRules of the ValueRelationConfigs configs.
+
+    lookups maps Value Relation roles to lookup CSV files and role_of(name)
+    gives the role of a lookup layer name. Widgets of other lookup layers,
+    or whose key column the CSV does not have, are left out.
+    """
+    rules = []
+    for config in configs:
+        csv_path = lookups.get(role_of(config.layer_name))
+        if csv_path is None:
+            continue
+        domain = CSV_COLUMNS.get(csv_path).get(config.key)
+        if domain is not None:
+            rules.append(DomainRule(config.field, domain, config.allow_multi, config.layer_name))
+    return rules
+
+
+def domain_value(value):
+    """Return an attribute value as the text a lookup CSV would hold, or None for no value."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def multi_values(value):
+    """Return the keys of a multiple choice value such as '{1,3}' or '{"a","b"}'."""
+    value = value.strip()
+    if value.startswith('{') and value.endswith('}'):
+        value = value[1:-1]
+    return [key.strip().strip('"') for key in value.split(',') if key.strip()]
+
+
+def validate_rows(rows, rules):
+    """Yield a Violation for every value of rows outside the domain of its rule.
+
+    rows is an iterable of (feature id, values), values holding one
+    attribute value per rule of rules, in order. Empty values are accepted.
+    """
+    for feature_id, values in rows:
+        for rule, value in zip(rules, values):
+            value = domain_value(value)
+            if value is None:
+                continue
+            keys = multi_values(value) if rule.allow_multi else [value]
+            for key in keys:
+                if key not in rule.domain:
+                    yield Violation(feature_id, rule.field, key)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Value Relation lookup tables as indexed GeoPackage tables.
+
+OGR reads a CSV from start to end every time a Value Relation widget
+opens or filters. The same rows in a GeoPackage attribute table, with an
+index on the key and filter columns, are looked up by SQLite instead.
+
+The GeoPackage is written with sqlite3 alone: the attribute table plus the
+tables a reader needs to recognise a GeoPackage (application id, spatial
+reference systems, contents, geometry columns). Every column is TEXT,
+as the OGR CSV driver reads every column as a string. The size and mtime
+of the CSV and the indexed columns are kept in the table's gpkg_contents
+description, so an up to date GeoPackage is recognised without reading the
+CSV again.
+
+With a shared Value Relation store (see qp_deploy) a GeoPackage is never
+rewritten: it gets a version folder of its own, named after the content
+of the CSV and the indexed columns, and is written once.
+"""
+
+import csv
+import hashlib
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+
+from .qp_deploy import FILE_DIGESTS, STORE_VERSION_LENGTH, ogr_source
+from .qp_log import LOGGER
+from .qp_project_io import replace_file, temporary_sibling
+from .qp_style import QML_VALUE_RELATIONS, expression_columns
+
+GPKG_APPLICATION_ID = 0x47504B47  # 'GPKG'
+GPKG_USER_VERSION = 10300  # GeoPackage 1.3
+GPKG_EXTENSION = '.gpkg'
+# What lookup_gpkg_source() raises for unreadable CSVs, QMLs or GeoPackages
+LOOKUP_ERRORS = (OSError, ValueError, csv.Error, sqlite3.Error, ET.ParseError)
+
+GPKG_SCHEMA = """
+CREATE TABLE gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT);
+CREATE TABLE gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+    description TEXT DEFAULT '',
+    last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+    srs_id INTEGER, CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id));
+CREATE TABLE gpkg_geometry_columns (
+    table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name));
+"""
+# The spatial reference systems every GeoPackage has to define
+GPKG_SPATIAL_REF_SYS = [
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+    ('WGS 84 geodetic', 4326, 'EPSG', 4326,
+     'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+     'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+     'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AXIS["Latitude",NORTH],'
+     'AXIS["Longitude",EAST],AUTHORITY["EPSG","4326"]]',
+     'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid'),
+]
+
+
+def quote_identifier(name):
+    """Return name quoted as an SQL identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def lookup_columns(configs, matches):
+    """Return the columns to index for a lookup table, in order and without repeats.
+
+    Those are the key and the filter expression columns of the
+    ValueRelationConfigs whose layer name matches(), a predicate.
+    """
+    columns = []
+    for config in configs:
+        if matches(config.layer_name):
+            for column in [config.key] + expression_columns(config.filter_expression):
+                if column and column not in columns:
+                    columns.append(column)
+    return columns
+
+
+def csv_signature(csv_path, index_columns):
+    """Return what a GeoPackage made from csv_path with index_columns records of them."""
+    stat = os.stat(csv_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{','.join(index_columns)}"
+
+
+def gpkg_signature(gpkg_path, table):
+    """Return the csv_signature() stored with table in gpkg_path, or None."""
+    if not os.path.exists(gpkg_path):
+        return None
+    try:
+        connection = sqlite3.connect(f"file:{gpkg_path}?mode=ro", uri=True)
+        try:
+            row = connection.execute("SELECT description FROM gpkg_contents WHERE table_name = ?",
+                                     (table,)).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def write_lookup_gpkg(csv_path, gpkg_path, table, index_columns, signature=''):
+    """Write the rows of csv_path as table of a new GeoPackage at gpkg_path.
+
+    Columns of index_columns that the CSV does not have are left out. The
+    GeoPackage is written next to gpkg_path and moved into place.
+    """
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        width = len(header)
+        rows = [(row + [''] * width)[:width] for row in reader if row]
+
+    temp_path = temporary_sibling(gpkg_path)
+    try:
+        connection = sqlite3.connect(temp_path)
+        try:
+            connection.execute(f"PRAGMA application_id = {GPKG_APPLICATION_ID}")
+            connection.execute(f"PRAGMA user_version = {GPKG_USER_VERSION}")
+            connection.executescript(GPKG_SCHEMA)
+            connection.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", GPKG_SPATIAL_REF_SYS)
+            columns = ', '.join(f"{quote_identifier(name)} TEXT" for name in header)
+            connection.execute(f"CREATE TABLE {quote_identifier(table)} "
+                               f"(fid INTEGER PRIMARY KEY AUTOINCREMENT{', ' if header else ''}{columns})")
+            if header:
+                placeholders = ', '.join('?' * width)
+                names = ', '.join(map(quote_identifier, header))
+                connection.executemany(f"INSERT INTO {quote_identifier(table)} ({names}) VALUES ({placeholders})",
+                                       rows)
+            for column in index_columns:
+                if column in header:
+                    connection.execute(f"CREATE INDEX {quote_identifier(f'idx_{table}_{column}')} "
+                                       f"ON {quote_identifier(table)} ({quote_identifier(column)})")
+            connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, description) "
+                               "VALUES (?, 'attributes', ?, ?)", (table, table, signature))
+            connection.commit()
+        finally:
+            connection.close()
+        replace_file(temp_path, gpkg_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def store_gpkg_path(csv_path, index_columns, store):
+    """Return the path of the GeoPackage of csv_path indexed on index_columns in the store folder."""
+    digest = hashlib.sha256(FILE_DIGESTS.get(csv_path).encode('ascii'))
+    for column in index_columns:
+        digest.update(f"\0{column}".encode('utf-8'))
+    name = os.path.splitext(os.path.basename(csv_path))[0] + GPKG_EXTENSION
+    return os.path.join(store, digest.hexdigest()[:STORE_VERSION_LENGTH], name)
+
+
+def csv_lookup_gpkg(csv_path, index_columns=(), store=None):
+    """Materialise csv_path as a GeoPackage; return (gpkg path, table name).
+
+    The GeoPackage has the name of the CSV and one table named after it.
+    Without a store it is written next to the CSV and only rewritten when
+    the CSV or index_columns changed. With one it goes to its version
+    folder of the store (see store_gpkg_path()) and, once there, is never
+    modified.
+    """
+    table = os.path.splitext(os.path.basename(csv_path))[0]
+    if store:
+        gpkg_path = store_gpkg_path(csv_path, index_columns, store)
+        if os.path.exists(gpkg_path):
+            return gpkg_path, table
+        os.makedirs(os.path.dirname(gpkg_path), exist_ok=True)
+    else:
+        gpkg_path = os.path.splitext(csv_path)[0] + GPKG_EXTENSION
+    signature = csv_signature(csv_path, index_columns)
+    if store or gpkg_signature(gpkg_path, table) != signature:
+        write_lookup_gpkg(csv_path, gpkg_path, table, index_columns, signature)
+        LOGGER.info("Wrote %s with indexes on %s", gpkg_path, ", ".join(index_columns) or "nothing",
+                    extra={'event': 'gpkg'})
+    return gpkg_path, table
+
+
+def lookup_gpkg_source(csv_path, qml_files, rules, role, store=None):
+    """Materialise the deployed Value Relation CSV of role and return the OGR source of its table.
+
+    The indexed columns are the ones the ValueRelation widgets of the
+    qml_files read from the layers RenameRules rules give that role, see
+    lookup_columns(). store is the shared Value Relation store, if any, see
+    csv_lookup_gpkg(). Raises one of LOOKUP_ERRORS on failure.
+    """
+    configs = [config for qml_file in qml_files if os.path.exists(qml_file)
+               for config in QML_VALUE_RELATIONS.get(qml_file)]
+    columns = lookup_columns(configs, lambda name: rules.value_relation_role(name) == role)
+    return ogr_source(*csv_lookup_gpkg(csv_path, columns, store))
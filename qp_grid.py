@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Finding duplicate and near-duplicate points with a hash grid.
+
+Points are put in square cells as wide as the tolerance, so two points
+within the tolerance of each other are in the same or in neighbouring
+cells. Every point is only compared with the points already seen in its
+own and the eight neighbouring cells, which takes linear time for points
+that are not piled up in a few cells. Points within the tolerance are
+merged with a union-find into clusters: a chain of close points is one
+cluster even if its ends are further apart.
+"""
+
+import math
+
+
+class UnionFind:
+    """Disjoint sets of hashable items."""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        """Return the representative of the set of item."""
+        parent = self.parent
+        parent.setdefault(item, item)
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]  # path halving
+            item = parent[item]
+        return item
+
+    def union(self, first, second):
+        """Merge the sets of first and second."""
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[second] = first
+
+
+def duplicate_clusters(points, tolerance):
+    """Return the clusters of points closer than tolerance to each other.
+
+    points is an iterable of (id, x, y). Each cluster is a sorted list of
+    ids with at least two points; clusters are ordered by their first id.
+    With a tolerance of 0 only points at the same coordinates are merged.
+    """
+    sets = UnionFind()
+    if tolerance <= 0:
+        first_at = {}
+        for point_id, x, y in points:
+            other = first_at.setdefault((x, y), point_id)
+            if other != point_id:
+                sets.union(other, point_id)
+    else:
+        limit = tolerance * tolerance
+        cells = {}  # (column, row) -> [(id, x, y)] of the points seen so far
+        for point_id, x, y in points:
+            column, row = math.floor(x / tolerance), math.floor(y / tolerance)
+            for neighbour_column in (column - 1, column, column + 1):
+                for neighbour_row in (row - 1, row, row + 1):
+                    for other_id, other_x, other_y in cells.get((neighbour_column, neighbour_row), ()):
+                        if (x - other_x) ** 2 + (y - other_y) ** 2 <= limit:
+                            sets.union(other_id, point_id)
+            cells.setdefault((column, row), []).append((point_id, x, y))
+
+    clusters = {}
+    for point_id in sets.parent:
+        clusters.setdefault(sets.find(point_id), []).append(point_id)
+    return sorted((sorted(cluster) for cluster in clusters.values() if len(cluster) > 1),
+                  key=lambda cluster: cluster[0])
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Results of joining points to nested polygon levels (block in EA in barangay).
+
+A HierarchyJoin holds, for every point, the id of the polygon of each level
+that contains it, as arrays of 64-bit integers parallel to the point ids;
+NO_MATCH marks a point outside every polygon of a level. A hundred thousand
+points take under a megabyte per level, where lists of tuples would take
+tens.
+
+Besides the per point matches it records the parent of every polygon, the
+polygon of the next level up containing it. A point is consistent when the
+polygon it falls in at one level sits in the polygon it falls in at the
+level above. A point on a boundary shared by two polygons of a level is in
+both; it is joined to the ones that nest, if any do.
+"""
+
+from array import array
+from itertools import product
+
+NO_MATCH = -1
+ID_TYPECODE = 'q'  # feature ids are 64-bit
+
+
+class HierarchyJoin:
+    """Polygon of each level containing each point, smallest level first.
+
+    parents maps every level to {polygon id: parent polygon id}. The same
+    polygons serve every point layer, so the parents are worked out once
+    (see polygon_parents() in qp_qa) and shared by the joins.
+    """
+
+    def __init__(self, levels, parents):
+        self.levels = list(levels)
+        self.point_ids = array(ID_TYPECODE)
+        self.matches = {level: array(ID_TYPECODE) for level in self.levels}
+        self.parents = parents
+
+    def __len__(self):
+        return len(self.point_ids)
+
+    def add(self, point_id, matches):
+        """Record the polygon ids matches, one per level, of point point_id."""
+        self.point_ids.append(point_id)
+        for level, polygon_id in zip(self.levels, matches):
+            self.matches[level].append(polygon_id)
+
+    def add_candidates(self, point_id, candidates):
+        """Record point point_id given the ids of every polygon of each level containing it.
+
+        candidates holds a list of polygon ids per level. The first
+        combination of them that nests is recorded, so a point on a shared
+        boundary is only a mismatch when no polygon it touches agrees with
+        the level above; failing that, the first polygon of every level. A
+        level without candidates records NO_MATCH.
+        """
+        choices = [ids or [NO_MATCH] for ids in candidates]
+        matches = next((matches for matches in product(*choices) if self.nested(matches)),
+                       [ids[0] for ids in choices])
+        self.add(point_id, matches)
+
+    def nested(self, matches):
+        """Return True if every polygon of matches, one per level, lies in the polygon of the next level.
+
+        Levels without a polygon are not held against the point here; see outside().
+        """
+        for level, polygon_id, parent_id in zip(self.levels, matches, matches[1:]):
+            if (polygon_id != NO_MATCH and parent_id != NO_MATCH
+                    and self.parents[level].get(polygon_id, NO_MATCH) != parent_id):
+                return False
+        return True
+
+    def outside(self, level):
+        """Return the ids of the points outside every polygon of level."""
+        return array(ID_TYPECODE, (point_id for point_id, polygon_id in zip(self.point_ids, self.matches[level])
+                                   if polygon_id == NO_MATCH))
+
+    def mismatches(self, level):
+        """Return the ids of the points whose polygon of level is not in their polygon of the next level.
+
+        Points outside either polygon are reported by outside() instead.
+        """
+        parent_level = self.levels[self.levels.index(level) + 1]
+        parents = self.parents[level]
+        return array(ID_TYPECODE, (
+            point_id for point_id, polygon_id, parent_id
+            in zip(self.point_ids, self.matches[level], self.matches[parent_level])
+            if polygon_id != NO_MATCH and parent_id != NO_MATCH and parents.get(polygon_id, NO_MATCH) != parent_id))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Logging for the QP Checker.
+
+Everything is logged to LOGGER with the standard logging module. Messages
+use %-style arguments, so they are only formatted when a handler is going
+to emit them; per-layer events are DEBUG and cost a level check when the
+threshold is higher. Events can carry structured fields through
+extra={'event': ..., 'layer': ...}; the JSON lines handler writes them
+out next to the message.
+
+Handlers provided here:
+
+* RingBufferHandler keeps the last records in memory, so they can be shown
+  after a run without logging everything somewhere.
+* JsonLinesHandler writes one JSON object per record, the machine-readable
+  event log of batch runs.
+
+PROJECT_FILTER stamps every record of LOGGER with the project being
+checked; set PROJECT_FILTER.project when starting on a project.
+"""
+
+import collections
+import json
+import logging
+import threading
+
+LOGGER_NAME = 'qp_checker'
+LOGGER = logging.getLogger(LOGGER_NAME)
+
+DEFAULT_RING_SIZE = 1000
+# Attributes every LogRecord has; anything else was passed through extra
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def record_fields(record):
+    """Return the structured fields passed to a log call through extra."""
+    return {name: value for name, value in vars(record).items() if name not in RECORD_ATTRIBUTES}
+
+
+class RingBufferHandler(logging.Handler):
+    """Keep the last capacity records in memory."""
+
+    def __init__(self, capacity=DEFAULT_RING_SIZE, level=logging.NOTSET):
+        super().__init__(level)
+        self.records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def lines(self):
+        """Return the buffered records formatted as text."""
+        return [self.format(record) for record in self.records]
+
+    def clear(self):
+        """Drop the buffered records."""
+        self.records.clear()
+
+
+class JsonLinesHandler(logging.Handler):
+    """Write each record as a JSON object on its own line.
+
+    Every line is written with a single write() and flushed, under a lock
+    shared by the threads of the process. Only one process should write a
+    file: batch workers send their records to the parent instead (see
+    configure_worker_logging() in qp_batch).
+    """
+
+    def __init__(self, path, level=logging.NOTSET):
+        super().__init__(level)
+        self.path = path
+        self.stream = open(path, 'a', encoding='utf-8')
+        self._write_lock = threading.Lock()
+
+    def emit(self, record):
+        try:
+            entry = {
+                'time': record.created,
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage(),
+            }
+            entry.update(record_fields(record))
+            if record.exc_info:
+                entry['exception'] = self.formatException(record.exc_info)
+            line = json.dumps(entry, default=str) + '\n'
+            with self._write_lock:
+                self.stream.write(line)
+                self.stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.stream.close()
+        super().close()
+
+
+class ProjectFilter(logging.Filter):
+    """Add the project being checked to every record as record.project."""
+
+    def __init__(self):
+        super().__init__()
+        self.project = None
+
+    def filter(self, record):
+        record.project = self.project
+        return True
+
+
+PROJECT_FILTER = ProjectFilter()
+LOGGER.addFilter(PROJECT_FILTER)
+
+# notify() levels
+NOTIFY_LEVELS = {'info': logging.INFO, 'warning': logging.WARNING, 'critical': logging.ERROR}
+
+
+def set_level(level):
+    """Set the threshold of LOGGER; level is a number or a name like 'DEBUG'."""
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    LOGGER.setLevel(level)
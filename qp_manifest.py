@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Incremental batch runs: remember which projects are already checked.
+
+The manifest is a small SQLite database kept in the root folder of a
+batch run. For every project it stores the fingerprint of the project
+file as it was left by the checker, together with the fingerprint of the
+inputs it was checked with: the QML files, CSVs and rename rules of the
+QML folder and the plugin version. A project whose file and inputs still match is
+skipped by the next run.
+
+The QA stages read the layer data (the SF, GP and base layer shapefiles),
+so the size and modification time of every local file the project's
+layers read is part of the project's fingerprint too: editing a
+shapefile makes its projects due for a check again.
+"""
+
+import configparser
+import hashlib
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote, urlparse
+
+from .qp_project_io import read_project_xml
+
+MANIFEST_NAME = '.qp_checker_manifest.sqlite'
+INPUT_EXTENSIONS = ('.qml', '.csv', '.json')
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files next to a shapefile that hold part of its data
+SHAPEFILE_SIDECARS = ('.dbf', '.shx', '.prj', '.cpg')
+
+
+def file_digest(path):
+    """Return the SHA-1 hex digest of the content of path."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def plugin_version():
+    """Return the plugin version from metadata.txt."""
+    parser = configparser.ConfigParser()
+    parser.read(os.path.join(os.path.dirname(__file__), 'metadata.txt'))
+    return parser.get('general', 'version', fallback='unknown')
+
+
+def inputs_fingerprint(qml_folder, version=None, options=()):
+    """Return a digest of everything a check depends on besides the project.
+
+    That is the plugin version, every QML, CSV and rules (JSON) file of
+    qml_folder and the options, strings for the settings that change what
+    a check writes.
+    """
+    digest = hashlib.sha1((version or plugin_version()).encode('utf-8'))
+    for option in options:
+        digest.update(f"\0{option}".encode('utf-8'))
+    for name in sorted(os.listdir(qml_folder)):
+        if name.lower().endswith(INPUT_EXTENSIONS):
+            digest.update(f"\0{name}\0{file_digest(os.path.join(qml_folder, name))}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def datasource_path(datasource, project_dir):
+    """Return the file of a layer data source, or None if it is not a file.
+
+    Handles 'file|options' sources, 'file://' URIs (delimited text) and
+    paths relative to project_dir.
+    """
+    if datasource.startswith('file:'):
+        path = unquote(urlparse(datasource).path)
+    else:
+        path = datasource.split('|', 1)[0]
+    if not path:
+        return None
+    return os.path.normpath(os.path.join(project_dir, path))
+
+
+def layer_data_files(qgs_file):
+    """Return the local files the layers of a project read, sorted; missing files are left out."""
+    data = read_project_xml(qgs_file)
+    root = ET.fromstring(data[data.find(b'<qgis'):])
+    project_dir = os.path.dirname(os.path.abspath(qgs_file))
+    paths = set()
+    for maplayer in root.iter('maplayer'):
+        path = datasource_path((maplayer.findtext('datasource') or '').strip(), project_dir)
+        if path is None:
+            continue
+        paths.add(path)
+        stem, extension = os.path.splitext(path)
+        if extension.lower() == '.shp':
+            paths.update(stem + sidecar for sidecar in SHAPEFILE_SIDECARS)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def data_fingerprint(qgs_file):
+    """Return a digest of the paths, sizes and modification times of the layer_data_files() of a project."""
+    digest = hashlib.sha1()
+    for path in layer_data_files(qgs_file):
+        stat = os.stat(path)
+        digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Fingerprints of the projects checked below a root folder."""
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS projects ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER, mtime_ns INTEGER, digest TEXT,"
+            " inputs TEXT, data TEXT)")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(projects)")]
+        if 'data' not in columns:  # Manifest of an older version
+            self.connection.execute("ALTER TABLE projects ADD COLUMN data TEXT")
+
+    @classmethod
+    def for_root(cls, root):
+        """Open (or create) the manifest of the batch root folder root."""
+        return cls(os.path.join(root, MANIFEST_NAME))
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _key(self, qgs_file):
+        return os.path.relpath(os.path.abspath(qgs_file), self.root).replace(os.sep, '/')
+
+    def is_current(self, qgs_file, inputs):
+        """Return True if qgs_file was checked with inputs and neither it nor its layer data changed since.
+
+        The file is only hashed when its size or modification time moved.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, digest, inputs, data FROM projects WHERE path = ?",
+            (self._key(qgs_file),)).fetchone()
+        if row is None or row[3] != inputs:
+            return False
+        stat = os.stat(qgs_file)
+        if (stat.st_size, stat.st_mtime_ns) != (row[0], row[1]):
+            if stat.st_size != row[0] or file_digest(qgs_file) != row[2]:
+                return False
+        return data_fingerprint(qgs_file) == row[4]
+
+    def record(self, qgs_file, inputs):
+        """Remember that qgs_file and its layer data, as they are now, have been checked with inputs."""
+        stat = os.stat(qgs_file)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO projects (path, size, mtime_ns, digest, inputs, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (self._key(qgs_file), stat.st_size, stat.st_mtime_ns, file_digest(qgs_file), inputs,
+             data_fingerprint(qgs_file)))
+        self.connection.commit()
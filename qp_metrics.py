@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Timings and operation counts of a QP Checker run, to see where the time goes.
+
+METRICS records the wall and CPU time of every stage of the current run
+and counts the operations that make a stage slow: layer renames, layer
+tree inserts and removes, data source changes, styles applied and bytes
+copied. The checkers reset it at the start of every project. The dialog
+shows summary() when a check is done; the batch runner writes as_dict()
+of every project as JSON.
+
+CPU time is the process time, so it includes every thread: with the
+background task it also covers what the interface did meanwhile.
+"""
+
+import json
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Counter names
+COUNT_RENAMES = 'layer_renames'  # setName() calls
+COUNT_TREE_INSERTS = 'tree_inserts'
+COUNT_TREE_REMOVES = 'tree_removes'
+COUNT_SOURCE_CHANGES = 'source_changes'  # layers pointed at another data source
+COUNT_STYLES = 'styles_applied'
+COUNT_BYTES_COPIED = 'bytes_copied'
+COUNT_BYTES_CLONED = 'bytes_cloned'  # copied as a reflink, sharing the source's blocks
+
+# Time spent in one stage of a run, in seconds
+StageTiming = namedtuple('StageTiming', 'label wall cpu')
+
+
+class Metrics:
+    """Stage timings and operation counters of the current run."""
+
+    def __init__(self, clock=time.perf_counter, cpu_clock=time.process_time):
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+        self.stages = []
+        self.counters = {}
+
+    def reset(self):
+        """Forget the previous run."""
+        self.stages = []
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, label):
+        """Time the body of the with statement as the stage label, even if it raises."""
+        wall, cpu = self.clock(), self.cpu_clock()
+        try:
+            yield
+        finally:
+            self.stages.append(StageTiming(label, self.clock() - wall, self.cpu_clock() - cpu))
+
+    def count(self, name, amount=1):
+        """Add amount to the counter name."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @property
+    def wall(self):
+        """Wall time of all stages."""
+        return sum(stage.wall for stage in self.stages)
+
+    @property
+    def cpu(self):
+        """CPU time of all stages."""
+        return sum(stage.cpu for stage in self.stages)
+
+    def as_dict(self):
+        """Return the timings and counters as plain data, for JSON."""
+        return {
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'stages': [stage._asdict() for stage in self.stages],
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def summary(self):
+        """Return the stages, slowest first, and the counters as lines of text."""
+        total = self.wall or 1.0
+        lines = [f"{stage.label}: {stage.wall * 1000:.0f} ms ({100.0 * stage.wall / total:.0f}%), "
+                 f"CPU {stage.cpu * 1000:.0f} ms"
+                 for stage in sorted(self.stages, key=lambda stage: stage.wall, reverse=True)]
+        lines.append(f"Total: {self.wall * 1000:.0f} ms, CPU {self.cpu * 1000:.0f} ms")
+        lines += [f"{name.replace('_', ' ').capitalize()}: {value}" for name, value in sorted(self.counters.items())]
+        return "\n".join(lines)
+
+
+def write_metrics(path, data):
+    """Write the metrics data (see Metrics.as_dict()) as JSON to path."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+
+
+# Metrics of the project being checked in this process
+METRICS = Metrics()
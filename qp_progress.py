@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Progress reporting for the QP Checker pipeline.
+
+A ProgressReporter knows the stages of a run and their weights, so a
+stage that reports its own progress moves the overall percentage within
+its share of the run. The percentage is passed on to sinks, functions
+called as sink(percent, label), at most max_rate times per second; the
+start of a stage and the end of the run are always passed on.
+
+Sinks for the dialog and the background task live with the QGIS code; the
+ones here are for headless runs.
+"""
+
+import logging
+import sys
+import time
+
+DEFAULT_MAX_RATE = 20  # sink updates per second
+
+
+class ProgressReporter:
+    """Overall progress of a run of weighted stages, throttled for the sinks."""
+
+    def __init__(self, sinks=None, max_rate=DEFAULT_MAX_RATE, clock=time.monotonic):
+        self.sinks = list(sinks or [])
+        self.min_interval = 1.0 / max_rate
+        self.clock = clock
+        self.labels = []
+        self.percent = 0.0
+        self.label = ''
+        self._starts = []  # share of the run done before each stage, in percent
+        self._shares = []  # share of the run of each stage, in percent
+        self._stage = None
+        self._last_sent = None
+
+    def start(self, stages):
+        """Start a run of stages, a list of (label, weight) pairs."""
+        total = sum(weight for label, weight in stages) or 1
+        self.labels = [label for label, weight in stages]
+        self._shares = [100.0 * weight / total for label, weight in stages]
+        self._starts = []
+        done = 0.0
+        for share in self._shares:
+            self._starts.append(done)
+            done += share
+        self._stage = None
+        self.label = ''
+        self._set(0.0, force=True)
+
+    def begin_stage(self, index):
+        """Enter stage index of the run."""
+        self._stage = index
+        self.label = self.labels[index]
+        self._set(self._starts[index], force=True)
+
+    def update(self, done, total):
+        """Report that done of total steps of the current stage are finished.
+
+        Cheap enough for inner loops: sinks only hear about it when the
+        last update they got is more than 1/max_rate seconds old.
+        """
+        if self._stage is None or total <= 0:
+            return
+        now = self.clock()
+        if self._last_sent is not None and now - self._last_sent < self.min_interval:
+            return
+        fraction = min(done / total, 1.0)
+        self._set(self._starts[self._stage] + self._shares[self._stage] * fraction, now=now)
+
+    def finish(self):
+        """End the run at 100%."""
+        self._stage = None
+        self._set(100.0, force=True)
+
+    def _set(self, percent, force=False, now=None):
+        self.percent = percent
+        now = self.clock() if now is None else now
+        if not force and self._last_sent is not None and now - self._last_sent < self.min_interval:
+            return
+        self._last_sent = now
+        for sink in self.sinks:
+            sink(percent, self.label)
+
+
+def print_progress(percent, label, stream=None):
+    """Sink writing the progress to the console, overwriting the previous line."""
+    stream = stream or sys.stderr
+    stream.write(f"\r{percent:5.1f}% {label:<40}")
+    if percent >= 100.0:
+        stream.write("\n")
+    stream.flush()
+
+
+def log_progress(logger, level=logging.INFO):
+    """Return a sink sending the progress to logger, for runs whose stderr is not a terminal."""
+    def sink(percent, label):
+        logger.log(level, "progress %.1f%% %s", percent, label,
+                   extra={'event': 'progress', 'percent': round(percent, 1), 'stage': label})
+    return sink
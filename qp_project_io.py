@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Reading and writing the project XML of .qgs and .qgz files without QGIS.
+
+A .qgz is rewritten without extracting it: only the .qgs member is read
+and recompressed, every other member (the auxiliary storage .qgd and
+friends) is copied over byte for byte in its compressed form.
+
+Projects are always written to a temporary file next to the original and
+moved into place with os.replace(), so a crash never leaves a half
+written project behind.
+"""
+
+import copy
+import os
+import shutil
+import struct
+import time
+import uuid
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Size of the fixed part of a zip local file header
+LOCAL_HEADER_SIZE = 30
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+# General purpose flag bit telling that CRC and sizes follow the data
+DATA_DESCRIPTOR_FLAG = 0x08
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Attributes of the <qgis> root element that change on every save
+VOLATILE_ROOT_ATTRIBUTES = ('saveDateTime', 'saveUser', 'saveUserFull')
+
+
+def is_qgz(path):
+    """Return True if path is a zipped (.qgz) project."""
+    return path.lower().endswith('.qgz')
+
+
+def qgs_member(archive):
+    """Return the ZipInfo of the project file stored in a .qgz archive."""
+    for info in archive.infolist():
+        if info.filename.lower().endswith('.qgs'):
+            return info
+    raise ValueError(f"No .qgs project found in {archive.filename}")
+
+
+def read_project_xml(path):
+    """Return the project XML of a .qgs or .qgz file as bytes."""
+    if not is_qgz(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    with zipfile.ZipFile(path) as archive:
+        return archive.read(qgs_member(archive))
+
+
+def project_xml_equal(first, second):
+    """Return True if two project XML documents differ only in their save stamp."""
+    if first == second:
+        return True
+    roots = []
+    for data in (first, second):
+        root = ET.fromstring(data[data.find(b'<qgis'):])
+        for name in VOLATILE_ROOT_ATTRIBUTES:
+            root.attrib.pop(name, None)
+        roots.append(root)
+    return ET.tostring(roots[0]) == ET.tostring(roots[1])
+
+
+def temporary_sibling(path):
+    """Return an unused file name next to path with the same extension.
+
+    The file is not created, so QGIS does not make a backup copy of it.
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    stem, extension = os.path.splitext(name)
+    return os.path.join(folder, f".{stem}.{uuid.uuid4().hex[:8]}{extension}")
+
+
+def replace_file(temp_path, path):
+    """Move temp_path over path in one step, keeping the permissions of path."""
+    if os.path.exists(path):
+        shutil.copymode(path, temp_path)
+    os.replace(temp_path, path)
+
+
+def copy_member_raw(source, info, archive):
+    """Append member info of the open zip file source to archive as is.
+
+    The compressed data is copied without being decompressed. zipfile has
+    no public API for this, so the member is appended to the archive's
+    file and registered the way ZipFile.write() does it.
+    """
+    source.seek(info.header_offset)
+    header = source.read(LOCAL_HEADER_SIZE)
+    if header[:4] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    source.seek(info.header_offset + LOCAL_HEADER_SIZE + name_length + extra_length)
+
+    copied = copy.copy(info)
+    copied.flag_bits &= ~DATA_DESCRIPTOR_FLAG  # sizes are known, write them in the header
+    copied.header_offset = archive.fp.tell()
+    archive.fp.write(copied.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.read(min(remaining, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+        archive.fp.write(chunk)
+        remaining -= len(chunk)
+
+    archive.filelist.append(copied)
+    archive.NameToInfo[copied.filename] = copied
+    archive.start_dir = archive.fp.tell()
+
+
+def write_qgz(path, data):
+    """Replace the .qgs member of the .qgz archive at path with data.
+
+    The new archive is written next to the old one and moved into place,
+    so readers never see a half written project.
+    """
+    temp_path = temporary_sibling(path)
+    try:
+        with open(path, 'rb') as source, zipfile.ZipFile(source) as old:
+            member = qgs_member(old)
+            with zipfile.ZipFile(temp_path, 'w') as new:
+                for info in old.infolist():
+                    if info.filename != member.filename:
+                        copy_member_raw(source, info, new)
+                        continue
+                    project = zipfile.ZipInfo(info.filename, date_time=time.localtime()[:6])
+                    project.compress_type = info.compress_type
+                    project.external_attr = info.external_attr
+                    new.writestr(project, data)
+        replace_file(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_project_xml(path, data):
+    """Replace the project XML of a .qgs or .qgz file with data, atomically."""
+    if is_qgz(path):
+        write_qgz(path, data)
+        return
+    temp_path = temporary_sibling(path)
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        replace_file(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
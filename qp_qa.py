@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""QA of the base and form layers.
+
+Are the points inside the right polygons, is any SF/GP point entered
+twice, and do the SF/GP attributes use codes of the lookup tables?
+
+The checks run on the task thread. They read layers through the
+LayerSources made on the main thread (see layer_source()) and stop early
+when their QgsFeedback is cancelled.
+
+Every polygon layer is put in a QgsSpatialIndex bulk loaded from one
+feature iterator, which also keeps the geometries, so the layer is read
+once. A point is located by asking the index for the few polygons whose
+bounding box holds it and testing those with a prepared geometry engine;
+polygons are only prepared once a point lands in their bounding box.
+The results are collected in a HierarchyJoin (see qp_hierarchy), which
+settles points on the boundary between two polygons.
+
+Duplicates are found by qp_grid on coordinates in metres: projected
+layers are scaled by their map units, geographic ones projected on a
+plane tangent at their mean latitude, which is exact enough over a few
+metres.
+
+Attributes are checked by qp_domains on features streamed without their
+geometries and with only the coded fields, one feature at a time.
+"""
+
+import math
+from collections import namedtuple
+
+from qgis.core import (
+    QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCsException, QgsFeatureRequest, QgsFields,
+    QgsGeometry, QgsPoint, QgsPointXY, QgsRectangle, QgsSpatialIndex, QgsUnitTypes,
+    QgsVectorLayerFeatureSource)
+from qgis.PyQt.QtCore import QVariant
+
+from .qp_domains import validate_rows
+from .qp_grid import duplicate_clusters
+from .qp_hierarchy import NO_MATCH, HierarchyJoin
+
+METRES_PER_DEGREE = 111320.0  # along a meridian, and along the equator
+
+# A layer to read off the main thread: a QgsVectorLayerFeatureSource and
+# copies of the layer properties the checks need, all taken on the main
+# thread by layer_source().
+LayerSource = namedtuple('LayerSource', 'id name source crs fields count')
+
+
+def layer_source(layer):
+    """Return the LayerSource of a vector layer. Call it on the main thread."""
+    return LayerSource(layer.id(), layer.name(), QgsVectorLayerFeatureSource(layer),
+                       QgsCoordinateReferenceSystem(layer.crs()), QgsFields(layer.fields()), layer.featureCount())
+
+
+def canceled(feedback):
+    """Return True if the QgsFeedback feedback, if any, has been cancelled."""
+    return feedback is not None and feedback.isCanceled()
+
+
+def feature_ids(layer):
+    """Return the ids of the features of the LayerSource layer."""
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setNoAttributes()
+    return [feature.id() for feature in layer.source.getFeatures(request)]
+
+
+class PolygonLocator:
+    """Find the polygon of a LayerSource containing a point.
+
+    context is the QgsCoordinateTransformContext of the project, for points
+    of another CRS. Building the index stops early when feedback is
+    cancelled.
+    """
+
+    def __init__(self, layer, context, feedback=None):
+        self.layer = layer
+        self.context = context
+        request = QgsFeatureRequest().setNoAttributes()
+        self.index = QgsSpatialIndex(layer.source.getFeatures(request), feedback,
+                                     QgsSpatialIndex.FlagStoreFeatureGeometries)
+        self._prepared = {}  # feature id -> (geometry, prepared engine of it)
+        self._transforms = {}  # authid of a point CRS -> transform to the layer CRS, None if the same
+
+    def _engine(self, fid):
+        prepared = self._prepared.get(fid)
+        if prepared is None:
+            geometry = self.index.geometry(fid)  # kept alive as long as its engine
+            engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+            engine.prepareGeometry()
+            prepared = self._prepared[fid] = (geometry, engine)
+        return prepared[1]
+
+    def _transform(self, crs):
+        key = crs.authid() or crs.toWkt()
+        if key not in self._transforms:
+            self._transforms[key] = (None if crs == self.layer.crs
+                                     else QgsCoordinateTransform(crs, self.layer.crs, self.context))
+        return self._transforms[key]
+
+    def locate_all(self, point, crs):
+        """Return the ids of every polygon containing the QgsPointXY point of crs.
+
+        Points on a boundary count as inside, so a point on a boundary
+        shared by two polygons is in both.
+        """
+        transform = self._transform(crs)
+        if transform is not None:
+            try:
+                point = transform.transform(point)
+            except QgsCsException:
+                return []
+        geometry = QgsPoint(point)
+        return [fid for fid in self.index.intersects(QgsRectangle(point, point))
+                if self._engine(fid).intersects(geometry)]
+
+    def locate(self, point, crs):
+        """Return the id of the first polygon containing the QgsPointXY point of crs, or NO_MATCH."""
+        return next(iter(self.locate_all(point, crs)), NO_MATCH)
+
+    def polygon_point(self, fid):
+        """Return a point inside polygon fid, or None for an empty geometry."""
+        point = self.index.geometry(fid).pointOnSurface()
+        return None if point.isEmpty() else point.asPoint()
+
+
+def feature_point(geometry):
+    """Return the point of a (multi)point geometry as a QgsPointXY, or None if it is empty."""
+    if geometry.isNull() or geometry.isEmpty():
+        return None
+    return QgsPointXY(geometry.vertexAt(0))
+
+
+def polygon_parents(locators, feedback=None):
+    """Return the parent of every polygon of locators as {level: {polygon id: parent id}}.
+
+    locators is a list of (level name, PolygonLocator), smallest level
+    first. The parent of a polygon is looked up in the next level's layer
+    from a point inside it; the polygons of the last level have none.
+    Stops early, leaving parents out, when feedback is cancelled.
+    """
+    parents = {level: {} for level, locator in locators}
+    for (level, locator), (parent_level, parent) in zip(locators, locators[1:]):
+        for fid in feature_ids(locator.layer):
+            if canceled(feedback):
+                return parents
+            point = locator.polygon_point(fid)
+            if point is not None:
+                parents[level][fid] = parent.locate(point, locator.layer.crs)
+    return parents
+
+
+def join_points(point_layer, locators, parents, progress=None, feedback=None):
+    """Join every point of the LayerSource point_layer to the polygon layers of locators, smallest level first.
+
+    locators is a list of (level name, PolygonLocator) and parents the
+    polygon_parents() of it, computed once for all point layers. A point on
+    a shared boundary is joined to the polygons that nest, see
+    HierarchyJoin.add_candidates(). Returns a HierarchyJoin, of the points
+    read so far if feedback is cancelled.
+    progress, if given, is called as progress(done, total).
+    """
+    join = HierarchyJoin([level for level, locator in locators], parents)
+    crs = point_layer.crs
+    total = point_layer.count
+    request = QgsFeatureRequest().setNoAttributes()
+    for done, feature in enumerate(point_layer.source.getFeatures(request)):
+        if canceled(feedback):
+            break
+        point = feature_point(feature.geometry())
+        if point is None:
+            join.add(feature.id(), [NO_MATCH] * len(locators))
+        else:
+            join.add_candidates(feature.id(), [locator.locate_all(point, crs) for level, locator in locators])
+        if progress is not None:
+            progress(done + 1, total)
+    return join
+
+
+def layer_points(layer, feedback=None):
+    """Return the points of the LayerSource layer as (feature id, x, y), in layer units.
+
+    Empty geometries are left out; reading stops when feedback is cancelled.
+    """
+    points = []
+    for feature in layer.source.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        if canceled(feedback):
+            break
+        point = feature_point(feature.geometry())
+        if point is not None:
+            points.append((feature.id(), point.x(), point.y()))
+    return points
+
+
+def metric_points(layer, feedback=None):
+    """Return the points of the LayerSource layer as (feature id, x, y) with x and y in metres."""
+    points = layer_points(layer, feedback)
+    crs = layer.crs
+    if crs.isGeographic():
+        if not points:
+            return points
+        mean_latitude = sum(y for point_id, x, y in points) / len(points)
+        x_scale = METRES_PER_DEGREE * math.cos(math.radians(mean_latitude))
+        return [(point_id, x * x_scale, y * METRES_PER_DEGREE) for point_id, x, y in points]
+    scale = QgsUnitTypes.fromUnitToUnitFactor(crs.mapUnits(), QgsUnitTypes.DistanceMeters)
+    if scale == 1.0:
+        return points
+    return [(point_id, x * scale, y * scale) for point_id, x, y in points]
+
+
+def duplicate_points(layer, tolerance, feedback=None):
+    """Return the clusters of points of the LayerSource layer within tolerance metres of each other.
+
+    The clusters are lists of feature ids.
+    """
+    return duplicate_clusters(metric_points(layer, feedback), tolerance)
+
+
+def attribute_value(value):
+    """Return an attribute value with a NULL QVariant as None."""
+    return None if isinstance(value, QVariant) and value.isNull() else value
+
+
+def attribute_violations(layer, rules, feedback=None):
+    """Yield the qp_domains Violations of the features of the LayerSource layer against the DomainRules rules.
+
+    Rules on fields layer does not have are skipped. Stops when feedback is
+    cancelled.
+    """
+    fields = layer.fields
+    rules = [rule for rule in rules if fields.indexOf(rule.field) >= 0]
+    if not rules:
+        return
+    indexes = [fields.indexOf(rule.field) for rule in rules]
+    request = (QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+               .setSubsetOfAttributes(sorted(set(indexes))))
+
+    def rows():
+        for feature in layer.source.getFeatures(request):
+            if canceled(feedback):
+                return
+            yield feature.id(), [attribute_value(feature.attribute(index)) for index in indexes]
+
+    yield from validate_rows(rows(), rules)
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""Naming and ordering rules of the QP Checker.
+
+The rules are kept free of QGIS so that the QGIS stages in qp_checker.py
+and the pure-XML engine in qp_xml.py apply exactly the same checks.
+"""
+
+import csv
+import json
+import os
+import re
+from collections import Counter, namedtuple
+
+SF_QML_NAME = "2. 2024 POPCEN-CBMS Form 8A.qml"
+GP_QML_NAME = "3. 2024 POPCEN-CBMS Form 8B.qml"
+
+# Value Relation CSVs as shipped in the QML folder and as deployed next to the project
+SF_CSV_SOURCE_NAME = "2024_POPCEN-CBMS_SF_Specific_Types.csv"
+GP_CSV_SOURCE_NAME = "2024_POPCEN-CBMS_GP_Fund.csv"
+SF_CSV_DEST_NAME = "2024 POPCEN-CBMS SF Specific Types.csv"
+GP_CSV_DEST_NAME = "2024 POPCEN-CBMS GP Fund.csv"
+
+BASE_LAYER_GROUP_NAMES = ['Base Layers', 'Base layers', 'Base Layer', 'Base layer', 'base layers']
+VALUE_RELATION_GROUP_NAMES = ["Value Relation", "Value Relations", "Value Relations "]  # Check for trailing space
+FORM_GROUP_MARKER = 'Form 8'
+
+SF_LAYER_ENDINGS = ('_SF', '_SF.shp')
+GP_LAYER_ENDINGS = ('_GP', '_GP.shp')
+
+# Suffix -> new suffix. Earlier entries win when a name contains several.
+# A RULES_FILE_NAME file in the QML folder replaces this table.
+SUFFIXES_TO_RENAME = {
+    'bgy': 'bgy',
+    'ea2024': 'ea',
+    'ea': 'ea',
+    'bldg': 'bldgpts',
+    'bldg_points': 'bldgpts',
+    'landmark': 'landmark',
+    'road': 'road',
+    'road_updated': 'road',
+    'updated_road': 'road',
+    'updated_river': 'river',
+    'river': 'river',
+    'river_updated': 'river',
+    'block': 'block',
+    'Block': 'block',
+    'block2024': 'block',
+}
+
+RULES_FILE_NAME = "qp_rules.json"
+
+STANDARD_SF_NAME = "2024 POPCEN-CBMS SF Specific Types"
+STANDARD_GP_NAME = "2024 POPCEN-CBMS GP Fund"
+
+# Value Relation layers: role -> standard name. Any spelling with the same
+# value_relation_key() is renamed to the standard name. The "value_relations"
+# table of a RULES_FILE_NAME file replaces these names for a new census round.
+VALUE_RELATION_SF = 'sf'
+VALUE_RELATION_GP = 'gp'
+VALUE_RELATION_NAMES = {
+    VALUE_RELATION_SF: STANDARD_SF_NAME,
+    VALUE_RELATION_GP: STANDARD_GP_NAME,
+}
+# Runs of these characters are one separator in a value_relation_key()
+VALUE_RELATION_SEPARATORS = re.compile(r'[\s_-]+')
+
+# Order of the base layers from the bottom of the group to the top.
+# 'bldg_point_variants' matches any of BLDG_POINT_VARIANTS.
+BASE_LAYER_ORDER = ['river', 'road', 'block', 'ea', 'bgy', 'landmark', 'bldg_point_variants']
+BLDG_POINT_VARIANTS = ['bldg_point', 'bldg_points', 'bldgps', 'bldgp', 'bldgpts', 'bldgpt']
+
+# Nested polygon base layers, smallest first, as BASE_LAYER_ORDER entries:
+# every building point lies in a block, in an EA, in a barangay.
+CONTAINMENT_LEVELS = ['block', 'ea', 'bgy']
+CONTAINMENT_POINTS = 'bldg_point_variants'
+
+# SF/GP points closer than this many metres are reported as duplicates
+DUPLICATE_TOLERANCE = 1.0
+
+
+def is_sf_layer(name):
+    """Return True if name is the Form 8A service facility layer."""
+    return name.endswith(SF_LAYER_ENDINGS)
+
+
+def is_gp_layer(name):
+    """Return True if name is the Form 8B government program layer."""
+    return name.endswith(GP_LAYER_ENDINGS)
+
+
+def find_eight_digit_id(names):
+    """Return the 8-digit barangay identifier taken from the first SF layer name."""
+    for name in names:
+        if is_sf_layer(name):
+            return name[:8]
+    return None
+
+
+def base_layer_name(name, eight_digit_id):
+    """Return the new name of a base layer, or None if it is already fine.
+
+    The 5-digit identifier of the layer is replaced with the 8-digit one
+    unless the name already starts with 8 digits.
+    """
+    if eight_digit_id is None:
+        return None
+    if len(name) >= 8 and not name[:8].isdigit():
+        return eight_digit_id + name[5:]
+    return None
+
+
+def value_relation_key(name):
+    """Return the key of a Value Relation layer name: case, spaces, '_' and '-' ignored."""
+    return VALUE_RELATION_SEPARATORS.sub(' ', name).strip().casefold()
+
+
+class RenameRules:
+    """Suffix rename rules compiled into a single matcher, and the Value Relation names.
+
+    suffixes maps each suffix to its new suffix, in priority order. All the
+    suffixes are combined into one regular expression that is run over a
+    name once, instead of testing every suffix with 'in'. The expression
+    sits in a lookahead so that overlapping occurrences are found too; at
+    a given position only the longest suffix is reported, so every suffix
+    that is a prefix of it is counted as found along with it.
+
+    value_relations maps Value Relation roles (VALUE_RELATION_SF/GP) to
+    their standard names; roles left out keep their VALUE_RELATION_NAMES
+    name. Layer names are matched to a role by value_relation_key().
+    """
+
+    def __init__(self, suffixes=None, value_relations=None):
+        self.suffixes = dict(SUFFIXES_TO_RENAME if suffixes is None else suffixes)
+        self.value_relations = dict(VALUE_RELATION_NAMES, **(value_relations or {}))
+        self._value_relation_roles = {value_relation_key(name): role
+                                      for role, name in self.value_relations.items()}
+        self._priority = {suffix: index for index, suffix in enumerate(self.suffixes)}
+        self._prefixes = {suffix: [other for other in self.suffixes if suffix.startswith(other)]
+                          for suffix in self.suffixes}
+        self._pattern = None
+        if self.suffixes:
+            alternatives = sorted(self.suffixes, key=len, reverse=True)
+            self._pattern = re.compile('(?=(' + '|'.join(map(re.escape, alternatives)) + '))')
+
+    @classmethod
+    def from_file(cls, path):
+        """Load the rules of a JSON file.
+
+        The file holds {"suffixes": {"suffix": "new suffix", ...},
+        "value_relations": {"sf": "standard name", "gp": "standard name"}};
+        either table may be left out to keep the built-in one. Raises
+        ValueError if the file does not hold valid rule tables.
+        """
+        with open(path, encoding='utf-8') as f:
+            try:
+                rules = json.load(f)
+                suffixes = rules.get('suffixes')
+                value_relations = rules.get('value_relations')
+            except (AttributeError, json.JSONDecodeError) as e:
+                raise ValueError(f"{path} is not a rules file: {e}")
+        if suffixes is None and value_relations is None:
+            raise ValueError(f"{path} has no 'suffixes' or 'value_relations' table")
+        if suffixes is not None and (not isinstance(suffixes, dict) or not all(
+                isinstance(suffix, str) and suffix and isinstance(new_suffix, str)
+                for suffix, new_suffix in suffixes.items())):
+            raise ValueError(f"{path} has no valid 'suffixes' table")
+        if value_relations is not None and (not isinstance(value_relations, dict) or not all(
+                role in VALUE_RELATION_NAMES and isinstance(name, str) and value_relation_key(name)
+                for role, name in value_relations.items())):
+            raise ValueError(f"{path} has no valid 'value_relations' table "
+                             f"(roles: {', '.join(VALUE_RELATION_NAMES)})")
+        return cls(suffixes, value_relations)
+
+    @classmethod
+    def for_folder(cls, folder):
+        """Load the RULES_FILE_NAME file of folder, or the built-in rules without one."""
+        path = os.path.join(folder, RULES_FILE_NAME) if folder else None
+        if path and os.path.exists(path):
+            return cls.from_file(path)
+        return cls()
+
+    def suffix_name(self, name):
+        """Return name with its suffix normalised, or None if nothing matches.
+
+        Of the suffixes found in name, the first one in table order whose
+        new suffix name does not already end with is used.
+        """
+        if self._pattern is None:
+            return None
+        found = set()
+        for match in self._pattern.finditer(name):
+            found.update(self._prefixes[match.group(1)])
+        for suffix in sorted(found, key=self._priority.get):
+            new_suffix = self.suffixes[suffix]
+            if not name.endswith(new_suffix):
+                return name.split(suffix)[0] + new_suffix
+        return None
+
+    def value_relation_role(self, name):
+        """Return the role (VALUE_RELATION_SF/GP) of a Value Relation layer name, or None."""
+        return self._value_relation_roles.get(value_relation_key(name))
+
+    def standard_value_relation_name(self, name):
+        """Return the standard name for a Value Relation layer name, or None."""
+        role = self.value_relation_role(name)
+        return None if role is None else self.value_relations[role]
+
+
+class NameIndex:
+    """Live count of the layer names of a project, for constant time lookups."""
+
+    def __init__(self, names=()):
+        self._counts = Counter(names)
+
+    def __contains__(self, name):
+        return self._counts[name] > 0
+
+    def rename(self, old_name, new_name):
+        """Record that a layer called old_name is now called new_name."""
+        self._counts[old_name] -= 1
+        if self._counts[old_name] <= 0:
+            del self._counts[old_name]
+        self._counts[new_name] += 1
+
+
+DEFAULT_RENAME_RULES = RenameRules()
+
+
+def form_layer_name(name, eight_digit_id):
+    """Return the '_SF'/'_GP' name for a '_SF.shp'/'_GP.shp' layer, else None."""
+    if eight_digit_id is None:
+        return None
+    if name.endswith('_SF.shp'):
+        return eight_digit_id + '_SF'
+    if name.endswith('_GP.shp'):
+        return eight_digit_id + '_GP'
+    return None
+
+
+# One rename of a rename plan. reason is one of the RENAME_* constants.
+RenameStep = namedtuple('RenameStep', 'layer_id old_name new_name reason')
+
+RENAME_BASE_LAYER_ID = 'base layer id'
+RENAME_FORM_LAYER = 'form layer'
+RENAME_SUFFIX = 'suffix'
+RENAME_VALUE_RELATION = 'value relation'
+
+RENAME_REPORT_FIELDS = ('project',) + RenameStep._fields
+
+
+class RenamePlan:
+    """Layer renames worked out before any layer is touched.
+
+    names maps layer ids to the current layer names, in the order the
+    layers are visited (QgsProject.mapLayers() order). The plan tracks the
+    name every layer will have once its steps are applied, so later rules
+    see the result of earlier ones exactly as if they had been applied.
+    """
+
+    def __init__(self, names):
+        self.original = dict(names)
+        self.names = dict(names)
+        self.steps = []
+        self._index = NameIndex(self.names.values())
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def name_taken(self, name):
+        """Return True if a layer will be called name."""
+        return name in self._index
+
+    def rename(self, layer_id, new_name, reason):
+        """Add a step renaming layer_id to new_name. Renames to the same name are left out."""
+        old_name = self.names[layer_id]
+        if new_name == old_name:
+            return
+        self.steps.append(RenameStep(layer_id, old_name, new_name, reason))
+        self._index.rename(old_name, new_name)
+        self.names[layer_id] = new_name
+
+    def final_names(self, steps=None):
+        """Return {layer id: new name} for the layers renamed by steps (default: all)."""
+        final = {}
+        for step in self.steps if steps is None else steps:
+            final[step.layer_id] = self.names[step.layer_id]
+        return {layer_id: name for layer_id, name in final.items() if name != self.original[layer_id]}
+
+
+def write_rename_report(path, rows):
+    """Write (project, RenameStep) pairs to a CSV dry-run report."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(RENAME_REPORT_FIELDS)
+        for project, step in rows:
+            writer.writerow((project,) + tuple(step))
+
+
+def plan_layer_renames(plan, base_layer_ids, rules):
+    """Plan the renames of rename_layers() on plan.
+
+    base_layer_ids are the ids of the layers of the base layer group, in
+    layer tree order. Every layer gets the 8-digit identifier, form layer
+    and suffix rules, in that order.
+    """
+    layer_ids = list(plan.names)
+    eight_digit_id = find_eight_digit_id(plan.names[layer_id] for layer_id in layer_ids)
+
+    for layer_id in base_layer_ids:
+        new_name = base_layer_name(plan.names[layer_id], eight_digit_id)
+        if new_name is not None:
+            plan.rename(layer_id, new_name, RENAME_BASE_LAYER_ID)
+
+    for layer_id in layer_ids:
+        layer_name = plan.names[layer_id]
+
+        # '_SF.shp'/'_GP.shp' become '_SF'/'_GP' if that name is not taken
+        new_name = form_layer_name(layer_name, eight_digit_id)
+        if new_name is not None and not plan.name_taken(new_name):
+            plan.rename(layer_id, new_name, RENAME_FORM_LAYER)
+
+        # The suffix rule works on the name the layer had before, and wins
+        new_name = rules.suffix_name(layer_name)
+        if new_name is not None:
+            plan.rename(layer_id, new_name, RENAME_SUFFIX)
+
+
+def plan_value_relation_renames(plan, layer_ids, rules=DEFAULT_RENAME_RULES):
+    """Plan the renames of rename_value_relation_layers() for the Value Relation layers layer_ids."""
+    for layer_id in layer_ids:
+        standard_name = rules.standard_value_relation_name(plan.names[layer_id])
+        if standard_name is not None:
+            plan.rename(layer_id, standard_name, RENAME_VALUE_RELATION)
+
+
+def tree_key(name):
+    """Return the key layer tree names are looked up by: case and runs of spaces ignored."""
+    return ' '.join(name.split()).casefold()
+
+
+def find_base_layer_match(key, names):
+    """Return the first of names matching an entry of BASE_LAYER_ORDER, or None."""
+    if key == 'bldg_point_variants':
+        return next((name for name in names if any(variant in name for variant in BLDG_POINT_VARIANTS)), None)
+    return next((name for name in names if key in name), None)
+
+
+def base_layer_top(names):
+    """Return the base layers that go on top of the group, top first.
+
+    The result is a list of indices into names: the layers named in
+    BASE_LAYER_ORDER in reverse order. When several layers share a name
+    the last one is used, like the name lookup of the layer tree stage.
+    Entries of names that are None (sub-groups) never match.
+    """
+    index_by_name = {}
+    for index, name in enumerate(names):
+        if name is not None:
+            index_by_name[name] = index  # the last layer of a name wins, like a dict
+
+    top = []
+    for key in BASE_LAYER_ORDER:
+        match = find_base_layer_match(key, index_by_name)
+        if match is not None:
+            top.insert(0, index_by_name[match])
+
+    # A layer matched by two keys ends up where the last key puts it
+    unique = []
+    for index in top:
+        if index not in unique:
+            unique.append(index)
+    return unique
+
+
+def arranged_base_layers(names):
+    """Return the arranged order of the children of the base layer group.
+
+    names holds the layer name of each child, or None for a sub-group. The
+    result is a permutation of the indices into names, top of the group
+    first: base_layer_top() followed by every other child in its current
+    order. Layers sharing a name are all kept.
+    """
+    top = base_layer_top(names)
+    placed = set(top)
+    return top + [index for index in range(len(names)) if index not in placed]
+
+
+def longest_increasing_subsequence(values):
+    """Return a longest strictly increasing subsequence of values."""
+    tails = []  # tails[k]: index in values of the smallest tail of an increasing run of length k + 1
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        low, high = 0, len(tails)
+        while low < high:
+            middle = (low + high) // 2
+            if values[tails[middle]] < value:
+                low = middle + 1
+            else:
+                high = middle
+        previous[index] = tails[low - 1] if low else None
+        if low == len(tails):
+            tails.append(index)
+        else:
+            tails[low] = index
+
+    result = []
+    index = tails[-1] if tails else None
+    while index is not None:
+        result.append(values[index])
+        index = previous[index]
+    return result[::-1]
+
+
+def reorder_moves(order):
+    """Return the fewest moves that rearrange a list into order.
+
+    order is the target permutation, a list of current indices. The
+    children in a longest increasing run of order already are in the right
+    order relative to each other and stay where they are; every other child
+    is moved once. Moves are (index, anchor) pairs, applied in turn: move
+    the child at current index index right after the child at current index
+    anchor, or to the front when anchor is None.
+    """
+    staying = set(longest_increasing_subsequence(order))
+    moves = []
+    for position, index in enumerate(order):
+        if index not in staying:
+            moves.append((index, order[position - 1] if position else None))
+    return moves
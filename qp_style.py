@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Fingerprints of layer styles, to skip re-applying a style a layer already has.
+
+A QML style is a <qgis> element whose children (renderer-v2, fieldConfiguration,
+editform, attributeEditorForm, aliases, ...) and root attributes replace those
+of the layer. The fingerprint of a QML is a hash of the canonical (C14N)
+form of those children and attributes. The XML engine takes the
+fingerprint of a layer the same way over the same element names and
+attributes of its maplayer element, so the two only match when the layer
+already carries everything the QML would set. The style QGIS exports for a
+layer holds more than the QML it was given, so the QGIS engine records the
+fingerprint of the QML it applied in the STYLE_PROPERTY custom property
+of the layer instead.
+
+The ValueRelation widgets of a QML are read here too: they tell which
+columns of the lookup tables the forms key and filter on.
+"""
+
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+from .qp_cache import FileCache
+
+# Children of a QML document that describe the file rather than the layer style
+QML_SKIPPED_ELEMENTS = {'layerGeometryType'}
+# Attributes of the QML root element that are not layer properties
+QML_SKIPPED_ATTRIBUTES = {'version', 'styleCategories'}
+# Custom layer property holding the fingerprint of the QML last applied to the layer
+STYLE_PROPERTY = 'qp_checker/style_sha1'
+
+# The ValueRelation widget of a field of a QML: the lookup layer and the
+# columns of it the widget reads. allow_multi is True for multiple choice.
+ValueRelationConfig = namedtuple('ValueRelationConfig',
+                                 'field layer_id layer_name key value filter_expression allow_multi')
+# A field name in a QGIS expression
+EXPRESSION_COLUMN = re.compile(r'"((?:[^"]|"")+)"')
+
+# What a QML sets on a layer: its element names in document order, its
+# root attribute names and the fingerprint of both.
+QmlStyle = namedtuple('QmlStyle', 'tags attributes fingerprint')
+
+
+def canonical_element(element):
+    """Return the C14N form of element, without its tail and surrounding whitespace."""
+    tail, element.tail = element.tail, None
+    try:
+        return ET.canonicalize(ET.tostring(element, encoding='unicode'), strip_text=True)
+    finally:
+        element.tail = tail
+
+
+def style_fingerprint(root, tags, attributes):
+    """Return the fingerprint of the elements tags and attributes of root."""
+    digest = hashlib.sha1()
+    for name in sorted(attributes):
+        digest.update(f"{name}={root.get(name)}\0".encode('utf-8'))
+    for tag in tags:
+        for element in root.findall(tag):
+            digest.update(canonical_element(element).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def qml_style(qml_root):
+    """Return the QmlStyle of the root element of a QML document."""
+    tags = []
+    for element in qml_root:
+        if element.tag not in QML_SKIPPED_ELEMENTS and element.tag not in tags:
+            tags.append(element.tag)
+    attributes = sorted(name for name in qml_root.attrib if name not in QML_SKIPPED_ATTRIBUTES)
+    return QmlStyle(tags, attributes, style_fingerprint(qml_root, tags, attributes))
+
+
+def load_qml_style(qml_file):
+    """Return the QmlStyle of a QML file."""
+    return qml_style(ET.parse(qml_file).getroot())
+
+
+# QmlStyles of the QML files, shared by every project checked in this process
+QML_STYLES = FileCache(load_qml_style)
+
+
+def has_style(root, style):
+    """Return True if the layer element root already carries the QmlStyle style."""
+    return style_fingerprint(root, style.tags, style.attributes) == style.fingerprint
+
+
+def value_relation_configs(qml_root):
+    """Return the ValueRelationConfigs of the fields of a QML document."""
+    configs = []
+    for field in qml_root.iter('field'):
+        widget = field.find('editWidget')
+        if widget is None or widget.get('type') != 'ValueRelation':
+            continue
+        options = {option.get('name'): option.get('value', '')
+                   for option in widget.iter('Option') if option.get('name')}
+        configs.append(ValueRelationConfig(
+            field.get('name'), options.get('Layer', ''), options.get('LayerName', ''),
+            options.get('Key', ''), options.get('Value', ''), options.get('FilterExpression', ''),
+            options.get('AllowMulti', 'false') == 'true'))
+    return configs
+
+
+def load_value_relation_configs(qml_file):
+    """Return the ValueRelationConfigs of a QML file."""
+    return value_relation_configs(ET.parse(qml_file).getroot())
+
+
+# ValueRelationConfigs of the QML files, shared by every project checked in this process
+QML_VALUE_RELATIONS = FileCache(load_value_relation_configs)
+
+
+def expression_columns(expression):
+    """Return the field names a QGIS expression refers to, in order."""
+    return [name.replace('""', '"') for name in EXPRESSION_COLUMN.findall(expression)]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Background execution of the QP Checker pipeline.
+
+QPCheckTask runs the stages of QPChecker.pipeline() from the QGIS task
+manager. Stages that only read or copy files run on the task thread; the
+stages that mutate the project are queued for the main thread one at a
+time, so the interface keeps processing events between them, and a
+cancelled task never waits on a main thread that waits on it. Progress is
+reported through the checker's ProgressReporter, weighted by stage and
+throttled, and the task can be cancelled between stages; the stages that
+read many features also stop midway, through the checker's QgsFeedback.
+Every stage is timed in METRICS (see qp_metrics).
+"""
+
+import threading
+
+from qgis.core import QgsFeedback, QgsTask
+from qgis.PyQt.QtCore import QObject, Qt, pyqtSignal
+
+from .qp_log import PROJECT_FILTER
+from .qp_metrics import METRICS
+
+
+class MainThreadCall:
+    """A function handed to the main thread, and its outcome."""
+
+    def __init__(self, function):
+        self.function = function
+        self.result = None
+        self.error = None
+        self.started = False
+        self.abandoned = False  # the caller stopped waiting before the call started
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def run(self):
+        """Run the function unless the caller gave up on it. Called on the main thread."""
+        with self.lock:
+            if self.abandoned:
+                return
+            self.started = True
+        try:
+            self.result = self.function()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+class MainThreadCaller(QObject):
+    """Call functions on the thread this object lives on and wait for them.
+
+    Create it on the main thread; calling it from a worker thread queues the
+    function for the main thread and waits until it has run. The wait wakes
+    up every poll_interval seconds to ask is_canceled(): the main thread may
+    itself be blocked waiting for the task, at QGIS shutdown or in
+    waitForFinished(), so a cancelled task stops waiting for a call that
+    has not started and the call is dropped.
+    """
+
+    call_requested = pyqtSignal(object)
+
+    def __init__(self, is_canceled, poll_interval=0.1):
+        super().__init__()
+        self.is_canceled = is_canceled
+        self.poll_interval = poll_interval
+        self.call_requested.connect(self._call, Qt.QueuedConnection)
+
+    def _call(self, call):
+        call.run()
+
+    def __call__(self, function):
+        """Return what function returned on the main thread, or False if cancelled before it ran."""
+        call = MainThreadCall(function)
+        self.call_requested.emit(call)
+        while not call.done.wait(self.poll_interval):
+            if self.is_canceled():
+                with call.lock:
+                    if not call.started:
+                        call.abandoned = True
+                        return False
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class QPCheckTask(QgsTask):
+    """Run the QP Checker pipeline of checker on qgs_file in the background."""
+
+    def __init__(self, checker, qgs_file):
+        super().__init__("QP Check", QgsTask.CanCancel)
+        self.checker = checker
+        self.qgs_file = qgs_file
+        self.succeeded = False
+        self.exception = None
+        self.main_thread = MainThreadCaller(self.isCanceled)  # created on the main thread
+        self.feedback = QgsFeedback()  # cancelled with the task, checked inside long stages
+
+    def run(self):
+        """Run every stage, handing project mutations to the main thread."""
+        self.checker.qgs_file = self.qgs_file
+        self.checker.feedback = self.feedback
+        PROJECT_FILTER.project = self.qgs_file
+        stages = self.checker.pipeline()
+        METRICS.reset()
+        progress = self.checker.progress
+        progress.sinks.append(self.report_progress)
+        try:
+            progress.start([(label, weight) for label, weight, needs_main_thread, stage in stages])
+            for index, (label, weight, needs_main_thread, stage) in enumerate(stages):
+                if self.isCanceled():
+                    return False
+                self.setDescription(f"QP Check: {label}")
+                progress.begin_stage(index)
+                with METRICS.stage(label):
+                    result = self.main_thread(stage) if needs_main_thread else stage()
+                if result is False:
+                    return False
+            progress.finish()
+        except Exception as e:
+            self.exception = e
+            return False
+        finally:
+            progress.sinks.remove(self.report_progress)
+            self.checker.feedback = None
+        self.succeeded = True
+        return True
+
+    def cancel(self):
+        """Cancel the task and the stage it is running."""
+        self.feedback.cancel()
+        super().cancel()
+
+    def report_progress(self, percent, label):
+        """Progress sink: setProgress() is safe to call from any thread."""
+        self.setProgress(percent)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Index of the layer tree of the current project.
+
+The stages look groups up by a list of spelling variants and then list
+the layers below them. LayerTreeIndex walks the tree once and answers
+those lookups from dictionaries. It listens to the tree: any node added, removed or
+renamed makes it walk the tree again on the next lookup. Renames done
+while the tree's signals are blocked have to be reported with
+invalidate().
+"""
+
+from qgis.core import QgsLayerTree
+
+from .qp_rules import tree_key
+
+
+class LayerTreeIndex:
+    """Groups by normalised name, and the layer nodes below each group."""
+
+    def __init__(self, root):
+        self.root = root
+        self._groups = {}  # tree_key(name) -> groups, depth first like findGroup()
+        self._layers_below = {}  # id() of a group of _groups -> layer nodes below it, like findLayers()
+        self._top_groups = []
+        self._dirty = True
+        self._signals = (root.addedChildren, root.removedChildren, root.nameChanged)
+        for signal in self._signals:
+            signal.connect(self.invalidate)
+
+    def close(self):
+        """Stop following the tree."""
+        for signal in self._signals:
+            try:
+                signal.disconnect(self.invalidate)
+            except TypeError:
+                pass  # already disconnected
+        self._signals = ()
+
+    def invalidate(self, *args):
+        """Walk the tree again before the next lookup."""
+        self._dirty = True
+
+    def _build(self):
+        self._groups = {}
+        self._layers_below = {}
+        self._top_groups = [node for node in self.root.children() if QgsLayerTree.isGroup(node)]
+        stack = [(node, ()) for node in reversed(self.root.children())]  # (node, layer lists of its groups)
+        while stack:
+            node, ancestors = stack.pop()
+            if QgsLayerTree.isGroup(node):
+                self._groups.setdefault(tree_key(node.name()), []).append(node)
+                layers = self._layers_below[id(node)] = []
+                stack.extend((child, ancestors + (layers,)) for child in reversed(node.children()))
+            elif QgsLayerTree.isLayer(node):
+                for layers in ancestors:
+                    layers.append(node)
+        self._dirty = False
+
+    def _index(self):
+        if self._dirty:
+            self._build()
+        return self
+
+    def group(self, names):
+        """Return the group matching the first of names that exists, or None.
+
+        Names are compared with tree_key(); of several groups with the same
+        key the first one depth first is returned, like findGroup().
+        """
+        groups = self._index()._groups
+        for name in names:
+            found = groups.get(tree_key(name))
+            if found:
+                return found[0]
+        return None
+
+    def top_group_containing(self, text):
+        """Return the first top level group whose name contains text, or None."""
+        return next((group for group in self._index()._top_groups if text in group.name()), None)
+
+    def layers(self, group):
+        """Return the layer nodes below a group found by this index, depth first like findLayers().
+
+        Other groups are walked with findLayers().
+        """
+        layers = self._index()._layers_below.get(id(group))
+        return list(layers) if layers is not None else group.findLayers()
@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+"""Pure-XML engine of the QP Checker.
+
+XmlProjectChecker applies the rules of QPChecker (see qp_rules.py)
+directly to the project XML, so it runs without a QgsApplication or even a
+QGIS install. Its interface mirrors QPChecker so that qp_batch can drive
+either of them.
+
+The layer tree is re-ordered in place, so the whole document is parsed
+once with the expat based ElementTree parser rather than streamed.
+"""
+
+import copy
+import logging
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+from .qp_cache import FileCache
+from .qp_deploy import deploy_value_relation_csv
+from .qp_gpkg import LOOKUP_ERRORS, lookup_gpkg_source
+from .qp_log import LOGGER, NOTIFY_LEVELS
+from .qp_metrics import (
+    COUNT_RENAMES, COUNT_SOURCE_CHANGES, COUNT_STYLES, COUNT_TREE_INSERTS, COUNT_TREE_REMOVES, METRICS)
+from .qp_progress import ProgressReporter
+from .qp_project_io import project_xml_equal, read_project_xml, write_project_xml
+from .qp_rules import (
+    BASE_LAYER_GROUP_NAMES, FORM_GROUP_MARKER, GP_CSV_DEST_NAME, GP_CSV_SOURCE_NAME,
+    GP_QML_NAME, RULES_FILE_NAME, SF_CSV_DEST_NAME, SF_CSV_SOURCE_NAME, SF_QML_NAME,
+    VALUE_RELATION_GP, VALUE_RELATION_GROUP_NAMES, VALUE_RELATION_SF, RenamePlan, RenameRules,
+    arranged_base_layers, is_gp_layer, is_sf_layer, plan_layer_renames, plan_value_relation_renames,
+    tree_key)
+from .qp_style import QML_SKIPPED_ATTRIBUTES, QML_SKIPPED_ELEMENTS, QML_STYLES, has_style
+
+LAYER_NODE = 'layer-tree-layer'
+GROUP_NODE = 'layer-tree-group'
+
+
+def parse_qml(qml_file):
+    """Return the root element of a QML file."""
+    return ET.parse(qml_file).getroot()
+
+
+# Parsed QML styles, shared by every project checked in this process.
+# apply_qml() copies what it embeds, so the cached trees stay untouched.
+QML_ROOTS = FileCache(parse_qml)
+
+
+def split_prolog(data):
+    """Split project XML into the prolog (declaration, DOCTYPE) and the document."""
+    start = data.find(b'<qgis')
+    if start < 0:
+        return b'', data
+    return data[:start], data[start:]
+
+
+def apply_qml(maplayer, qml_root):
+    """Embed the style of a parsed QML document into a maplayer element.
+
+    Like loadNamedStyle() with all style categories, every element of the
+    QML replaces the element of the same name in the layer, in place, and
+    the layer properties held as attributes of the QML root are copied.
+    """
+    for name, value in qml_root.attrib.items():
+        if name not in QML_SKIPPED_ATTRIBUTES:
+            maplayer.set(name, value)
+
+    for element in qml_root:
+        if element.tag in QML_SKIPPED_ELEMENTS:
+            continue
+        existing = maplayer.findall(element.tag)
+        replacement = copy.deepcopy(element)
+        if existing:
+            index = list(maplayer).index(existing[0])
+            for old in existing:
+                maplayer.remove(old)
+            maplayer.insert(index, replacement)
+        else:
+            maplayer.append(replacement)
+
+
+class XmlProjectChecker:
+    """Run the QP Checker stages on the XML of a project, without QGIS."""
+
+    def __init__(self):
+        self.qml_folder = None
+        self.sf_qml_file = None
+        self.gp_qml_file = None
+        self.qgs_file = None
+        self.rename_rules = RenameRules()
+        self.rename_plan = None  # RenamePlan of the current project
+        self.dry_run = False  # Only plan the renames, change nothing
+        self.value_relation_store = None  # Shared folder for the Value Relation CSVs, see deploy_value_relation_csv()
+        self.value_relation_gpkg = False  # Point the Value Relation layers at indexed GeoPackage tables
+        self.progress = ProgressReporter()
+        self.messages = []
+        self.project_changed = None  # Whether the last save rewrote the project file
+        self.root = None
+        self._prolog = b''
+        self._layers = {}  # layer id -> maplayer element
+        self._tree_nodes = defaultdict(list)  # layer id -> layer-tree-layer elements
+        self._legend_layers = defaultdict(list)  # layer id -> legendlayer elements
+        self._groups = defaultdict(list)  # tree_key(name) -> layer-tree-group elements, depth first
+
+    def set_qml_folder(self, qml_folder):
+        """Use qml_folder as the source of the Form 8A/8B QML files and CSVs."""
+        self.qml_folder = qml_folder
+        self.sf_qml_file = os.path.join(self.qml_folder, SF_QML_NAME)
+        self.gp_qml_file = os.path.join(self.qml_folder, GP_QML_NAME)
+
+    def notify(self, level, title, text, bar=False):
+        """Record and log a message; there is nobody to show it to."""
+        LOGGER.log(NOTIFY_LEVELS[level], "%s: %s", title, text, extra={'event': 'message'})
+        self.messages.append((level, title, text))
+
+    def check_project(self, qgs_file, save=False):
+        """Read qgs_file, run every check stage on it and optionally save it.
+
+        The project is only written back when the check changed its XML.
+        A dry run only plans the renames and never saves. Returns False if
+        the project could not be read or saved. The stages, reading and
+        saving are timed in METRICS.
+        """
+        self.qgs_file = qgs_file
+        self.project_changed = None
+        self.rename_plan = None
+        METRICS.reset()
+        try:
+            self.rename_rules = RenameRules.for_folder(self.qml_folder)
+        except (OSError, ValueError) as e:
+            self.notify('critical', "Error", f"Failed to read {RULES_FILE_NAME}: {e}")
+            return False
+        try:
+            with METRICS.stage("Loading project"):
+                original = read_project_xml(qgs_file)
+                self._prolog, document = split_prolog(original)
+                root = ET.fromstring(document)
+        except (OSError, ValueError, zipfile.BadZipFile, ET.ParseError) as e:
+            self.notify('critical', "Error", f"Failed to load QGS project: {e}")
+            return False
+
+        self.check_document(root)
+
+        if save and not self.dry_run:
+            with METRICS.stage("Saving project"):
+                data = self.to_bytes()
+                self.project_changed = not project_xml_equal(original, data)
+                if not self.project_changed:
+                    return True
+                try:
+                    write_project_xml(qgs_file, data)
+                except OSError as e:
+                    self.notify('critical', "Error", f"Failed to save QGS project: {e}")
+                    return False
+        return True
+
+    def check_document(self, root):
+        """Run every check stage on the parsed project root element."""
+        self.root = root
+        self._layers = {maplayer.findtext('id'): maplayer
+                        for maplayer in root.iter('maplayer')}
+        self._tree_nodes = defaultdict(list)
+        for node in root.iter(LAYER_NODE):
+            self._tree_nodes[node.get('id')].append(node)
+        self._legend_layers = defaultdict(list)
+        for legend_layer in root.iter('legendlayer'):
+            for layer_file in legend_layer.iter('legendlayerfile'):
+                self._legend_layers[layer_file.get('layerid')].append(legend_layer)
+        self._groups = defaultdict(list)
+        root_group = self.tree_root()
+        for group in root_group.iter(GROUP_NODE):
+            if group is not root_group:
+                self._groups[tree_key(group.get('name', ''))].append(group)
+        self.rename_plan = RenamePlan({layer_id: self.layer_name(layer_id) for layer_id in self.layer_ids()})
+
+        stages = self.stages()
+        self.progress.start([(label, weight) for label, weight, stage in stages])
+        for index, (label, weight, stage) in enumerate(stages):
+            self.progress.begin_stage(index)
+            with METRICS.stage(label):
+                stage()
+        self.progress.finish()
+
+    def stages(self):
+        """Return the check stages in order as (label, weight, method), like QPChecker.pipeline()."""
+        stages = [
+            ("Renaming layers", 10, self.rename_layers),
+            ("Renaming Value Relation layers", 2, self.rename_value_relation_layers),
+        ]
+        if not self.dry_run:
+            stages += [
+                ("Applying styles", 15, self.apply_styles_to_layers),
+                ("Arranging base layers", 3, self.arrange_base_layers),
+                ("Updating Value Relation sources", 10, self.update_layer_sources),
+            ]
+        return stages
+
+    def to_bytes(self):
+        """Serialise the checked project, keeping its original prolog."""
+        return self._prolog + ET.tostring(self.root, encoding='unicode').encode('utf-8') + b'\n'
+
+    def close_project(self):
+        """Drop the current project."""
+        self.root = None
+        self._layers = {}
+        self._tree_nodes = defaultdict(list)
+        self._legend_layers = defaultdict(list)
+        self._groups = defaultdict(list)
+
+    # Project access
+
+    def layer_ids(self):
+        """Return the ids of all layers, in the order of QgsProject.mapLayers()."""
+        return sorted(self._layers)
+
+    def layer_name(self, layer_id):
+        """Return the name of a layer."""
+        return self._layers[layer_id].findtext('layername', '')
+
+    def node_name(self, node):
+        """Return the name of a layer tree node, preferring the layer name."""
+        if node.tag == LAYER_NODE and node.get('id') in self._layers:
+            return self.layer_name(node.get('id'))
+        return node.get('name', '')
+
+    def set_layer_name(self, layer_id, name):
+        """Rename a layer everywhere the project stores its name."""
+        layername = self._layers[layer_id].find('layername')
+        if layername is None:
+            layername = ET.SubElement(self._layers[layer_id], 'layername')
+        layername.text = name
+        for node in self._tree_nodes[layer_id]:
+            node.set('name', name)
+        for legend_layer in self._legend_layers[layer_id]:
+            legend_layer.set('name', name)
+        METRICS.count(COUNT_RENAMES)
+
+    def set_layer_source(self, layer_id, source, provider):
+        """Point a layer at a new data source, its file stored the way the project stores paths.
+
+        source is a file or 'file|options'. Returns False if the layer
+        already used that source.
+        """
+        maplayer = self._layers[layer_id]
+        path, separator, options = source.partition('|')
+        source = self.project_path(path) + separator + options
+        if maplayer.findtext('datasource') == source and maplayer.findtext('provider') == provider:
+            return False
+        for tag, text in (('datasource', source), ('provider', provider)):
+            element = maplayer.find(tag)
+            if element is None:
+                element = ET.SubElement(maplayer, tag)
+            element.text = text
+        for node in self._tree_nodes[layer_id]:
+            if node.get('source') is not None:
+                node.set('source', source)
+            if node.get('providerKey') is not None:
+                node.set('providerKey', provider)
+        METRICS.count(COUNT_SOURCE_CHANGES)
+        return True
+
+    def project_path(self, path):
+        """Return path as written in the project: relative unless it uses absolute paths.
+
+        Like QGIS, a path on another drive stays absolute and a relative
+        path gets a './' prefix unless it starts with '../'.
+        """
+        if self.root.findtext('properties/Paths/Absolute', 'false').strip() == 'true':
+            return os.path.abspath(path)
+        try:
+            relative = os.path.relpath(path, os.path.dirname(os.path.abspath(self.qgs_file)))
+        except ValueError:  # Another drive
+            return os.path.abspath(path)
+        relative = relative.replace(os.sep, '/')
+        return relative if relative.startswith('../') else './' + relative
+
+    def tree_root(self):
+        """Return the root group of the layer tree."""
+        root_group = self.root.find(GROUP_NODE)
+        if root_group is None:
+            root_group = ET.SubElement(self.root, GROUP_NODE)
+        return root_group
+
+    def find_group(self, name):
+        """Return the first group matching name (see tree_key()), depth first like findGroup().
+
+        The stages move layers but never add, remove or rename groups, so
+        the groups indexed by check_document() stay valid for the run.
+        """
+        groups = self._groups.get(tree_key(name))
+        return groups[0] if groups else None
+
+    def find_first_group(self, names):
+        """Return the group matching the first name of names that exists."""
+        for name in names:
+            group = self.find_group(name)
+            if group is not None:
+                return group
+        return None
+
+    def find_layers(self, group):
+        """Return the layer nodes below group, depth first like findLayers()."""
+        return list(group.iter(LAYER_NODE))
+
+    # Stages
+
+    def rename_layers(self):
+        """Rename layers based on defined suffixes and check names in 'Base Layer' group."""
+        base_layer_ids = []
+        base_layer_group = self.find_first_group(BASE_LAYER_GROUP_NAMES)
+        if base_layer_group is not None:
+            base_layer_ids = [node.get('id') for node in self.find_layers(base_layer_group)
+                              if node.get('id') in self._layers]
+
+        first_step = len(self.rename_plan)
+        plan_layer_renames(self.rename_plan, base_layer_ids, self.rename_rules)
+        self.apply_rename_steps(self.rename_plan.steps[first_step:])
+
+    def apply_rename_steps(self, steps):
+        """Rename the layers of the rename plan steps, unless this is a dry run."""
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            for step in steps:
+                LOGGER.debug("Layer %r renamed to %r (%s)", step.old_name, step.new_name, step.reason,
+                             extra={'event': 'rename', 'layer': step.layer_id, 'reason': step.reason})
+        if self.dry_run:
+            return
+        new_names = self.rename_plan.final_names(steps)
+        for index, (layer_id, new_name) in enumerate(new_names.items()):
+            self.set_layer_name(layer_id, new_name)
+            self.progress.update(index + 1, len(new_names))
+
+    def rename_value_relation_layers(self):
+        """Rename layers in the 'Value Relation' group to standard names."""
+        value_relation_group = self.find_first_group(VALUE_RELATION_GROUP_NAMES)
+        if value_relation_group is None:
+            self.notify('warning', "Warning", "Value Relations group not found or has a trailing space.")
+            return
+
+        layer_ids = [node.get('id') for node in self.find_layers(value_relation_group)
+                     if node.get('id') in self._layers]
+        first_step = len(self.rename_plan)
+        plan_value_relation_renames(self.rename_plan, layer_ids, self.rename_rules)
+        self.apply_rename_steps(self.rename_plan.steps[first_step:])
+
+    def apply_styles_to_layers(self):
+        """Embed the Form 8A/8B QML styles into the SF and GP layers of the 'Form 8' group."""
+        group = None
+        for node in self.tree_root():
+            if node.tag == GROUP_NODE and FORM_GROUP_MARKER in node.get('name', ''):
+                group = node
+                break
+
+        if group is None:
+            self.notify('critical', "Error", "Group containing 'Form 8' not found.")
+            return
+
+        sf_layer_id = None
+        gp_layer_id = None
+        for node in self.find_layers(group):
+            if node.get('id') not in self._layers:
+                continue
+            layer_name = self.node_name(node)
+            if is_sf_layer(layer_name):
+                sf_layer_id = node.get('id')
+            elif is_gp_layer(layer_name):
+                gp_layer_id = node.get('id')
+
+        for layer_id, qml_file, label in ((sf_layer_id, self.sf_qml_file, "SF"),
+                                          (gp_layer_id, self.gp_qml_file, "GP")):
+            if layer_id is None or not os.path.exists(qml_file):
+                self.notify('critical', "Error", f"{label} layer not found or invalid.")
+                continue
+            try:
+                if has_style(self._layers[layer_id], QML_STYLES.get(qml_file)):
+                    LOGGER.debug("%s layer already has the style of %s", label, qml_file, extra={'event': 'style'})
+                    continue
+                apply_qml(self._layers[layer_id], QML_ROOTS.get(qml_file))
+                METRICS.count(COUNT_STYLES)
+            except (OSError, ET.ParseError) as e:
+                self.notify('critical', "Error", f"Failed to read {qml_file}: {e}")
+
+    def arrange_base_layers(self):
+        """Rearrange base layers in a specific order (see arranged_base_layers())."""
+        base_layer_group = self.find_first_group(BASE_LAYER_GROUP_NAMES)
+        if base_layer_group is None:
+            self.notify('critical', "Error", "Base Layers group not found.", bar=True)
+            return
+
+        nodes = [child for child in base_layer_group if child.tag in (LAYER_NODE, GROUP_NODE)]
+        names = [self.node_name(node) if node.tag == LAYER_NODE else None for node in nodes]
+        order = arranged_base_layers(names)
+        if order == list(range(len(nodes))):
+            return
+
+        # Keep the indentation of the file: tails stay with the positions
+        tails = [node.tail for node in nodes]
+        for node in nodes:
+            base_layer_group.remove(node)
+        for index, tail in zip(order, tails):
+            nodes[index].tail = tail
+            base_layer_group.append(nodes[index])
+        METRICS.count(COUNT_TREE_REMOVES, len(nodes))
+        METRICS.count(COUNT_TREE_INSERTS, len(nodes))
+
+    def update_layer_sources(self):
+        """Copy the Value Relation CSVs next to the project and point the Value Relation layers at them.
+
+        With a value_relation_store the CSVs go to that shared store instead.
+        With value_relation_gpkg the layers use indexed GeoPackage tables
+        made from the CSVs (see lookup_gpkg_source()).
+        """
+        if not self.qml_folder:
+            self.notify('warning', "Error", "QML folder not selected.", bar=True)
+            return
+
+        project_dir = os.path.dirname(self.qgs_file)
+        copies = ((SF_CSV_SOURCE_NAME, SF_CSV_DEST_NAME, VALUE_RELATION_SF),
+                  (GP_CSV_SOURCE_NAME, GP_CSV_DEST_NAME, VALUE_RELATION_GP))
+        destinations = {}
+        for source_name, dest_name, role in copies:
+            try:
+                destinations[role] = deploy_value_relation_csv(
+                    os.path.join(self.qml_folder, source_name), project_dir, dest_name, self.value_relation_store)
+            except OSError as e:
+                self.notify('warning', "Error", f"Failed to copy {role.upper()} CSV: {e}")
+                return
+            if self.value_relation_gpkg:
+                try:
+                    destinations[role] = lookup_gpkg_source(destinations[role], (self.sf_qml_file, self.gp_qml_file),
+                                                            self.rename_rules, role, self.value_relation_store)
+                except LOOKUP_ERRORS as e:
+                    self.notify('warning', "Error", f"Failed to convert the {role.upper()} CSV to GeoPackage: {e}")
+                    return
+
+        value_relation_group = self.find_first_group(VALUE_RELATION_GROUP_NAMES)
+        if value_relation_group is None:
+            self.notify('warning', "Warning", "Value Relations group not found or has a trailing space.")
+            return
+
+        for node in self.find_layers(value_relation_group):
+            layer_id = node.get('id')
+            if layer_id not in self._layers:
+                continue
+            destination = destinations.get(self.rename_rules.value_relation_role(self.layer_name(layer_id)))
+            if destination is not None and self.set_layer_source(layer_id, destination, 'ogr'):
+                LOGGER.debug("Updated data source for layer: %s with %s", self.layer_name(layer_id), destination,
+                             extra={'event': 'source', 'layer': layer_id})
@@ -0,0 +1,216 @@
+# coding=utf-8
+"""Tests for the headless batch runner, on the XML engine.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import json
+import os
+import queue
+import shutil
+import tempfile
+import unittest
+
+from ..qp_batch import (
+    BatchReport, ProjectResult, _worker, check_directory, check_projects_parallel, configure_logging, create_checker,
+    find_projects)
+from ..qp_rules import GP_CSV_SOURCE_NAME, GP_QML_NAME, SF_CSV_SOURCE_NAME, SF_QML_NAME
+from ..qp_xml import XmlProjectChecker
+from .test_qp_xml import QML, project_xml
+
+try:
+    from qgis.core import QgsApplication  # noqa: F401, the QGIS engine needs a QGIS install
+    HAS_QGIS = True
+except ImportError:
+    HAS_QGIS = False
+
+
+class BatchTest(unittest.TestCase):
+    """Test checking a small tree of projects with the XML engine."""
+
+    engine = 'xml'
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.qml_folder = os.path.join(self.folder, 'qml')
+        os.mkdir(self.qml_folder)
+        for name in (SF_QML_NAME, GP_QML_NAME):
+            self.write(os.path.join(self.qml_folder, name), QML)
+        for name in (SF_CSV_SOURCE_NAME, GP_CSV_SOURCE_NAME):
+            self.write(os.path.join(self.qml_folder, name), 'code,description\n1,One\n')
+        self.root = os.path.join(self.folder, 'root')
+        self.projects = [os.path.join(self.root, 'a.qgs'), os.path.join(self.root, 'b', 'c.qgs'),
+                         os.path.join(self.root, 'b', 'd.qgs')]
+        for path in self.projects:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.write(path, self.project_xml())
+        self.write(os.path.join(self.root, 'b', 'notes.txt'), 'not a project')
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def write(self, path, text):
+        """Write text to path."""
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def project_xml(self):
+        """Return the XML of a project of the tree."""
+        return project_xml()
+
+    def test_find_projects(self):
+        """Projects are found in a stable order, other files are ignored."""
+        self.assertEqual(list(find_projects(self.root)), self.projects)
+
+    def test_report(self):
+        """The report counts failures and saves and derives the throughput."""
+        report = BatchReport()
+        report.add(ProjectResult('a.qgs', True, 0.1, [], True, [], {}))
+        report.add(ProjectResult('b.qgs', False, 0.1, [], False, [], {}))
+        report.elapsed = 30.0
+        self.assertEqual(len(report.failed), 1)
+        self.assertEqual(len(report.saved), 1)
+        self.assertEqual(report.projects_per_minute, 4.0)
+        self.assertEqual(report.summary(),
+                         "2 projects checked, 1 failed, 1 saved, 0 unchanged in 30.0s (4.0 projects/min)")
+
+    def check(self, **options):
+        """Check the tree with the engine of the test and return the BatchReport."""
+        results = []
+        report = check_directory(self.root, self.qml_folder, callback=results.append, engine=self.engine, **options)
+        self.assertEqual(results, report.results)
+        return report
+
+    def test_serial(self):
+        """Every project is checked and saved."""
+        report = self.check()
+        self.assertEqual([result.path for result in report.results], self.projects)
+        self.assertEqual(len(report.saved), 3)
+        self.assertFalse(report.failed)
+
+    def test_workers(self):
+        """A pool of workers checks every project once."""
+        report = self.check(workers=2)
+        self.assertEqual(sorted(result.path for result in report.results), self.projects)
+        self.assertEqual(len(report.saved), 3)
+        self.assertFalse(report.failed)
+
+    def test_worker(self):
+        """A worker says it is ready, announces and answers every path and says goodbye."""
+        tasks = queue.Queue()
+        results = queue.Queue()
+        for task in self.projects[:2] + [None]:
+            tasks.put(task)
+        _worker(self.qml_folder, True, False, self.engine, False, False, None, False, None, tasks, results)
+        messages = []
+        while not results.empty():
+            pid, message = results.get()
+            messages.append(message)
+        self.assertEqual([kind for kind, payload in messages], ['ready', 'started', 'done', 'started', 'done', 'exit'])
+        self.assertEqual([payload for kind, payload in messages if kind == 'started'], self.projects[:2])
+        self.assertTrue(all(payload.ok for kind, payload in messages if kind == 'done'))
+
+    def test_no_worker(self):
+        """When no worker can start, every project is reported as failed before the error is raised."""
+        results = []
+        log_config = ('NO SUCH LEVEL', None)  # fails in the workers before they are ready
+        with self.assertRaises(RuntimeError):
+            check_projects_parallel(self.projects, self.qml_folder, 2, callback=results.append, engine=self.engine,
+                                    log_config=log_config)
+        self.assertEqual(sorted(result.path for result in results), self.projects)
+        self.assertFalse(any(result.ok for result in results))
+
+    def test_worker_log(self):
+        """The records of every worker reach the log file of the parent whole, one JSON object per line."""
+        path = os.path.join(self.folder, 'events.jsonl')
+        log_config = ('DEBUG', path)
+        configure_logging(*log_config)
+        try:
+            self.check(workers=2, log_config=log_config)
+        finally:
+            configure_logging()
+        with open(path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(sorted({record['project'] for record in records}), self.projects)
+        self.assertIn('rename', {record.get('event') for record in records})
+
+    def test_incremental(self):
+        """A second incremental run skips the projects that did not change."""
+        self.assertEqual(len(self.check(incremental=True).results), 3)
+        self.write(self.projects[1], self.project_xml())
+        report = self.check(incremental=True)
+        self.assertEqual([result.path for result in report.results], [self.projects[1]])
+        self.assertEqual(report.skipped, 2)
+        with self.assertRaises(ValueError):
+            self.check(incremental=True, save=False)
+
+    def test_incremental_warnings(self):
+        """A project that checked with warnings is checked again, and its warnings reported, every run."""
+        self.write(self.projects[0], self.project_xml().replace('Value Relations', 'Lookups'))
+        first = self.check(incremental=True)
+        self.assertTrue(first.results[0].messages)
+        report = self.check(incremental=True)
+        self.assertEqual([result.path for result in report.results], [self.projects[0]])
+        self.assertEqual(report.results[0].messages, first.results[0].messages)
+
+    def test_engine(self):
+        """The engine option chooses the checker."""
+        self.assertIsInstance(create_checker(self.qml_folder, engine='xml'), XmlProjectChecker)
+
+
+@unittest.skipUnless(HAS_QGIS, "the QGIS engine needs QGIS")
+class QgisBatchTest(BatchTest):
+    """Test checking a small tree of projects with the QGIS engine."""
+
+    engine = 'qgis'
+
+    def project_xml(self):
+        """Return the XML of a project whose layers are empty memory layers, so they load without data files."""
+        return (project_xml()
+                .replace('<datasource>./old</datasource>', '<datasource>Point?crs=EPSG:3857</datasource>')
+                .replace('<provider>ogr</provider>', '<provider>memory</provider>'))
+
+    def test_engine(self):
+        """The QGIS engine is a QPChecker running in this process's QgsApplication."""
+        from ..qp_checker import QPChecker
+
+        self.assertIsInstance(create_checker(self.qml_folder), QPChecker)
+        self.assertIsNotNone(QgsApplication.instance())
+
+    def test_fast_load(self):
+        """A fast load leaves the layers unresolved and checks the projects like a full load."""
+        from qgis.core import QgsProject
+
+        checker = create_checker(self.qml_folder, fast_load=True)
+        self.assertTrue(checker.fast_load)
+        checker.qgs_file = self.projects[0]
+        self.assertTrue(checker.read_project())
+        self.assertFalse(QgsProject.instance().mapLayer('b1').isValid())
+        checker.close_project()
+
+        renames = [result.renames for result in self.check(save=False).results]
+        report = self.check(save=False, fast_load=True)
+        self.assertFalse(report.failed)
+        self.assertEqual([result.renames for result in report.results], renames)
+
+    def test_same_renames(self):
+        """Both engines plan the same renames."""
+        renames = [result.renames for result in self.check(save=False).results]
+        self.engine = 'xml'
+        self.assertEqual([result.renames for result in self.check(save=False).results], renames)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(BatchTest), unittest.makeSuite(QgisBatchTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,65 @@
+# coding=utf-8
+"""Tests for the parsed file cache.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..qp_cache import FileCache
+
+
+class FileCacheTest(unittest.TestCase):
+    """Test that files are parsed once per version."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'style.qml')
+        with open(self.path, 'w') as f:
+            f.write('first')
+        self.loads = []
+        self.cache = FileCache(self.load)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def load(self, path):
+        """Loader counting its calls."""
+        self.loads.append(path)
+        with open(path) as f:
+            return f.read()
+
+    def test_parsed_once(self):
+        """Repeated lookups of an unchanged file do not load it again."""
+        for _ in range(3):
+            self.assertEqual(self.cache.get(self.path), 'first')
+        self.assertEqual(len(self.loads), 1)
+
+    def test_changed_file(self):
+        """A file whose modification time or size changed is loaded again."""
+        self.cache.get(self.path)
+        with open(self.path, 'w') as f:
+            f.write('second')
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertEqual(self.cache.get(self.path), 'second')
+        self.assertEqual(len(self.loads), 2)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(FileCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,75 @@
+# coding=utf-8
+"""Tests for the QGIS engine of the checker.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from qgis.core import QgsVectorLayer
+
+from ..qp_checker import QPChecker
+from ..qp_metrics import COUNT_STYLES, METRICS
+from ..qp_style import STYLE_PROPERTY
+from .test_qp_xml import QML
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class ApplyStyleTest(unittest.TestCase):
+    """Test that a QML is applied to a layer once."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.qml_file = os.path.join(self.folder, 'style.qml')
+        self.write(QML)
+        self.checker = QPChecker(None)
+        self.layer = QgsVectorLayer('Point?crs=EPSG:4326&field=type:integer', 'sf', 'memory')
+        METRICS.reset()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def write(self, text):
+        """Write text to the QML file."""
+        with open(self.qml_file, 'w') as f:
+            f.write(text)
+
+    def test_apply_once(self):
+        """A style is applied, recorded on the layer and then skipped until the QML changes."""
+        self.assertTrue(self.checker.apply_qml_style(self.layer, self.qml_file))
+        self.assertEqual(self.layer.customProperty(STYLE_PROPERTY), self.checker.qml_fingerprint(self.qml_file))
+        self.assertFalse(self.checker.apply_qml_style(self.layer, self.qml_file))
+        self.assertEqual(METRICS.counters, {COUNT_STYLES: 1})
+
+        self.write(QML.replace('categorizedSymbol', 'singleSymbol'))
+        self.assertTrue(self.checker.apply_qml_style(self.layer, self.qml_file))
+        self.assertEqual(METRICS.counters, {COUNT_STYLES: 2})
+
+    def test_parsed_document(self):
+        """The parsed document of read_qml_styles() is applied and recorded the same way."""
+        self.checker.sf_qml_file = self.qml_file
+        self.checker.read_qml_styles()
+        self.assertIn(self.qml_file, self.checker.qml_styles)
+        self.assertTrue(self.checker.apply_qml_style(self.layer, self.qml_file))
+        self.assertFalse(self.checker.apply_qml_style(self.layer, self.qml_file))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ApplyStyleTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
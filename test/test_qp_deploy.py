@@ -0,0 +1,93 @@
+# coding=utf-8
+"""Tests for deploying the Value Relation CSVs.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..qp_deploy import (
+    DEPLOY_CLONED, DEPLOY_COPIED, DEPLOY_UNCHANGED, STORE_VERSION_LENGTH, deploy_file, same_content,
+    same_path, store_file)
+
+
+class DeployTest(unittest.TestCase):
+    """Test that files are only copied when their content differs."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.source = os.path.join(self.folder, 'source.csv')
+        self.dest = os.path.join(self.folder, 'dest.csv')
+        with open(self.source, 'w') as f:
+            f.write('code,description\n1,One\n')
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def read_dest(self):
+        """Return the content of the destination file."""
+        with open(self.dest) as f:
+            return f.read()
+
+    def test_deploy(self):
+        """The first deploy copies, the next ones leave the file alone."""
+        self.assertIn(deploy_file(self.source, self.dest), (DEPLOY_COPIED, DEPLOY_CLONED))
+        self.assertEqual(self.read_dest(), 'code,description\n1,One\n')
+        before = os.stat(self.dest)
+        self.assertEqual(deploy_file(self.source, self.dest), DEPLOY_UNCHANGED)
+        self.assertEqual(os.stat(self.dest).st_ino, before.st_ino)
+        self.assertEqual(sorted(os.listdir(self.folder)), ['dest.csv', 'source.csv'])
+
+    def test_same_size_other_content(self):
+        """A destination of the same size but other bytes is replaced."""
+        with open(self.dest, 'w') as f:
+            f.write('code,description\n2,Two\n')
+        self.assertFalse(same_content(self.source, self.dest))
+        self.assertIn(deploy_file(self.source, self.dest), (DEPLOY_COPIED, DEPLOY_CLONED))
+        self.assertEqual(self.read_dest(), 'code,description\n1,One\n')
+
+    def test_same_content_other_time(self):
+        """An identical file written at another time is kept and given the source's time."""
+        with open(self.dest, 'w') as f:
+            f.write('code,description\n1,One\n')
+        os.utime(self.dest, ns=(0, 0))
+        self.assertEqual(deploy_file(self.source, self.dest), DEPLOY_UNCHANGED)
+        self.assertEqual(os.stat(self.dest).st_mtime_ns, os.stat(self.source).st_mtime_ns)
+
+    def test_store(self):
+        """Each content gets its own version folder in the store, written once."""
+        store = os.path.join(self.folder, 'store')
+        first = store_file(self.source, store, 'lookup.csv')
+        self.assertEqual(os.path.basename(first), 'lookup.csv')
+        self.assertEqual(len(os.path.basename(os.path.dirname(first))), STORE_VERSION_LENGTH)
+        self.assertEqual(store_file(self.source, store, 'lookup.csv'), first)
+        with open(self.source, 'w') as f:
+            f.write('code,description\n1,One\n2,Two\n')
+        second = store_file(self.source, store, 'lookup.csv')
+        self.assertNotEqual(os.path.dirname(second), os.path.dirname(first))
+        with open(first) as f:
+            self.assertEqual(f.read(), 'code,description\n1,One\n')
+
+    def test_same_path(self):
+        """Paths are compared after normalisation."""
+        self.assertTrue(same_path(self.dest, os.path.join(self.folder, 'x', '..', 'dest.csv')))
+        self.assertFalse(same_path(self.dest, self.source))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DeployTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Tests for checking coded attributes against the lookup tables.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..qp_domains import DomainRule, Violation, domain_rules, multi_values, read_csv_columns, validate_rows
+from ..qp_rules import DEFAULT_RENAME_RULES, STANDARD_GP_NAME, STANDARD_SF_NAME, VALUE_RELATION_SF
+from ..qp_style import ValueRelationConfig
+
+
+class DomainsTest(unittest.TestCase):
+    """Test validating attribute values against lookup CSV columns."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.folder, 'Specific Types.csv')
+        with open(self.csv_path, 'w', encoding='utf-8-sig') as f:
+            f.write('code,description\n1,One\n2,Two\n 3 ,Three\n')
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def test_read_columns(self):
+        """Every column becomes the set of its stripped values."""
+        self.assertEqual(read_csv_columns(self.csv_path),
+                         {'code': {'1', '2', '3'}, 'description': {'One', 'Two', 'Three'}})
+
+    def test_rules(self):
+        """Only widgets of a known lookup layer and key column become rules."""
+        configs = [
+            ValueRelationConfig('type', 'l1', STANDARD_SF_NAME, 'code', 'description', '', False),
+            ValueRelationConfig('fund', 'l2', STANDARD_GP_NAME, 'code', 'description', '', False),
+            ValueRelationConfig('other', 'l1', STANDARD_SF_NAME, 'missing', 'description', '', False),
+        ]
+        rules = domain_rules(configs, {VALUE_RELATION_SF: self.csv_path}, DEFAULT_RENAME_RULES.value_relation_role)
+        self.assertEqual(rules, [DomainRule('type', frozenset({'1', '2', '3'}), False, STANDARD_SF_NAME)])
+
+    def test_multi_values(self):
+        """Both the old and the JSON-like multiple choice formats are split."""
+        self.assertEqual(multi_values('{1,3}'), ['1', '3'])
+        self.assertEqual(multi_values('{"a","b c"}'), ['a', 'b c'])
+        self.assertEqual(multi_values('{}'), [])
+
+    def test_validate(self):
+        """Values outside the domain are reported, empty values and integral floats are not."""
+        rules = [DomainRule('type', frozenset({'1', '2'}), False, 'SF'),
+                 DomainRule('kinds', frozenset({'a', 'b'}), True, 'SF')]
+        rows = [(1, [1, '{a,b}']), (2, [2.0, None]), (3, ['', '{a,c}']), (4, [7, 'a'])]
+        self.assertEqual(list(validate_rows(iter(rows), rules)),
+                         [Violation(3, 'kinds', 'c'), Violation(4, 'type', '7')])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DomainsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""Tests for the GeoPackage Value Relation lookup tables.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from ..qp_gpkg import GPKG_APPLICATION_ID, csv_lookup_gpkg, lookup_columns
+from ..qp_style import ValueRelationConfig
+
+
+class LookupGpkgTest(unittest.TestCase):
+    """Test materialising a CSV as an indexed GeoPackage table."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.csv_path = os.path.join(self.folder, 'Specific Types.csv')
+        with open(self.csv_path, 'w', encoding='utf-8-sig') as f:
+            f.write('code,description,category\n1,One,a\n2,Two\n')
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def test_table(self):
+        """Every CSV row is in the table, every column as text."""
+        gpkg_path, table = csv_lookup_gpkg(self.csv_path, ['code', 'category', 'missing'])
+        self.assertEqual(gpkg_path, os.path.join(self.folder, 'Specific Types.gpkg'))
+        self.assertEqual(table, 'Specific Types')
+        connection = sqlite3.connect(gpkg_path)
+        try:
+            self.assertEqual(connection.execute("PRAGMA application_id").fetchone()[0], GPKG_APPLICATION_ID)
+            rows = connection.execute('SELECT code, description, category FROM "Specific Types" ORDER BY fid')
+            self.assertEqual(rows.fetchall(), [('1', 'One', 'a'), ('2', 'Two', '')])
+            indexes = connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?",
+                                         (table,)).fetchall()
+            self.assertEqual(sorted(name for name, in indexes),
+                             ['idx_Specific Types_category', 'idx_Specific Types_code'])
+            contents = connection.execute("SELECT data_type FROM gpkg_contents WHERE table_name = ?", (table,))
+            self.assertEqual(contents.fetchone()[0], 'attributes')
+        finally:
+            connection.close()
+
+    def test_up_to_date(self):
+        """The GeoPackage is rewritten only when the CSV or the indexes change."""
+        gpkg_path, table = csv_lookup_gpkg(self.csv_path, ['code'])
+        before = os.stat(gpkg_path).st_ino
+        csv_lookup_gpkg(self.csv_path, ['code'])
+        self.assertEqual(os.stat(gpkg_path).st_ino, before)
+        csv_lookup_gpkg(self.csv_path, ['code', 'category'])
+        self.assertNotEqual(os.stat(gpkg_path).st_ino, before)
+
+    def test_store(self):
+        """In a store other index columns give another version folder; existing ones are left alone."""
+        store = os.path.join(self.folder, 'store')
+        first, table = csv_lookup_gpkg(self.csv_path, ['code'], store)
+        self.assertEqual(os.path.dirname(os.path.dirname(first)), store)
+        before = os.stat(first).st_mtime_ns
+        second, table = csv_lookup_gpkg(self.csv_path, ['code', 'category'], store)
+        self.assertNotEqual(os.path.dirname(first), os.path.dirname(second))
+        self.assertEqual(csv_lookup_gpkg(self.csv_path, ['code'], store)[0], first)
+        self.assertEqual(os.stat(first).st_mtime_ns, before)
+
+    def test_lookup_columns(self):
+        """Key and filter columns of the matching widgets are indexed once each."""
+        configs = [
+            ValueRelationConfig('a', 'l1', 'SF Types', 'code', 'description', '"category" = 1', False),
+            ValueRelationConfig('b', 'l1', 'SF Types', 'code', 'description', '', False),
+            ValueRelationConfig('c', 'l2', 'GP Fund', 'fund', 'description', '"year" > 2020', False),
+        ]
+        self.assertEqual(lookup_columns(configs, lambda name: name == 'SF Types'), ['code', 'category'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(LookupGpkgTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
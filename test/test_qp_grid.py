@@ -0,0 +1,59 @@
+# coding=utf-8
+"""Tests for the hash grid duplicate point detection.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import random
+import unittest
+
+from ..qp_grid import UnionFind, duplicate_clusters
+
+
+def pairwise_clusters(points, tolerance):
+    """Cluster points by comparing every pair, the reference for duplicate_clusters()."""
+    sets = UnionFind()
+    for index, (first_id, x1, y1) in enumerate(points):
+        for second_id, x2, y2 in points[index + 1:]:
+            if (x1 - x2) ** 2 + (y1 - y2) ** 2 <= tolerance ** 2:
+                sets.union(first_id, second_id)
+    clusters = {}
+    for point_id in sets.parent:
+        clusters.setdefault(sets.find(point_id), []).append(point_id)
+    return sorted((sorted(cluster) for cluster in clusters.values() if len(cluster) > 1),
+                  key=lambda cluster: cluster[0])
+
+
+class DuplicateClustersTest(unittest.TestCase):
+    """Test finding clusters of close points."""
+
+    def test_clusters(self):
+        """Chains of close points form one cluster, lone points none."""
+        points = [(1, 0.0, 0.0), (2, 0.5, 0.0), (3, 1.4, 0.0), (4, 10.0, 10.0), (5, -0.1, -0.9), (6, 10.0, 11.5)]
+        self.assertEqual(duplicate_clusters(points, 1.0), [[1, 2, 3, 5]])
+
+    def test_exact(self):
+        """With no tolerance only identical coordinates are duplicates."""
+        points = [(1, 1.0, 2.0), (2, 1.0, 2.0), (3, 1.0, 2.0000001), (4, 1.0, 2.0)]
+        self.assertEqual(duplicate_clusters(points, 0), [[1, 2, 4]])
+
+    def test_same_as_pairwise(self):
+        """The grid finds the same clusters as comparing every pair."""
+        generator = random.Random(3)
+        points = [(index, generator.uniform(-50, 50), generator.uniform(-50, 50)) for index in range(600)]
+        for tolerance in (0.5, 2.0, 7.3):
+            self.assertEqual(duplicate_clusters(points, tolerance), pairwise_clusters(points, tolerance))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(DuplicateClustersTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Tests for the results of joining points to nested polygons.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+
+from ..qp_hierarchy import NO_MATCH, HierarchyJoin
+
+
+class HierarchyJoinTest(unittest.TestCase):
+    """Test finding points outside their polygons or in inconsistent ones."""
+
+    def setUp(self):
+        """Runs before each test."""
+        parents = {'block': {10: 100, 11: 101}, 'ea': {100: 1000, 101: 1000}, 'bgy': {}}
+        self.join = HierarchyJoin(['block', 'ea', 'bgy'], parents)
+        self.join.add(1, [10, 100, 1000])  # consistent
+        self.join.add(2, [11, 100, 1000])  # block 11 is in EA 101
+        self.join.add(3, [NO_MATCH, 101, 1000])  # outside every block
+        self.join.add(4, [10, 100, NO_MATCH])  # outside every barangay
+
+    def test_outside(self):
+        """Points without a polygon of a level are listed per level."""
+        self.assertEqual(len(self.join), 4)
+        self.assertEqual(list(self.join.outside('block')), [3])
+        self.assertEqual(list(self.join.outside('ea')), [])
+        self.assertEqual(list(self.join.outside('bgy')), [4])
+
+    def test_mismatches(self):
+        """Points whose polygons do not nest are listed, outside points are not."""
+        self.assertEqual(list(self.join.mismatches('block')), [2])
+        self.assertEqual(list(self.join.mismatches('ea')), [])
+
+    def test_shared_parents(self):
+        """A join made with the parents of another sees the same nesting."""
+        join = HierarchyJoin(self.join.levels, self.join.parents)
+        join.add(5, [11, 100, 1000])
+        self.assertEqual(list(join.mismatches('block')), [5])
+
+    def test_candidates(self):
+        """A point on a shared boundary is joined to the polygons that nest, if any do."""
+        join = HierarchyJoin(self.join.levels, self.join.parents)
+        join.add_candidates(5, [[11], [100, 101], [1000]])  # on the boundary of EAs 100 and 101
+        join.add_candidates(6, [[10, 11], [101], []])  # on the boundary of blocks 10 and 11
+        join.add_candidates(7, [[10], [101], [1000]])  # no candidate agrees
+        self.assertEqual(list(join.matches['block']), [11, 11, 10])
+        self.assertEqual(list(join.matches['ea']), [101, 101, 101])
+        self.assertEqual(list(join.outside('bgy')), [6])
+        self.assertEqual(list(join.mismatches('block')), [7])
+
+    def test_compact(self):
+        """Matches are stored as 64-bit integer arrays."""
+        self.assertEqual(self.join.matches['block'].typecode, 'q')
+        self.assertEqual(self.join.matches['block'].itemsize, 8)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(HierarchyJoinTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
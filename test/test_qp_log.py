@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Tests for the QP Checker logging handlers.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..qp_log import LOGGER, PROJECT_FILTER, JsonLinesHandler, RingBufferHandler
+
+
+class LogHandlersTest(unittest.TestCase):
+    """Test the ring buffer and the JSON lines log."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.level = LOGGER.level
+        LOGGER.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        """Runs after each test."""
+        LOGGER.setLevel(self.level)
+        PROJECT_FILTER.project = None
+        shutil.rmtree(self.folder)
+
+    def test_ring_buffer(self):
+        """Only the latest records are kept."""
+        handler = RingBufferHandler(capacity=3)
+        LOGGER.addHandler(handler)
+        try:
+            for index in range(5):
+                LOGGER.debug("event %d", index)
+        finally:
+            LOGGER.removeHandler(handler)
+        self.assertEqual(handler.lines(), ['event 2', 'event 3', 'event 4'])
+
+    def test_json_lines(self):
+        """Records are written with their structured fields and project."""
+        path = os.path.join(self.folder, 'events.jsonl')
+        handler = JsonLinesHandler(path)
+        LOGGER.addHandler(handler)
+        try:
+            PROJECT_FILTER.project = 'a.qgs'
+            LOGGER.debug("Layer %r renamed to %r", 'x_ea2024', 'x_ea', extra={'event': 'rename', 'layer': 'l1'})
+        finally:
+            LOGGER.removeHandler(handler)
+            handler.close()
+        with open(path) as f:
+            entry = json.loads(f.readline())
+        self.assertEqual(entry['message'], "Layer 'x_ea2024' renamed to 'x_ea'")
+        self.assertEqual((entry['event'], entry['layer'], entry['project']), ('rename', 'l1', 'a.qgs'))
+        self.assertEqual(entry['level'], 'DEBUG')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(LogHandlersTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,81 @@
+# coding=utf-8
+"""Tests for the incremental batch manifest.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..qp_manifest import Manifest, inputs_fingerprint
+
+
+class ManifestTest(unittest.TestCase):
+    """Test that only changed projects are checked again."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.qml_folder = os.path.join(self.folder, 'qml')
+        os.mkdir(self.qml_folder)
+        self.write(os.path.join(self.qml_folder, 'form.qml'), '<qgis/>')
+        self.qgs_file = os.path.join(self.folder, 'project.qgs')
+        self.write(self.qgs_file, '<qgis/>')
+        self.manifest = Manifest.for_root(self.folder)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.manifest.close()
+        shutil.rmtree(self.folder)
+
+    def write(self, path, text):
+        """Write text to path."""
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_unchanged_project_is_current(self):
+        """A recorded project is current until it or its inputs change."""
+        inputs = inputs_fingerprint(self.qml_folder, '1.0')
+        self.assertFalse(self.manifest.is_current(self.qgs_file, inputs))
+        self.manifest.record(self.qgs_file, inputs)
+        self.assertTrue(self.manifest.is_current(self.qgs_file, inputs))
+
+        self.write(self.qgs_file, '<qgis edited="1"/>')
+        self.assertFalse(self.manifest.is_current(self.qgs_file, inputs))
+
+    def test_layer_data(self):
+        """Editing a shapefile the project reads, its .dbf included, makes the project due again."""
+        os.mkdir(os.path.join(self.folder, 'data'))
+        for extension in ('.shp', '.dbf'):
+            self.write(os.path.join(self.folder, 'data', 'sf' + extension), 'v1')
+        self.write(self.qgs_file, '<qgis><projectlayers><maplayer><datasource>./data/sf.shp</datasource>'
+                                  '</maplayer></projectlayers></qgis>')
+        inputs = inputs_fingerprint(self.qml_folder, '1.0')
+        self.manifest.record(self.qgs_file, inputs)
+        self.assertTrue(self.manifest.is_current(self.qgs_file, inputs))
+        self.write(os.path.join(self.folder, 'data', 'sf.dbf'), 'v2 with more rows')
+        self.assertFalse(self.manifest.is_current(self.qgs_file, inputs))
+
+    def test_inputs(self):
+        """Changing a QML or the plugin version changes the inputs fingerprint."""
+        inputs = inputs_fingerprint(self.qml_folder, '1.0')
+        self.assertNotEqual(inputs, inputs_fingerprint(self.qml_folder, '1.1'))
+        self.assertNotEqual(inputs, inputs_fingerprint(self.qml_folder, '1.0', ['store=/srv/vr']))
+        self.write(os.path.join(self.qml_folder, 'form.qml'), '<qgis version="2"/>')
+        self.assertNotEqual(inputs, inputs_fingerprint(self.qml_folder, '1.0'))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ManifestTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
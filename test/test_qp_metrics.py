@@ -0,0 +1,83 @@
+# coding=utf-8
+"""Tests for the stage timings and operation counters.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..qp_metrics import COUNT_RENAMES, Metrics, StageTiming, write_metrics
+
+
+class MetricsTest(unittest.TestCase):
+    """Test timing stages and counting operations."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.now = 0.0
+        self.cpu = 0.0
+        self.metrics = Metrics(clock=lambda: self.now, cpu_clock=lambda: self.cpu)
+
+    def run_stage(self, label, wall, cpu):
+        with self.metrics.stage(label):
+            self.now += wall
+            self.cpu += cpu
+
+    def test_stages(self):
+        """Every stage records its wall and CPU time, also when it raises."""
+        self.run_stage('Loading project', 2.0, 1.5)
+        with self.assertRaises(ValueError):
+            with self.metrics.stage('Renaming layers'):
+                self.now += 0.5
+                raise ValueError
+        self.assertEqual(self.metrics.stages, [StageTiming('Loading project', 2.0, 1.5),
+                                               StageTiming('Renaming layers', 0.5, 0.0)])
+        self.assertEqual(self.metrics.wall, 2.5)
+
+    def test_summary(self):
+        """The summary lists the slowest stage first, then the totals and counters."""
+        self.run_stage('Renaming layers', 0.25, 0.25)
+        self.run_stage('Loading project', 0.75, 0.5)
+        self.metrics.count(COUNT_RENAMES)
+        self.metrics.count(COUNT_RENAMES, 2)
+        self.assertEqual(self.metrics.summary().splitlines(), [
+            "Loading project: 750 ms (75%), CPU 500 ms",
+            "Renaming layers: 250 ms (25%), CPU 250 ms",
+            "Total: 1000 ms, CPU 750 ms",
+            "Layer renames: 3",
+        ])
+
+    def test_reset_and_json(self):
+        """as_dict() is plain data for JSON; reset() starts over."""
+        self.run_stage('Saving project', 1.0, 0.5)
+        self.metrics.count(COUNT_RENAMES)
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'metrics.json')
+            write_metrics(path, self.metrics.as_dict())
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(json.load(f), {
+                    'wall': 1.0, 'cpu': 0.5, 'counters': {COUNT_RENAMES: 1},
+                    'stages': [{'label': 'Saving project', 'wall': 1.0, 'cpu': 0.5}]})
+        finally:
+            shutil.rmtree(folder)
+        self.metrics.reset()
+        self.assertEqual(self.metrics.as_dict(), {'wall': 0, 'cpu': 0, 'stages': [], 'counters': {}})
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(MetricsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,75 @@
+# coding=utf-8
+"""Tests for the progress reporter.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import logging
+import unittest
+
+from ..qp_log import RingBufferHandler
+from ..qp_progress import ProgressReporter, log_progress
+
+
+class ProgressReporterTest(unittest.TestCase):
+    """Test stage weights and throttling."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.now = 0.0
+        self.updates = []
+        self.progress = ProgressReporter([lambda percent, label: self.updates.append((percent, label))],
+                                         max_rate=20, clock=lambda: self.now)
+
+    def test_weights(self):
+        """A stage moves the progress within its share of the run."""
+        self.progress.start([('a', 1), ('b', 3)])
+        self.progress.begin_stage(1)
+        self.now = 1.0
+        self.progress.update(1, 2)
+        self.assertEqual(self.updates[-1], (62.5, 'b'))
+        self.progress.finish()
+        self.assertEqual(self.updates[-1][0], 100.0)
+
+    def test_throttle(self):
+        """Updates closer together than 1/max_rate are not passed on."""
+        self.progress.start([('a', 1)])
+        self.progress.begin_stage(0)
+        for step in range(1000):
+            self.now += 0.001
+            self.progress.update(step, 1000)
+        self.assertLessEqual(len(self.updates), 2 + 20)
+        self.progress.finish()
+        self.assertEqual(self.updates[-1][0], 100.0)
+
+    def test_log_sink(self):
+        """The log sink writes the progress as INFO records with the percentage and stage as fields."""
+        logger = logging.getLogger('qp_checker.test_progress')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RingBufferHandler()
+        logger.addHandler(handler)
+        try:
+            self.progress.sinks = [log_progress(logger)]
+            self.progress.start([('Loading project', 1)])
+            self.progress.begin_stage(0)
+        finally:
+            logger.removeHandler(handler)
+        record = handler.records[-1]
+        self.assertEqual(record.getMessage(), "progress 0.0% Loading project")
+        self.assertEqual((record.levelno, record.event, record.percent, record.stage),
+                         (logging.INFO, 'progress', 0.0, 'Loading project'))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ProgressReporterTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,82 @@
+# coding=utf-8
+"""Tests for reading and writing project files without QGIS.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from ..qp_project_io import project_xml_equal, read_project_xml, write_project_xml
+
+
+class ProjectIOTest(unittest.TestCase):
+    """Test the .qgz rewrite."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.qgz_file = os.path.join(self.folder, 'project.qgz')
+        with zipfile.ZipFile(self.qgz_file, 'w') as archive:
+            archive.writestr('project.qgs', b'<qgis/>', compress_type=zipfile.ZIP_DEFLATED)
+            archive.writestr('project.qgd', b'auxiliary' * 1000, compress_type=zipfile.ZIP_DEFLATED)
+            archive.writestr('notes.txt', b'stored', compress_type=zipfile.ZIP_STORED)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def test_read(self):
+        """Only the project member is returned."""
+        self.assertEqual(read_project_xml(self.qgz_file), b'<qgis/>')
+
+    def test_write_qgz(self):
+        """The project member is replaced, the others are copied unchanged."""
+        with zipfile.ZipFile(self.qgz_file) as archive:
+            before = {info.filename: (info.CRC, info.compress_size, info.compress_type)
+                      for info in archive.infolist()}
+
+        write_project_xml(self.qgz_file, b'<qgis checked="1"/>')
+
+        with zipfile.ZipFile(self.qgz_file) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read('project.qgs'), b'<qgis checked="1"/>')
+            self.assertEqual(archive.read('project.qgd'), b'auxiliary' * 1000)
+            for info in archive.infolist():
+                if info.filename != 'project.qgs':
+                    self.assertEqual((info.CRC, info.compress_size, info.compress_type),
+                                     before[info.filename])
+            self.assertEqual(archive.getinfo('project.qgs').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(os.listdir(self.folder), ['project.qgz'])
+
+    def test_write_qgs(self):
+        """A .qgs is replaced without leaving the temporary file behind."""
+        qgs_file = os.path.join(self.folder, 'project.qgs')
+        write_project_xml(qgs_file, b'<qgis/>')
+        write_project_xml(qgs_file, b'<qgis checked="1"/>')
+        self.assertEqual(read_project_xml(qgs_file), b'<qgis checked="1"/>')
+        self.assertEqual(sorted(os.listdir(self.folder)), ['project.qgs', 'project.qgz'])
+
+    def test_xml_equal(self):
+        """Only the save stamp of the root element is ignored."""
+        first = b'<?xml version="1.0"?>\n<qgis saveDateTime="2024-01-01" saveUser="a"><title/></qgis>'
+        second = b'<qgis saveDateTime="2024-10-17" saveUser="b"><title/></qgis>'
+        self.assertTrue(project_xml_equal(first, second))
+        self.assertFalse(project_xml_equal(first, b'<qgis saveDateTime="2024-10-17"><title>x</title></qgis>'))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ProjectIOTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
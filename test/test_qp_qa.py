@@ -0,0 +1,136 @@
+# coding=utf-8
+"""Tests for the spatial QA of the base layers.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+
+from qgis.core import QgsCoordinateTransformContext, QgsFeature, QgsFeedback, QgsGeometry, QgsPointXY, QgsVectorLayer
+
+from ..qp_domains import DomainRule, Violation
+from ..qp_hierarchy import NO_MATCH
+from ..qp_qa import (
+    PolygonLocator, attribute_violations, duplicate_points, join_points, layer_source, polygon_parents)
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+def memory_layer(geometry_type, wkts):
+    """Return a memory layer in EPSG:3857 with one feature per WKT."""
+    layer = QgsVectorLayer(f'{geometry_type}?crs=EPSG:3857', geometry_type, 'memory')
+    features = []
+    for wkt in wkts:
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def square(x, y, size):
+    """Return the WKT of a square polygon."""
+    return f'POLYGON(({x} {y}, {x + size} {y}, {x + size} {y + size}, {x} {y + size}, {x} {y}))'
+
+
+class ContainmentTest(unittest.TestCase):
+    """Test locating points in nested polygon layers."""
+
+    def setUp(self):
+        """Runs before each test."""
+        # Two blocks in EA 1, a third block mostly in EA 2 that reaches into EA 1
+        self.blocks = memory_layer('Polygon', [square(0, 0, 10), square(10, 0, 10),
+                                               'POLYGON((20 0, 45 0, 45 10, 20 10, 20 0))'])
+        self.eas = memory_layer('Polygon', [square(0, 0, 25), square(25, 0, 25)])
+        self.bgys = memory_layer('Polygon', [square(0, 0, 100)])
+        # The last point lies on the boundary of the two EAs, in block 3
+        self.points = memory_layer('Point', ['POINT(5 5)', 'POINT(15 5)', 'POINT(22 22)', 'POINT(23 5)',
+                                             'POINT(200 200)', 'POINT(25 5)'])
+
+    def locators(self):
+        """Return the locators of the block, EA and barangay layers."""
+        context = QgsCoordinateTransformContext()
+        return [(level, PolygonLocator(layer_source(layer), context))
+                for level, layer in (('block', self.blocks), ('ea', self.eas), ('bgy', self.bgys))]
+
+    def test_locate(self):
+        """Points are matched to the polygon containing them, boundaries included."""
+        locator = PolygonLocator(layer_source(self.blocks), QgsCoordinateTransformContext())
+        crs = self.points.crs()
+        self.assertEqual(locator.locate(QgsPointXY(5, 5), crs), 1)
+        self.assertIn(locator.locate(QgsPointXY(10, 5), crs), (1, 2))
+        self.assertEqual(locator.locate(QgsPointXY(50, 5), crs), NO_MATCH)
+        self.assertEqual(sorted(locator.locate_all(QgsPointXY(10, 5), crs)), [1, 2])
+
+    def test_join(self):
+        """Points outside a level or in polygons that do not nest are found."""
+        locators = self.locators()
+        parents = polygon_parents(locators)
+        self.assertEqual(parents['bgy'], {})
+        join = join_points(layer_source(self.points), locators, parents)
+        self.assertEqual(len(join), 6)
+        self.assertEqual(list(join.outside('block')), [3, 5])
+        self.assertEqual(list(join.outside('bgy')), [5])
+        self.assertEqual(list(join.mismatches('block')), [4])  # block 3 lies in EA 2
+        self.assertEqual(join.parents['block'][3], 2)
+        self.assertEqual(join.matches['ea'][5], 2)  # the EA of its block, of the two it touches
+
+
+    def test_cancel(self):
+        """A cancelled join stops reading points."""
+        feedback = QgsFeedback()
+        feedback.cancel()
+        locators = self.locators()
+        join = join_points(layer_source(self.points), locators, polygon_parents(locators), feedback=feedback)
+        self.assertEqual(len(join), 0)
+
+
+class DuplicatePointsTest(unittest.TestCase):
+    """Test finding duplicate points in metres whatever the layer CRS."""
+
+    def test_geographic(self):
+        """Degrees are converted to metres before comparing with the tolerance."""
+        layer = QgsVectorLayer('Point?crs=EPSG:4326', 'sf', 'memory')
+        features = []
+        for wkt in ('POINT(121.0 14.6)', 'POINT(121.000005 14.6)', 'POINT(121.0001 14.6)'):
+            feature = QgsFeature()
+            feature.setGeometry(QgsGeometry.fromWkt(wkt))
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        # 0.000005 degrees of longitude is about half a metre, 0.0001 about 11 metres
+        self.assertEqual(duplicate_points(layer_source(layer), 1.0), [[1, 2]])
+
+
+class AttributeViolationsTest(unittest.TestCase):
+    """Test streaming the coded attributes of a layer."""
+
+    def test_violations(self):
+        """Codes outside the domain are reported; rules on missing fields are skipped."""
+        layer = QgsVectorLayer('Point?crs=EPSG:3857&field=name:string&field=type:integer', 'sf', 'memory')
+        features = []
+        for name, code in (('a', 1), ('b', 5), ('c', None)):
+            feature = QgsFeature(layer.fields())
+            feature.setAttributes([name, code])
+            feature.setGeometry(QgsGeometry.fromWkt('POINT(0 0)'))
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        rules = [DomainRule('type', frozenset({'1', '2'}), False, 'SF'),
+                 DomainRule('missing', frozenset(), False, 'SF')]
+        fid = [feature.id() for feature in layer.getFeatures()][1]
+        self.assertEqual(list(attribute_violations(layer_source(layer), rules)), [Violation(fid, 'type', '5')])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(ContainmentTest), unittest.makeSuite(DuplicatePointsTest),
+                                unittest.makeSuite(AttributeViolationsTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
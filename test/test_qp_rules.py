@@ -0,0 +1,201 @@
+# coding=utf-8
+"""Tests for the QP Checker naming and ordering rules.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import csv
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..qp_rules import (
+    RENAME_BASE_LAYER_ID, RENAME_FORM_LAYER, RENAME_SUFFIX, RENAME_VALUE_RELATION,
+    RULES_FILE_NAME, STANDARD_GP_NAME, STANDARD_SF_NAME, SUFFIXES_TO_RENAME, NameIndex,
+    RenamePlan, RenameRules, arranged_base_layers, base_layer_name, find_eight_digit_id,
+    form_layer_name, plan_layer_renames, plan_value_relation_renames, reorder_moves, tree_key,
+    write_rename_report)
+
+
+def linear_suffix_name(name, suffixes):
+    """The rename rule as a plain scan of the table, to compare against."""
+    for suffix, new_suffix in suffixes.items():
+        if suffix in name and not name.endswith(new_suffix):
+            return name.split(suffix)[0] + new_suffix
+    return None
+
+
+class QPRulesTest(unittest.TestCase):
+    """Test the rules shared by the QGIS and XML engines."""
+
+    def test_eight_digit_id(self):
+        """The identifier comes from the first SF layer."""
+        names = ['12345_road', '12345678_SF.shp', '87654321_SF']
+        self.assertEqual(find_eight_digit_id(names), '12345678')
+        self.assertIsNone(find_eight_digit_id(['12345_road']))
+
+    def test_base_layer_name(self):
+        """The 5-digit identifier is replaced unless 8 digits are present."""
+        self.assertEqual(base_layer_name('12345_road', '12345678'), '12345678_road')
+        self.assertIsNone(base_layer_name('12345678_road', '12345678'))
+        self.assertIsNone(base_layer_name('12345_road', None))
+
+    def test_suffix_name(self):
+        """Suffixes are normalised in the order of the rule table."""
+        suffix_name = RenameRules().suffix_name
+        self.assertEqual(suffix_name('12345678_bldg_points'), '12345678_bldgpts')
+        self.assertEqual(suffix_name('12345678_ea2024'), '12345678_ea')
+        self.assertEqual(suffix_name('12345678_road_updated'), '12345678_road')
+        self.assertEqual(suffix_name('12345678_Block'), '12345678_block')
+        self.assertIsNone(suffix_name('12345678_road'))
+        self.assertIsNone(suffix_name('12345678_bldgpts'))
+
+    def test_form_layer_name(self):
+        """Shapefile names of the form layers lose their extension."""
+        self.assertEqual(form_layer_name('x_SF.shp', '12345678'), '12345678_SF')
+        self.assertEqual(form_layer_name('x_GP.shp', '12345678'), '12345678_GP')
+        self.assertIsNone(form_layer_name('12345678_SF', '12345678'))
+
+    def test_standard_value_relation_name(self):
+        """Spelling variants map to the standard Value Relation names."""
+        standard_value_relation_name = RenameRules().standard_value_relation_name
+        self.assertEqual(standard_value_relation_name('2024_POPCEN_CBMS_SF_Specific_Types'),
+                         STANDARD_SF_NAME)
+        self.assertEqual(standard_value_relation_name('2024-POPCEN-CBMS-GP-Fund'),
+                         STANDARD_GP_NAME)
+        self.assertIsNone(standard_value_relation_name('something else'))
+
+    def test_tree_key(self):
+        """Group spellings differing in case and spacing share a key."""
+        self.assertEqual(tree_key('Value Relations '), tree_key('value  relations'))
+        self.assertEqual(tree_key('Base Layers'), tree_key('BASE LAYERS'))
+        self.assertNotEqual(tree_key('Base Layer'), tree_key('Base Layers'))
+
+    def test_value_relation_spellings(self):
+        """Any mix of case, spaces, '_' and '-' maps to the standard name."""
+        standard_value_relation_name = RenameRules().standard_value_relation_name
+        for name in ('2024 POPCEN-CBMS SF Specific Types ', '2024_popcen_cbms_sf_specific_types',
+                     ' 2024--POPCEN  CBMS_SF-Specific Types'):
+            self.assertEqual(standard_value_relation_name(name), STANDARD_SF_NAME, name)
+        self.assertIsNone(standard_value_relation_name('2024 POPCEN-CBMS SF Specific'))
+
+    def test_arranged_base_layers(self):
+        """Known base layers go on top in order, the rest keeps its order."""
+        names = ['x_bgy', 'other', None, 'x_river', 'x_bldgpts', 'x_road', 'other']
+        self.assertEqual(arranged_base_layers(names), [4, 0, 5, 3, 1, 2, 6])
+
+    def test_reorder_moves(self):
+        """Children already in relative order stay, the others move once."""
+        order = [4, 0, 5, 3, 1, 2, 6]
+        children = list(range(len(order)))
+        moves = reorder_moves(order)
+        for index, anchor in moves:
+            children.remove(index)
+            children.insert(0 if anchor is None else children.index(anchor) + 1, index)
+        self.assertEqual(children, order)
+        self.assertEqual(len(moves), 3)  # 0, 1, 2, 6 stay
+
+
+class RenameRulesTest(unittest.TestCase):
+    """Test the compiled rename rules."""
+
+    def test_same_as_linear_scan(self):
+        """The compiled matcher picks the same rule as scanning the table."""
+        parts = list(SUFFIXES_TO_RENAME) + list(SUFFIXES_TO_RENAME.values()) + ['12345_', '_', 'pts', 'x']
+        rules = RenameRules()
+        for count in range(4):
+            for combination in itertools.product(parts, repeat=count):
+                name = ''.join(combination)
+                self.assertEqual(rules.suffix_name(name),
+                                 linear_suffix_name(name, SUFFIXES_TO_RENAME), name)
+
+    def test_from_file(self):
+        """A rules file in the QML folder replaces the built-in table."""
+        folder = tempfile.mkdtemp()
+        try:
+            self.assertEqual(RenameRules.for_folder(folder).suffixes, SUFFIXES_TO_RENAME)
+            with open(os.path.join(folder, RULES_FILE_NAME), 'w') as f:
+                json.dump({'suffixes': {'lm': 'landmark', 'landmarks': 'landmark'}}, f)
+            rules = RenameRules.for_folder(folder)
+            self.assertEqual(rules.suffix_name('12345678_lm'), '12345678_landmark')
+            self.assertIsNone(rules.suffix_name('12345678_road_updated'))
+            with open(os.path.join(folder, RULES_FILE_NAME), 'w') as f:
+                json.dump({'suffixes': ['lm']}, f)
+            self.assertRaises(ValueError, RenameRules.for_folder, folder)
+            with open(os.path.join(folder, RULES_FILE_NAME), 'w') as f:
+                json.dump({'value_relations': {'sf': '2025 CBMS SF Specific Types'}}, f)
+            rules = RenameRules.for_folder(folder)
+            self.assertEqual(rules.standard_value_relation_name('2025_CBMS_SF_SPECIFIC_TYPES'),
+                             '2025 CBMS SF Specific Types')
+            self.assertIsNone(rules.standard_value_relation_name(STANDARD_SF_NAME))
+            self.assertEqual(rules.standard_value_relation_name('2024-POPCEN-CBMS-GP-Fund'), STANDARD_GP_NAME)
+            self.assertEqual(rules.suffixes, SUFFIXES_TO_RENAME)
+            with open(os.path.join(folder, RULES_FILE_NAME), 'w') as f:
+                json.dump({'value_relations': {'xx': 'Other'}}, f)
+            self.assertRaises(ValueError, RenameRules.for_folder, folder)
+        finally:
+            shutil.rmtree(folder)
+
+    def test_name_index(self):
+        """The index follows renames and counts duplicate names."""
+        names = NameIndex(['a', 'a', 'b'])
+        names.rename('a', 'c')
+        self.assertIn('a', names)
+        self.assertIn('c', names)
+        names.rename('a', 'd')
+        self.assertNotIn('a', names)
+
+
+class RenamePlanTest(unittest.TestCase):
+    """Test planning the renames of a project."""
+
+    def test_plan(self):
+        """Steps record the reason, later rules see earlier renames."""
+        plan = RenamePlan({'a': '12345678_SF.shp', 'b': '12345678_SF', 'c': '12345_road_updated',
+                           'd': 'x_GP.shp', 'v': '2024_POPCEN_CBMS_GP_Fund'})
+        plan_layer_renames(plan, ['c'], RenameRules())
+        plan_value_relation_renames(plan, ['v'])
+        self.assertEqual([(step.layer_id, step.new_name, step.reason) for step in plan], [
+            ('c', '12345678_road_updated', RENAME_BASE_LAYER_ID),
+            ('c', '12345678_road', RENAME_SUFFIX),
+            ('d', '12345678_GP', RENAME_FORM_LAYER),
+            ('v', STANDARD_GP_NAME, RENAME_VALUE_RELATION),
+        ])
+        self.assertEqual(plan.final_names(), {'c': '12345678_road', 'd': '12345678_GP', 'v': STANDARD_GP_NAME})
+        self.assertEqual(plan.final_names(plan.steps[:1]), {'c': '12345678_road'})
+
+    def test_report(self):
+        """The dry-run report has a row per step, stamped with its project."""
+        plan = RenamePlan({'a': '12345678_SF', 'c': '12345_road_updated'})
+        plan_layer_renames(plan, ['c'], RenameRules())
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'renames.csv')
+            write_rename_report(path, (('a.qgs', step) for step in plan))
+            with open(path, newline='', encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual(rows, [
+            ['project', 'layer_id', 'old_name', 'new_name', 'reason'],
+            ['a.qgs', 'c', '12345_road_updated', '12345678_road_updated', RENAME_BASE_LAYER_ID],
+            ['a.qgs', 'c', '12345678_road_updated', '12345678_road', RENAME_SUFFIX],
+        ])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(QPRulesTest), unittest.makeSuite(RenameRulesTest),
+                                unittest.makeSuite(RenamePlanTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
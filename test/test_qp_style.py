@@ -0,0 +1,100 @@
+# coding=utf-8
+"""Tests for the layer style fingerprints.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+import xml.etree.ElementTree as ET
+
+from ..qp_style import expression_columns, has_style, qml_style, value_relation_configs
+
+QML = """<qgis version="3.34.0" styleCategories="AllStyleCategories" readOnly="0">
+  <renderer-v2 type="categorizedSymbol" attr="code"/>
+  <aliases><alias field="code" name="Code"/></aliases>
+  <layerGeometryType>0</layerGeometryType>
+</qgis>
+"""
+
+VALUE_RELATION_QML = """<qgis version="3.34.0">
+  <fieldConfiguration>
+    <field name="type" configurationFlags="None">
+      <editWidget type="ValueRelation">
+        <config>
+          <Option type="Map">
+            <Option name="AllowMulti" type="bool" value="true"/>
+            <Option name="FilterExpression" type="QString" value="&quot;category&quot; = current_value('cat') AND &quot;x &quot;&quot;y&quot; = 1"/>
+            <Option name="Key" type="QString" value="code"/>
+            <Option name="Layer" type="QString" value="sf_types_1"/>
+            <Option name="LayerName" type="QString" value="2024 POPCEN-CBMS SF Specific Types"/>
+            <Option name="Value" type="QString" value="description"/>
+          </Option>
+        </config>
+      </editWidget>
+    </field>
+    <field name="remarks" configurationFlags="None">
+      <editWidget type="TextEdit"><config><Option/></config></editWidget>
+    </field>
+  </fieldConfiguration>
+</qgis>
+"""
+
+
+class StyleFingerprintTest(unittest.TestCase):
+    """Test comparing a layer with a QML style."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.style = qml_style(ET.fromstring(QML))
+
+    def test_tags(self):
+        """Only the layer properties of the QML are compared."""
+        self.assertEqual(self.style.tags, ['renderer-v2', 'aliases'])
+        self.assertEqual(self.style.attributes, ['readOnly'])
+
+    def test_same_style(self):
+        """Attribute order, whitespace and other elements do not matter."""
+        layer = ET.fromstring(
+            '<maplayer readOnly="0" type="vector"><id>sf</id>'
+            '<aliases>\n  <alias name="Code" field="code"/>\n</aliases>'
+            '<renderer-v2 attr="code" type="categorizedSymbol"></renderer-v2></maplayer>')
+        self.assertTrue(has_style(layer, self.style))
+
+    def test_different_style(self):
+        """A changed element or layer property makes the layer differ."""
+        layer = ET.fromstring(
+            '<maplayer readOnly="0"><aliases><alias field="code" name="Code"/></aliases>'
+            '<renderer-v2 type="singleSymbol" attr="code"/></maplayer>')
+        self.assertFalse(has_style(layer, self.style))
+        layer = ET.fromstring(
+            '<maplayer readOnly="1"><aliases><alias field="code" name="Code"/></aliases>'
+            '<renderer-v2 type="categorizedSymbol" attr="code"/></maplayer>')
+        self.assertFalse(has_style(layer, self.style))
+
+
+class ValueRelationConfigTest(unittest.TestCase):
+    """Test reading the ValueRelation widgets of a QML."""
+
+    def test_configs(self):
+        """Only ValueRelation widgets are returned, with their options."""
+        [config] = value_relation_configs(ET.fromstring(VALUE_RELATION_QML))
+        self.assertEqual(config.field, 'type')
+        self.assertEqual(config.layer_name, '2024 POPCEN-CBMS SF Specific Types')
+        self.assertEqual((config.key, config.value), ('code', 'description'))
+        self.assertTrue(config.allow_multi)
+        self.assertEqual(expression_columns(config.filter_expression), ['category', 'x "y'])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(StyleFingerprintTest),
+                                unittest.makeSuite(ValueRelationConfigTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
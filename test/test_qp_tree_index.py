@@ -0,0 +1,71 @@
+# coding=utf-8
+"""Tests for the layer tree index.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import unittest
+
+from qgis.core import QgsLayerTreeGroup, QgsVectorLayer
+
+from ..qp_rules import BASE_LAYER_GROUP_NAMES, VALUE_RELATION_GROUP_NAMES
+from ..qp_tree_index import LayerTreeIndex
+from .utilities import get_qgis_app
+
+QGIS_APP = get_qgis_app()
+
+
+class LayerTreeIndexTest(unittest.TestCase):
+    """Test lookups on a small layer tree and that they follow changes."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.root = QgsLayerTreeGroup()
+        self.form = self.root.addGroup('Form 8A')
+        self.base = self.root.addGroup('base layers')
+        self.value_relations = self.form.addGroup('Value Relations ')
+        self.layer = QgsVectorLayer('Point', '12345_road', 'memory')
+        self.base.addLayer(self.layer)
+        self.index = LayerTreeIndex(self.root)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.index.close()
+
+    def test_groups(self):
+        """Groups are found by any spelling variant, nested or not."""
+        self.assertIs(self.index.group(BASE_LAYER_GROUP_NAMES), self.base)
+        self.assertIs(self.index.group(VALUE_RELATION_GROUP_NAMES), self.value_relations)
+        self.assertIsNone(self.index.group(['Missing']))
+        self.assertIs(self.index.top_group_containing('Form 8'), self.form)
+
+    def test_layers(self):
+        """The layers below a group are listed like findLayers(), nested groups included."""
+        [node] = self.index.layers(self.index.group(BASE_LAYER_GROUP_NAMES))
+        self.assertIs(node.layer(), self.layer)
+        nested = self.value_relations.addLayer(QgsVectorLayer('Point', 'lookup', 'memory'))
+        self.assertEqual([node.name() for node in self.index.layers(self.form)], [nested.name()])
+        self.assertEqual(self.index.layers(self.root.addGroup('Empty')), [])
+
+    def test_follows_changes(self):
+        """Added, removed and renamed nodes are seen by the next lookup."""
+        self.base.setName('Other')
+        self.assertIsNone(self.index.group(BASE_LAYER_GROUP_NAMES))
+        added = self.root.addGroup('Base Layers')
+        self.assertIs(self.index.group(BASE_LAYER_GROUP_NAMES), added)
+        added.addLayer(QgsVectorLayer('Point', '12345_river', 'memory'))
+        self.assertEqual([node.name() for node in self.index.layers(added)], ['12345_river'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(LayerTreeIndexTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
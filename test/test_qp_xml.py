@@ -0,0 +1,199 @@
+# coding=utf-8
+"""Tests for the pure-XML engine of the QP Checker.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'test@gmail.com'
+__date__ = '2024-10-17'
+__copyright__ = 'Copyright 2024, PSA'
+
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+from ..qp_metrics import (
+    COUNT_BYTES_CLONED, COUNT_BYTES_COPIED, COUNT_RENAMES, COUNT_SOURCE_CHANGES, COUNT_STYLES, METRICS)
+from ..qp_rules import (
+    GP_CSV_DEST_NAME, GP_CSV_SOURCE_NAME, GP_QML_NAME, SF_CSV_DEST_NAME, SF_CSV_SOURCE_NAME,
+    SF_QML_NAME)
+from ..qp_style import has_style, load_qml_style
+from ..qp_xml import XmlProjectChecker
+
+QML = """<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>
+<qgis version="3.34.0" styleCategories="AllStyleCategories" readOnly="0">
+  <renderer-v2 type="categorizedSymbol"/>
+  <editform tolerant="1"/>
+  <layerGeometryType>0</layerGeometryType>
+</qgis>
+"""
+
+LAYERS = [
+    ('sf', 'Form 8', '12345678_SF.shp'),
+    ('gp', 'Form 8', '12345678_GP.shp'),
+    ('b1', 'Base Layers', '12345_bldg_points'),
+    ('b2', 'Base Layers', '12345_river_updated'),
+    ('b3', 'Base Layers', '12345_road'),
+    ('b4', 'Base Layers', '12345_ea2024'),
+    ('v1', 'Value Relations', '2024_POPCEN_CBMS_SF_Specific_Types'),
+    ('v2', 'Value Relations', '2024-POPCEN-CBMS-GP-Fund'),
+]
+
+
+def project_xml():
+    """Return the XML of a small QP project."""
+    groups = {}
+    for layer_id, group, name in LAYERS:
+        groups.setdefault(group, []).append(
+            f'<layer-tree-layer id="{layer_id}" name="{name}" source="./old" providerKey="ogr"/>')
+    tree = ''.join(f'<layer-tree-group name="{group}">{"".join(nodes)}</layer-tree-group>'
+                   for group, nodes in groups.items())
+    layers = ''.join(
+        f'<maplayer type="vector"><id>{layer_id}</id><datasource>./old</datasource>'
+        f'<layername>{name}</layername><provider>ogr</provider><renderer-v2 type="old"/></maplayer>'
+        for layer_id, _, name in LAYERS)
+    return ("<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>\n"
+            f'<qgis version="3.34.0"><layer-tree-group>{tree}</layer-tree-group>'
+            f'<projectlayers>{layers}</projectlayers></qgis>\n')
+
+
+class XmlProjectCheckerTest(unittest.TestCase):
+    """Test the XML engine on a project written to a temporary folder."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.folder = tempfile.mkdtemp()
+        self.qml_folder = os.path.join(self.folder, 'qml')
+        os.mkdir(self.qml_folder)
+        for name in (SF_QML_NAME, GP_QML_NAME):
+            with open(os.path.join(self.qml_folder, name), 'w') as f:
+                f.write(QML)
+        for name in (SF_CSV_SOURCE_NAME, GP_CSV_SOURCE_NAME):
+            with open(os.path.join(self.qml_folder, name), 'w') as f:
+                f.write('code,description\n1,One\n')
+        self.qgs_file = os.path.join(self.folder, 'project.qgs')
+        with open(self.qgs_file, 'w') as f:
+            f.write(project_xml())
+
+        self.checker = XmlProjectChecker()
+        self.checker.set_qml_folder(self.qml_folder)
+        self.assertTrue(self.checker.check_project(self.qgs_file, save=True))
+        self.root = ET.parse(self.qgs_file).getroot()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.folder)
+
+    def maplayer(self, layer_id):
+        """Return the saved maplayer element of layer_id."""
+        return next(maplayer for maplayer in self.root.iter('maplayer')
+                    if maplayer.findtext('id') == layer_id)
+
+    def test_rename(self):
+        """Layers are renamed in the layer list and in the layer tree."""
+        self.assertEqual(self.maplayer('sf').findtext('layername'), '12345678_SF')
+        self.assertEqual(self.maplayer('b1').findtext('layername'), '12345678_bldgpts')
+        self.assertEqual(self.maplayer('v2').findtext('layername'), '2024 POPCEN-CBMS GP Fund')
+        node = next(node for node in self.root.iter('layer-tree-layer') if node.get('id') == 'b4')
+        self.assertEqual(node.get('name'), '12345678_ea')
+
+    def test_arrange(self):
+        """Base layers are ordered building points first, river last."""
+        group = next(group for group in self.root.iter('layer-tree-group')
+                     if group.get('name') == 'Base Layers')
+        self.assertEqual([node.get('id') for node in group], ['b1', 'b4', 'b3', 'b2'])
+
+    def test_styles(self):
+        """The QML is embedded into the SF and GP layers only."""
+        self.assertEqual(self.maplayer('sf').find('renderer-v2').get('type'), 'categorizedSymbol')
+        self.assertIsNotNone(self.maplayer('gp').find('editform'))
+        self.assertIsNone(self.maplayer('gp').find('layerGeometryType'))
+        self.assertEqual(self.maplayer('b1').find('renderer-v2').get('type'), 'old')
+        qml_file = os.path.join(self.qml_folder, SF_QML_NAME)
+        self.assertTrue(has_style(self.maplayer('sf'), load_qml_style(qml_file)))
+        self.assertFalse(has_style(self.maplayer('b1'), load_qml_style(qml_file)))
+
+    def test_sources(self):
+        """Value Relation layers point at the CSVs copied next to the project."""
+        self.assertTrue(os.path.exists(os.path.join(self.folder, SF_CSV_DEST_NAME)))
+        self.assertEqual(self.maplayer('v1').findtext('datasource'), './' + SF_CSV_DEST_NAME)
+        self.assertEqual(self.maplayer('v2').findtext('datasource'), './' + GP_CSV_DEST_NAME)
+
+    def test_prolog(self):
+        """The DOCTYPE of the project is kept."""
+        with open(self.qgs_file) as f:
+            self.assertTrue(f.read().startswith('<!DOCTYPE qgis'))
+
+    def test_unchanged_not_saved(self):
+        """A second check changes nothing, so the file is not rewritten."""
+        self.assertTrue(self.checker.project_changed)
+        before = os.stat(self.qgs_file).st_mtime_ns
+        self.assertTrue(self.checker.check_project(self.qgs_file, save=True))
+        self.assertFalse(self.checker.project_changed)
+        self.assertEqual(os.stat(self.qgs_file).st_mtime_ns, before)
+
+    def test_metrics(self):
+        """Every stage is timed and the changes made are counted."""
+        self.assertEqual([stage.label for stage in METRICS.stages], [
+            "Loading project", "Renaming layers", "Renaming Value Relation layers", "Applying styles",
+            "Arranging base layers", "Updating Value Relation sources", "Saving project"])
+        counters = METRICS.counters
+        self.assertEqual(counters[COUNT_STYLES], 2)
+        self.assertEqual(counters[COUNT_SOURCE_CHANGES], 2)
+        self.assertGreater(counters[COUNT_RENAMES], 0)
+        self.assertEqual(counters.get(COUNT_BYTES_COPIED, 0) + counters.get(COUNT_BYTES_CLONED, 0),
+                         2 * len('code,description\n1,One\n'))
+
+    def test_value_relation_store(self):
+        """With a store the layers point at its version folders by relative paths."""
+        with open(self.qgs_file, 'w') as f:
+            f.write(project_xml())
+        self.checker.value_relation_store = os.path.join(self.folder, 'store')
+        self.assertTrue(self.checker.check_project(self.qgs_file, save=True))
+        root = ET.parse(self.qgs_file).getroot()
+        source = next(maplayer.findtext('datasource') for maplayer in root.iter('maplayer')
+                      if maplayer.findtext('id') == 'v1')
+        self.assertTrue(source.startswith('./store/'), source)
+        self.assertTrue(os.path.exists(os.path.join(self.folder, source)))
+
+    def test_gpkg_lookups(self):
+        """With GeoPackage lookups the layers point at a table next to the CSV."""
+        with open(self.qgs_file, 'w') as f:
+            f.write(project_xml())
+        self.checker.value_relation_gpkg = True
+        self.assertTrue(self.checker.check_project(self.qgs_file, save=True))
+        self.root = ET.parse(self.qgs_file).getroot()
+        stem = os.path.splitext(SF_CSV_DEST_NAME)[0]
+        self.assertEqual(self.maplayer('v1').findtext('datasource'), f'./{stem}.gpkg|layername={stem}')
+        self.assertTrue(os.path.exists(os.path.join(self.folder, stem + '.gpkg')))
+
+    def test_group_spelling(self):
+        """Groups are found whatever their case and spacing."""
+        with open(self.qgs_file, 'w') as f:
+            f.write(project_xml().replace('name="Base Layers"', 'name="BASE  LAYERS "'))
+        self.assertTrue(self.checker.check_project(self.qgs_file, save=True))
+        root = ET.parse(self.qgs_file).getroot()
+        group = next(group for group in root.iter('layer-tree-group') if group.get('name') == 'BASE  LAYERS ')
+        self.assertEqual([node.get('id') for node in group], ['b1', 'b4', 'b3', 'b2'])
+
+    def test_dry_run(self):
+        """A dry run plans the renames without touching the project."""
+        with open(self.qgs_file, 'w') as f:
+            f.write(project_xml())
+        before = os.stat(self.qgs_file).st_mtime_ns
+        self.checker.dry_run = True
+        self.assertTrue(self.checker.check_project(self.qgs_file, save=True))
+        self.assertIn(('sf', '12345678_SF'), [(step.layer_id, step.new_name) for step in self.checker.rename_plan])
+        self.assertEqual(os.stat(self.qgs_file).st_mtime_ns, before)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(XmlProjectCheckerTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)